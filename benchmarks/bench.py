@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for the token issuance path.
+
+    python benchmarks/bench.py run --output baseline.json
+    python benchmarks/bench.py run --output current.json
+    python benchmarks/bench.py compare baseline.json current.json --threshold 10
+
+``compare`` exits with status 1 when any case is more than ``--threshold``
+percent slower than the baseline. Baselines are only comparable when taken
+on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "example")
+sys.path.insert(0, PROJECT_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+PAYLOADS = {
+    "empty": {"email": "joe@example.com", "name": "Joe", "external_id": "joe", "tags": []},
+    "typical": {
+        "email": "joe@example.com", "name": "Joe Tester", "external_id": "joe",
+        "organization": "Acme, Inc.", "tags": ["customer", "premium", "beta"],
+    },
+    "large_tags": {
+        "email": "joe@example.com", "name": "Joe Tester", "external_id": "joe",
+        "tags": ["tag-{}".format(i) for i in range(500)],
+    },
+    "long_name": {"email": "joe@example.com", "name": u"Jörg Ångström " * 150, "external_id": "joe"},
+}
+
+
+def setup_django():
+    import django
+    from django.conf import settings
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+    settings.DEBUG = False
+    settings.ROOT_URLCONF = sys.modules[__name__]
+
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0)
+
+
+def make_view_class(payload):
+    from zendesk_auth.views import ZendeskJWTAuthorize
+
+    hooks = dict(("get_" + claim, lambda self, v=payload.get(claim, ""): v) for claim in (
+        "email", "external_id", "organization", "tags", "remote_photo_url"))
+    hooks["get_user_name"] = lambda self: payload.get("name", "")
+    return type("BenchmarkAuthorize", (ZendeskJWTAuthorize,), hooks)
+
+
+def time_case(func, repeat):
+    """
+    Returns the best per-call time of ``func`` in microseconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def get_cases(name, payload, client):
+    from django.conf import settings
+    from django.template.loader import render_to_string
+    from zendesk_auth.rendering import get_precompiled_template
+    from zendesk_auth.signers import HS256Signer, PyJWTSigner
+
+    view = make_view_class(payload)()
+    token = view.get_jwt_string()
+    context = {"zendesk_url": settings.ZENDESK_URL, "jwt_string": token}
+    template_name = view.template_name
+    precompiled = get_precompiled_template([template_name], context)
+    signed = dict(payload, iat=int(time.time()), jti="bench")
+    hs256, pyjwt = HS256Signer(settings.ZENDESK_TOKEN), PyJWTSigner(settings.ZENDESK_TOKEN)
+
+    return {
+        "build_payload[{}]".format(name): lambda: view.build_payload(view.get_claims()),
+        "sign_hs256[{}]".format(name): lambda: hs256.sign(signed),
+        "sign_pyjwt[{}]".format(name): lambda: pyjwt.sign(signed),
+        "get_jwt_string[{}]".format(name): view.get_jwt_string,
+        "render_template[{}]".format(name): lambda: render_to_string(template_name, context),
+        "render_precompiled[{}]".format(name): lambda: precompiled.render(context),
+        "request[{}]".format(name): lambda: client.get("/{}/".format(name)),
+    }
+
+
+def run(args):
+    setup_django()
+
+    import django
+    import jwt
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    client = Client()
+    client.force_login(User.objects.create_user("bench", "bench@example.com"))
+
+    results = {}
+    for name, payload in sorted(PAYLOADS.items()):
+        for case, func in sorted(get_cases(name, payload, client).items()):
+            results[case] = time_case(func, args.repeat)
+            print("{:<40} {:>12.2f} us".format(case, results[case]))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "pyjwt": jwt.__version__,
+            "machine": platform.node(),
+            "timestamp": int(time.time()),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = []
+    for case in sorted(set(baseline) & set(current)):
+        change = (current[case] - baseline[case]) / baseline[case] * 100
+        print("{:<40} {:>12.2f} us {:>12.2f} us {:>+8.1f}%".format(case, baseline[case], current[case], change))
+        if change > args.threshold:
+            regressions.append(case)
+
+    for case in regressions:
+        print("REGRESSION: {} is more than {}% slower".format(case, args.threshold))
+    return 1 if regressions else 0
+
+
+def get_urlpatterns():
+    from django.urls import path
+    return [path("{}/".format(name), make_view_class(payload).as_view()) for name, payload in PAYLOADS.items()]
+
+
+def __getattr__(name):
+    # ROOT_URLCONF points at this module; build the patterns once Django is set up.
+    if name == "urlpatterns":
+        return get_urlpatterns()
+    raise AttributeError(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="time every case")
+    run_parser.add_argument("--output", help="write results to this JSON file")
+    run_parser.add_argument("--repeat", type=int, default=5, help="timing repeats per case, best is kept")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
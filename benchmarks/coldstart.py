@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+First-request latency of a fresh process, with and without the
+``ZENDESK_WARMUP`` done in ``ZendeskAuthConfig.ready()``.
+
+    python benchmarks/coldstart.py --runs 10 --output coldstart.json
+
+Each run starts a new interpreter that sets Django up (timed as
+``startup``), logs a user in and times its first and second requests to the
+authorize view. Medians over ``--runs`` are reported for each mode.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "example")
+METRICS = ("startup", "first_request", "second_request")
+
+
+def child(args):
+    sys.path.insert(0, PROJECT_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+    from django.conf import settings
+    settings.ZENDESK_WARMUP = args.warmup
+    settings.DEBUG = False
+
+    import django
+    start = time.perf_counter()
+    django.setup()
+    startup = time.perf_counter() - start
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    client = Client()
+    client.force_login(User.objects.create_user("cold", "cold@example.com"))
+    client.handler.load_middleware()
+
+    timings = {"startup": startup}
+    for metric in ("first_request", "second_request"):
+        start = time.perf_counter()
+        response = client.get("/zendesk-jwt-authorize/")
+        timings[metric] = time.perf_counter() - start
+        assert response.status_code == 200, response.status_code
+    print(json.dumps(timings))
+    return 0
+
+
+def measure(warmup):
+    command = [sys.executable, os.path.abspath(__file__), "child"] + (["--warmup"] if warmup else [])
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(args):
+    runs = {"cold": [], "warm": []}
+    for _ in range(args.runs):
+        runs["cold"].append(measure(warmup=False))
+        runs["warm"].append(measure(warmup=True))
+
+    results = {
+        mode: {metric: statistics.median(run[metric] for run in mode_runs) * 1000 for metric in METRICS}
+        for mode, mode_runs in runs.items()
+    }
+    print("{:<16} {:>12} {:>12}".format("median ms", "no warmup", "warmup"))
+    for metric in METRICS:
+        print("{:<16} {:>12.2f} {:>12.2f}".format(metric, results["cold"][metric], results["warm"][metric]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": args.runs, "results": results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    parser.add_argument("--runs", type=int, default=10, help="processes started per mode")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.set_defaults(func=run)
+
+    child_parser = subparsers.add_parser("child", help="one measured process")
+    child_parser.add_argument("--warmup", action="store_true")
+    child_parser.set_defaults(func=child)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+"""
+Concurrent load test of the full SSO flow.
+
+    python benchmarks/loadtest.py --configs wsgi:1:1 wsgi:1:8 wsgi:4:1 asgi:4:1 \\
+        --concurrency 32 --requests 4000 --output loadtest.json
+
+Each config is ``<server>:<workers>:<threads>``. ``wsgi`` serves the example
+project with gunicorn when it is installed, else with a built-in prefork,
+thread-pooled wsgiref server. ``asgi`` needs uvicorn (threads are ignored)
+and exercises the async view.
+
+Every client thread is a different logged-in user. It fetches the authorize
+page and sends the token to a local stub of Zendesk's ``/access/jwt``, which
+checks the signature, that ``iat`` is fresh and that no ``jti`` is issued
+twice. Throughput and latency percentiles of the authorize request are
+reported per config. Any failed request or rejected token is a correctness
+failure and makes the command exit with status 1.
+"""
+import argparse
+import ast
+import collections
+import http.client
+import json
+import math
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+EXAMPLE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "example"))
+PATHS = {"wsgi": "/zendesk-jwt-authorize/", "asgi": "/zendesk-jwt-authorize/async/"}
+
+SETTINGS = """\
+from settings import *  # noqa
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3", "NAME": {db!r}, "OPTIONS": {{"timeout": 30}}}}}}
+SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
+ZENDESK_URL = {zendesk_url!r}
+"""
+
+
+class Verifier(object):
+    """
+    What Zendesk checks before logging a user in with a token.
+    """
+
+    def __init__(self, key, max_age):
+        self.key = key
+        self.max_age = max_age
+        self.seen = set()
+        self.rejected = collections.Counter()
+        self.lock = threading.Lock()
+
+    def verify(self, token):
+        import jwt
+
+        try:
+            payload = jwt.decode(token, self.key, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            return self.reject("bad signature")
+        if not 0 <= time.time() - payload["iat"] + 1 <= self.max_age:
+            return self.reject("stale iat")
+        with self.lock:
+            duplicate = payload["jti"] in self.seen
+            self.seen.add(payload["jti"])
+        return self.reject("duplicate jti") if duplicate else None
+
+    def reject(self, reason):
+        with self.lock:
+            self.rejected[reason] += 1
+        return reason
+
+
+class StubZendeskHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond(parse_qs(urlsplit(self.path).query).get("jwt", [""])[0])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("ascii")
+        self.respond(parse_qs(body).get("jwt", [""])[0])
+
+    def respond(self, token):
+        reason = self.server.verifier.verify(token)
+        content = (reason or "").encode("utf-8")
+        self.send_response(401 if reason else 302)
+        if not reason:
+            self.send_header("Location", "/hc")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    wsgiref server that handles connections on a fixed pool of threads.
+    """
+
+    def __init__(self, address, threads):
+        super(PooledWSGIServer, self).__init__(address, QuietWSGIRequestHandler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(args):
+    """
+    Built-in WSGI server: binds once, forks ``--workers - 1`` times and
+    serves on every process.
+    """
+    sys.path.insert(0, EXAMPLE_DIR)
+    from wsgi import application
+
+    server = PooledWSGIServer(("127.0.0.1", args.port), args.threads)
+    server.set_app(application)
+    for _ in range(args.workers - 1):
+        if os.fork() == 0:
+            break
+    server.serve_forever()
+
+
+def parse_config(value):
+    server, workers, threads = value.split(":")
+    if server not in PATHS:
+        raise argparse.ArgumentTypeError("server must be one of {}".format(", ".join(PATHS)))
+    return server, int(workers), int(threads)
+
+
+def parse_setting(value):
+    name, _, literal = value.partition("=")
+    try:
+        return name, ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        return name, literal
+
+
+def is_installed(module):
+    import importlib.util
+    return importlib.util.find_spec(module) is not None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with status {}".format(process.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start listening on port {}".format(port))
+
+
+def get_server_command(config, port):
+    server, workers, threads = config
+    if server == "asgi":
+        return [sys.executable, "-m", "uvicorn", "asgi:application", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    if is_installed("gunicorn"):
+        return [sys.executable, "-m", "gunicorn", "wsgi:application", "--bind", "127.0.0.1:{}".format(port),
+                "--workers", str(workers), "--threads", str(threads), "--log-level", "warning"]
+    return [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port),
+            "--workers", str(workers), "--threads", str(threads)]
+
+
+def start_server(config, env):
+    port = free_port()
+    process = subprocess.Popen(get_server_command(config, port), cwd=EXAMPLE_DIR, env=env, start_new_session=True)
+    try:
+        wait_for_port(port, process)
+    except RuntimeError:
+        stop_server(process)
+        raise
+    return process, port
+
+
+def stop_server(process):
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+    process.wait()
+
+
+def setup_project(workdir, zendesk_url, overrides):
+    """
+    Writes a settings module for the servers, creates the database and
+    returns the settings environment.
+    """
+    settings = SETTINGS.format(db=os.path.join(workdir, "loadtest.db"), zendesk_url=zendesk_url)
+    settings += "".join("{} = {!r}\n".format(name, value) for name, value in overrides)
+    with open(os.path.join(workdir, "loadtest_settings.py"), "w") as f:
+        f.write(settings)
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="loadtest_settings")
+    env["PYTHONPATH"] = os.pathsep.join([workdir, EXAMPLE_DIR, os.path.dirname(EXAMPLE_DIR)])
+    sys.path[:0] = [workdir, EXAMPLE_DIR]
+    os.environ["DJANGO_SETTINGS_MODULE"] = "loadtest_settings"
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+    return env
+
+
+def get_session_cookies(count):
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    User.objects.bulk_create([
+        User(username="load{}".format(i), email="load{}@example.com".format(i)) for i in range(count)])
+    cookies = []
+    for user in User.objects.filter(username__startswith="load").order_by("pk"):
+        client = Client()
+        client.force_login(user)
+        cookies.append("{}={}".format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value))
+    return cookies
+
+
+def get_token(response, body):
+    if response.status == 302:
+        return parse_qs(urlsplit(response.getheader("Location")).query).get("jwt", [None])[0]
+    match = re.search(rb'name="jwt" value="([^"]+)"', body)
+    return match.group(1).decode("ascii") if match else None
+
+
+class Client(object):
+    """
+    One logged-in user going through the SSO flow ``count`` times over
+    kept-alive connections.
+    """
+
+    def __init__(self, app_port, zendesk_port, path, cookie):
+        self.app = http.client.HTTPConnection("127.0.0.1", app_port, timeout=60)
+        self.zendesk = http.client.HTTPConnection("127.0.0.1", zendesk_port, timeout=60)
+        self.path = path
+        self.headers = {"Cookie": cookie}
+        self.latencies = []
+        self.errors = collections.Counter()
+
+    def run(self, count):
+        for _ in range(count):
+            try:
+                self.login()
+            except (OSError, http.client.HTTPException) as error:
+                self.errors[type(error).__name__] += 1
+                self.app.close()
+                self.zendesk.close()
+        return self
+
+    def login(self):
+        start = time.perf_counter()
+        self.app.request("GET", self.path, headers=self.headers)
+        response = self.app.getresponse()
+        body = response.read()
+        self.latencies.append(time.perf_counter() - start)
+
+        token = get_token(response, body)
+        if token is None:
+            self.errors["status {}".format(response.status)] += 1
+            return
+        self.zendesk.request("POST", "/access/jwt", "jwt={}".format(token),
+                             {"Content-Type": "application/x-www-form-urlencoded"})
+        self.zendesk.getresponse().read()
+
+
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)] if values else 0.0
+
+
+def run_config(config, args, env, cookies, zendesk_port):
+    process, port = start_server(config, env)
+    try:
+        clients = [Client(port, zendesk_port, PATHS[config[0]], cookie) for cookie in cookies]
+        with ThreadPoolExecutor(len(clients)) as pool:
+            list(pool.map(lambda client: client.run(args.warmup), clients))
+            for client in clients:
+                client.latencies = []
+            per_client = [args.requests // len(clients) + (i < args.requests % len(clients))
+                          for i in range(len(clients))]
+            start = time.perf_counter()
+            list(pool.map(Client.run, clients, per_client))
+            elapsed = time.perf_counter() - start
+    finally:
+        stop_server(process)
+    return summarize(clients, elapsed)
+
+
+def summarize(clients, elapsed):
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    errors = sum((client.errors for client in clients), collections.Counter())
+    return {
+        "requests": len(latencies),
+        "errors": dict(errors),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def available(config):
+    if config[0] == "asgi" and not is_installed("uvicorn"):
+        print("skipping {}: uvicorn is not installed".format(":".join(map(str, config))))
+        return False
+    return True
+
+
+def run(args):
+    verifier = Verifier(None, args.max_token_age)
+    zendesk = ThreadingHTTPServer(("127.0.0.1", 0), StubZendeskHandler)
+    zendesk.verifier = verifier
+    threading.Thread(target=zendesk.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = setup_project(workdir, "http://127.0.0.1:{}".format(zendesk.server_port), args.set)
+        from django.conf import settings
+        verifier.key = settings.ZENDESK_TOKEN
+        cookies = get_session_cookies(args.concurrency)
+
+        print("{:<16} {:>9} {:>7} {:>10} {:>9} {:>9} {:>9}".format(
+            "config", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+        results = {}
+        for config in filter(available, args.configs):
+            name = ":".join(map(str, config))
+            result = results[name] = run_config(config, args, env, cookies, zendesk.server_port)
+            print("{:<16} {:>9} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                name, result["requests"], sum(result["errors"].values()), result["throughput"],
+                result["p50_ms"], result["p95_ms"], result["p99_ms"]))
+    zendesk.shutdown()
+
+    report = {"concurrency": args.concurrency, "results": results, "rejected": dict(verifier.rejected)}
+    for reason, count in sorted(verifier.rejected.items()):
+        print("REJECTED: {} tokens with {}".format(count, reason))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    failed = verifier.rejected or any(result["errors"] for result in results.values())
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    parser.add_argument("--configs", nargs="+", type=parse_config, default=[("wsgi", 1, 1), ("wsgi", 1, 8)],
+                        help="<server>:<workers>:<threads> to test, server is wsgi or asgi")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients, each a different user")
+    parser.add_argument("--requests", type=int, default=2000, help="measured logins per config")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured logins per client before measuring")
+    parser.add_argument("--max-token-age", type=int, default=180, help="seconds the stub accepts an iat for")
+    parser.add_argument("--set", action="append", type=parse_setting, default=[], metavar="NAME=VALUE",
+                        help="extra Django setting for the servers, e.g. ZENDESK_RESPONSE_MODE=redirect")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.set_defaults(func=run)
+
+    serve_parser = subparsers.add_parser("serve", help="built-in WSGI server used when gunicorn is missing")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--workers", type=int, default=1)
+    serve_parser.add_argument("--threads", type=int, default=1)
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+"""
+ASGI config for example project.
+
+Serves the async views (``zendesk-jwt-authorize/async/``) without a thread
+per request, e.g. ``uvicorn asgi:application`` from this directory.
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.core.asgi import get_asgi_application  # noqa: E402
+application = get_asgi_application()
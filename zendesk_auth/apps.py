@@ -0,0 +1,28 @@
+import os
+
+from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
+from django.core import checks
+
+
+class ZendeskAuthConfig(AppConfig):
+    name = "zendesk_auth"
+    default_auto_field = "django.db.models.AutoField"
+
+    def ready(self):
+        from zendesk_auth.cache import register_configured_views
+        from zendesk_auth.checks import check_settings
+        from zendesk_auth.conf import get_setting
+        from zendesk_auth.profiling import install_signal_handler
+        from zendesk_auth.session_claims import precompute_claims
+        from zendesk_auth.warmup import reset_after_fork, warmup
+
+        checks.register(check_settings, "zendesk_auth")
+        user_logged_in.connect(precompute_claims, dispatch_uid="zendesk_auth.session_claims")
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=reset_after_fork)
+        install_signal_handler()
+        if get_setting("ZENDESK_CLAIMS_CACHE"):
+            register_configured_views()
+        if get_setting("ZENDESK_WARMUP"):
+            warmup()
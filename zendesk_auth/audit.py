@@ -0,0 +1,265 @@
+"""
+Audit log of issued tokens, written off the request path.
+
+Signing a token only puts ``(tenant, user pk, payload)`` on a bounded
+in-memory queue. A background thread turns queued events into records
+(``tenant``, ``user_pk``, ``jti``, ``claims_hash``, ``issued_at``) and hands
+them to the ``ZENDESK_AUDIT_SINK`` in batches of up to
+``ZENDESK_AUDIT_BATCH_SIZE``, at least every ``ZENDESK_AUDIT_FLUSH_INTERVAL``
+seconds. What's queued is flushed when the process exits.
+
+When the queue is full, ``ZENDESK_AUDIT_OVERFLOW = "drop"`` drops the event
+and ``"block"`` waits up to ``ZENDESK_AUDIT_BLOCK_TIMEOUT`` seconds for room
+before dropping it. The async view never waits, whatever the policy, so a
+full queue can't stall the event loop. Dropped events are counted and logged.
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop", "block")
+
+_STOP = object()
+
+
+def hash_claims(payload):
+    claims = {key: value for key, value in payload.items() if key not in ("iat", "jti")}
+    data = json.dumps(claims, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def to_record(event):
+    tenant, user_pk, payload = event
+    return {
+        "tenant": tenant,
+        "user_pk": str(user_pk),
+        "jti": payload["jti"],
+        "claims_hash": hash_claims(payload),
+        "issued_at": datetime.datetime.fromtimestamp(payload["iat"], datetime.timezone.utc),
+    }
+
+
+class ModelSink(object):
+    """
+    Writes records to ``zendesk_auth.models.IssuedToken`` with one
+    ``bulk_create`` per batch.
+    """
+
+    def __init__(self, using="default"):
+        self.using = using
+
+    def write(self, records):
+        from zendesk_auth.models import IssuedToken
+
+        close_old_connections()
+        IssuedToken.objects.using(self.using).bulk_create([IssuedToken(**record) for record in records])
+
+
+class JSONLSink(object):
+    """
+    Appends records to ``path`` as JSON lines. The file is rotated to
+    ``path.1`` ... ``path.<backup_count>`` once it reaches ``max_bytes``.
+    """
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.stream = None
+
+    def write(self, records):
+        if self.stream is None:
+            self.stream = open(self.path, "a", encoding="utf-8")
+        self.stream.write("".join(json.dumps(record, default=datetime.datetime.isoformat) + "\n"
+                                  for record in records))
+        self.stream.flush()
+        if self.stream.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.close()
+        names = [self.path] + ["{}.{}".format(self.path, i) for i in range(1, self.backup_count + 1)]
+        for source, target in reversed(list(zip(names, names[1:]))):
+            if os.path.exists(source):
+                os.replace(source, target)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class AuditLog(object):
+    """
+    Bounded queue of issuance events drained into ``sink`` by a daemon
+    thread, started on first use and again in forked children.
+    """
+
+    def __init__(self, sink, queue_size=10000, batch_size=500, flush_interval=1.0,
+                 overflow="drop", block_timeout=0.1):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ImproperlyConfigured("ZENDESK_AUDIT_OVERFLOW must be one of {}".format(OVERFLOW_POLICIES))
+        self.sink = sink
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = overflow == "block"
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self.reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+        atexit.register(self.close)
+
+    def reset(self):
+        self.queue = queue.Queue(self.queue_size)
+        self._thread = None
+
+    def record(self, event):
+        self._put(event, self.block)
+
+    def record_nowait(self, event):
+        """
+        Queues ``event`` without waiting for room, dropping it when the queue
+        is full whatever the overflow policy. Safe to call on an event loop.
+        """
+        self._put(event, False)
+
+    def _put(self, event, block):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put(event, block, self.block_timeout)
+        except queue.Full:
+            self._drop()
+
+    def _drop(self):
+        self.dropped += 1
+        if self.dropped % 1000 == 1:
+            logger.warning("Audit queue is full, %d token events dropped so far", self.dropped)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="zendesk-auth-audit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._collect()
+            self._write(batch)
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            event = self._get(deadline)
+            if event is None:
+                break
+            if event is _STOP:
+                self.queue.task_done()
+                return batch, True
+            batch.append(event)
+        return batch, False
+
+    def _get(self, deadline):
+        try:
+            return self.queue.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            return None
+
+    def _write(self, batch):
+        try:
+            if batch:
+                self.sink.write([to_record(event) for event in batch])
+        except Exception:
+            logger.exception("Could not write %d token events to the audit log", len(batch))
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """
+        Blocks until every event queued so far is written.
+        """
+        if self._thread is not None:
+            self.queue.join()
+
+    def close(self, timeout=5):
+        """
+        Writes what's queued, stops the writer thread and closes the sink.
+        Recording again starts a new thread.
+        """
+        thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._stop(thread, timeout)
+        if hasattr(self.sink, "close"):
+            self.sink.close()
+
+    def _stop(self, thread, timeout):
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Audit queue is full, %d token events were not written", self.queue.qsize())
+            return
+        thread.join(timeout)
+
+
+@lru_cache(maxsize=None)
+def get_audit_log():
+    """
+    Returns the process wide audit log, or ``None`` when
+    ``ZENDESK_AUDIT_SINK`` isn't set.
+    """
+    sink = get_setting("ZENDESK_AUDIT_SINK")
+    if not sink:
+        return None
+    return AuditLog(
+        import_string(sink)(**get_setting("ZENDESK_AUDIT_SINK_OPTIONS")),
+        queue_size=get_setting("ZENDESK_AUDIT_QUEUE_SIZE"),
+        batch_size=get_setting("ZENDESK_AUDIT_BATCH_SIZE"),
+        flush_interval=get_setting("ZENDESK_AUDIT_FLUSH_INTERVAL"),
+        overflow=get_setting("ZENDESK_AUDIT_OVERFLOW"),
+        block_timeout=get_setting("ZENDESK_AUDIT_BLOCK_TIMEOUT"),
+    )
+
+
+def record_issued(view, payload):
+    audit_log = get_audit_log()
+    if audit_log is not None:
+        audit_log.record((view.get_tenant().name, view.request.user.pk, payload))
+
+
+def record_issued_nowait(view, payload):
+    audit_log = get_audit_log()
+    if audit_log is not None:
+        audit_log.record_nowait((view.get_tenant().name, view.request.user.pk, payload))
+
+
+@receiver(setting_changed)
+def reset_audit_log(setting, **kwargs):
+    if setting.startswith("ZENDESK_AUDIT"):
+        if get_audit_log.cache_info().currsize and get_audit_log() is not None:
+            get_audit_log().close()
+        get_audit_log.cache_clear()
@@ -0,0 +1,236 @@
+"""
+Cross-request cache of the claims computed by a view's ``get_*`` hooks.
+
+Claims are stored in a Django cache, keyed by user pk, tenant, a hash of the
+view class and the user's generation, with a small in-process LRU in front
+of it. Signals on the models the hooks declare with
+``zendesk_auth.claims.depends_on`` invalidate a user's entries of every view
+and tenant at once by bumping the generation, which is also kept in the
+shared cache. The LRU is per process, so its own timeout
+(``ZENDESK_CLAIMS_CACHE_LOCAL_TIMEOUT``) bounds how long another process can
+serve claims after they were invalidated.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from zendesk_auth.claims import get_claim_dependencies
+from zendesk_auth.conf import get_setting
+
+
+class LocalLRU(object):
+    """
+    Thread-safe, size bounded LRU whose entries expire after ``timeout``
+    seconds.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, 0))
+            if expires < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ClaimsCache(object):
+
+    def __init__(self, alias, timeout, maxsize, local_timeout):
+        self.shared = caches[alias]
+        self.timeout = timeout
+        self.local = LocalLRU(maxsize, local_timeout)
+
+    def get(self, key):
+        claims = self.local.get(key)
+        if claims is None:
+            claims = self.shared.get(key)
+            self._remember(key, claims)
+        return claims
+
+    async def aget(self, key):
+        claims = self.local.get(key)
+        if claims is None:
+            claims = await self.shared.aget(key)
+            self._remember(key, claims)
+        return claims
+
+    def set(self, key, claims):
+        self.shared.set(key, claims, self.timeout)
+        self.local.set(key, claims)
+
+    async def aset(self, key, claims):
+        await self.shared.aset(key, claims, self.timeout)
+        self.local.set(key, claims)
+
+    def get_generation(self, user_pk):
+        key = make_generation_key(user_pk)
+        generation = self.local.get(key)
+        if generation is None:
+            generation = self.shared.get(key, 0)
+            self.local.set(key, generation)
+        return generation
+
+    async def aget_generation(self, user_pk):
+        key = make_generation_key(user_pk)
+        generation = self.local.get(key)
+        if generation is None:
+            generation = await self.shared.aget(key, 0)
+            self.local.set(key, generation)
+        return generation
+
+    def bump(self, user_pks):
+        """
+        Moves ``user_pks`` to a new generation, orphaning their entries.
+        """
+        # A fresh timestamp rather than incr(), so concurrent bumps can't
+        # collide and a lost key can't resurrect old entries. Generations
+        # never expire for the same reason.
+        keys = [make_generation_key(pk) for pk in user_pks]
+        self.shared.set_many(dict.fromkeys(keys, time.time_ns()), None)
+        for key in keys:
+            self.local.delete(key)
+
+    def _remember(self, key, claims):
+        if claims is not None:
+            self.local.set(key, claims)
+
+
+@lru_cache(maxsize=None)
+def get_claims_cache():
+    """
+    Returns the process wide ``ClaimsCache``, or ``None`` when
+    ``ZENDESK_CLAIMS_CACHE`` is off.
+    """
+    if not get_setting("ZENDESK_CLAIMS_CACHE"):
+        return None
+    return ClaimsCache(
+        get_setting("ZENDESK_CLAIMS_CACHE_ALIAS"),
+        get_setting("ZENDESK_CLAIMS_CACHE_TIMEOUT"),
+        get_setting("ZENDESK_CLAIMS_CACHE_MAXSIZE"),
+        get_setting("ZENDESK_CLAIMS_CACHE_LOCAL_TIMEOUT"),
+    )
+
+
+@receiver(setting_changed)
+def reset_claims_cache(setting, **kwargs):
+    if setting.startswith("ZENDESK_CLAIMS_CACHE") or setting == "CACHES":
+        get_claims_cache.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def get_claims_version(view_class):
+    """
+    Hash identifying the shape of ``view_class``'s claims. Bump the view's
+    ``claims_version`` to orphan entries when hook logic changes.
+    """
+    source = "{}.{}:{}:{}".format(
+        view_class.__module__, view_class.__qualname__, view_class.claims_version, view_class.claim_hooks)
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+
+def make_key(version, tenant, user_pk, generation=0):
+    return "zendesk_auth:claims:{}:{}:{}:{}".format(version, tenant, user_pk, generation)
+
+
+def make_generation_key(user_pk):
+    return "zendesk_auth:claims-generation:{}".format(user_pk)
+
+
+# ``update_last_login`` saves the user on every login; that alone should not
+# throw away the claims the login is about to need.
+IGNORED_UPDATE_FIELDS = frozenset(["last_login"])
+
+_watched_models = {}
+_watched_m2m = set()
+_lock = threading.Lock()
+
+
+def register_view(view_class):
+    """
+    Connects invalidation for the models ``view_class``'s hooks depend on.
+    Called for every subclass of ``ZendeskJWTMixin`` when it is defined.
+    """
+    with _lock:
+        for model, user_field in get_claim_dependencies(view_class):
+            _watch(model, user_field)
+
+
+def register_configured_views():
+    """
+    Imports the ``ZENDESK_CLAIMS_CACHE_VIEWS`` classes, so processes that
+    save the models their hooks depend on without importing the views
+    (task workers, management commands, web workers before the URLconf
+    loads) still invalidate cached claims. Called from
+    ``ZendeskAuthConfig.ready()``.
+    """
+    for path in get_setting("ZENDESK_CLAIMS_CACHE_VIEWS"):
+        register_view(import_string(path))
+
+
+def _watch(model, user_field):
+    fields = _watched_models.setdefault(model, set())
+    if user_field in fields:
+        return
+    fields.add(user_field)
+    _watched_m2m.add(model)
+    uid = "zendesk_auth.cache:{}:{}".format(model, user_field)
+    post_save.connect(_make_receiver(user_field), sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(_make_receiver(user_field), sender=model, weak=False, dispatch_uid=uid)
+
+
+def _make_receiver(user_field):
+    def invalidate_user(instance, update_fields=None, **kwargs):
+        if update_fields and IGNORED_UPDATE_FIELDS.issuperset(update_fields):
+            return
+        invalidate(getattr(instance, user_field))
+    return invalidate_user
+
+
+def invalidate(*user_pks):
+    """
+    Drops the cached claims of ``user_pks`` for every view and tenant.
+    """
+    cache = get_claims_cache()
+    if cache is not None:
+        cache.bump(user_pks)
+
+
+@receiver(m2m_changed, dispatch_uid="zendesk_auth.cache:m2m")
+def invalidate_m2m(sender, instance, action, model, pk_set, **kwargs):
+    if sender._meta.label not in _watched_m2m or not action.startswith("post_"):
+        return
+    if isinstance(instance, get_user_model()):
+        invalidate(instance.pk)
+    elif model is get_user_model():
+        invalidate(*(pk_set or ()))
@@ -0,0 +1,71 @@
+"""
+System checks for the zendesk_auth settings, run by ``manage.py check`` and
+at server start.
+"""
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.checks import Error, Warning
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.profiling import SERVER_SIGNALS
+from zendesk_auth.session_claims import MODES as SESSION_CLAIMS_MODES
+
+SESSION_MIDDLEWARE = "django.contrib.sessions.middleware.SessionMiddleware"
+SESSION_CLAIMS_MIDDLEWARE = "zendesk_auth.session_claims.SessionClaimsMiddleware"
+
+
+def check_url(name, url):
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return [Error("{} must be an absolute URL like https://yourcompany.zendesk.com".format(name),
+                      id="zendesk_auth.E002")]
+    if parts.scheme != "https":
+        return [Warning("{} should use https, tokens are sent to it".format(name), id="zendesk_auth.W001")]
+    if parts.path:
+        return [Warning("{} should not have a path or trailing slash; /access/jwt is appended to it".format(name),
+                        id="zendesk_auth.W002")]
+    return []
+
+
+def check_tenant(name, url, token):
+    if not token:
+        return [Error("{} is set but its token is empty".format(name), id="zendesk_auth.E003")]
+    return check_url(name, url)
+
+
+def check_session_claims(mode):
+    if mode is None:
+        return []
+    if mode not in SESSION_CLAIMS_MODES:
+        return [Error("ZENDESK_SESSION_CLAIMS must be None or one of {}".format(SESSION_CLAIMS_MODES),
+                      id="zendesk_auth.E004")]
+    middleware = list(settings.MIDDLEWARE)
+    after_sessions = middleware[middleware.index(SESSION_MIDDLEWARE) + 1:] if SESSION_MIDDLEWARE in middleware else []
+    if mode == "thread" and SESSION_CLAIMS_MIDDLEWARE not in after_sessions:
+        return [Warning("ZENDESK_SESSION_CLAIMS = 'thread' needs {} after {} in MIDDLEWARE".format(
+            SESSION_CLAIMS_MIDDLEWARE, SESSION_MIDDLEWARE), id="zendesk_auth.W003")]
+    return []
+
+
+def check_profile_signal(name):
+    if name in SERVER_SIGNALS:
+        return [Warning("ZENDESK_PROFILE_SIGNAL = {!r} is handled by application servers such as gunicorn; "
+                        "use e.g. 'SIGRTMIN'".format(name), id="zendesk_auth.W004")]
+    return []
+
+
+def check_settings(app_configs=None, **kwargs):
+    # Tenants from ZENDESK_TENANTS_LOADER are only known at runtime.
+    loader = get_setting("ZENDESK_TENANTS_LOADER")
+    tenants = {} if loader else get_setting("ZENDESK_TENANTS")
+    url = getattr(settings, "ZENDESK_URL", None)
+    if not (url or tenants or loader):
+        return [Error("Set ZENDESK_URL and ZENDESK_TOKEN (or ZENDESK_TENANTS)", id="zendesk_auth.E001")]
+
+    errors = check_tenant("ZENDESK_URL", url, getattr(settings, "ZENDESK_TOKEN", None)) if url else []
+    errors.extend(check_session_claims(get_setting("ZENDESK_SESSION_CLAIMS")))
+    errors.extend(check_profile_signal(get_setting("ZENDESK_PROFILE_SIGNAL")))
+    for name, config in tenants.items():
+        errors.extend(check_tenant("ZENDESK_TENANTS[{!r}]".format(name), config.get("URL"), config.get("TOKEN")))
+    return errors
@@ -0,0 +1,84 @@
+"""
+Declarations that claim hooks can carry.
+"""
+from functools import lru_cache
+
+
+def depends_on(*models, user_field="pk"):
+    """
+    Declares the models a claim hook reads, as ``"app_label.ModelName"``
+    strings. Saving or deleting one of them invalidates the cached claims of
+    the user whose pk is ``getattr(instance, user_field)``. Auto-created
+    many-to-many tables (e.g. ``"auth.User_groups"``) are watched through
+    ``m2m_changed``.
+
+        @depends_on("accounts.Membership", user_field="user_id")
+        def get_organization(self):
+            ...
+    """
+    def decorator(hook):
+        dependencies = getattr(hook, "claim_dependencies", ())
+        hook.claim_dependencies = dependencies + tuple((model, user_field) for model in models)
+        return hook
+    return decorator
+
+
+def get_claim_dependencies(view_class):
+    """
+    Returns the ``(model, user_field)`` pairs declared by ``view_class``'s
+    claim hooks.
+    """
+    dependencies = set()
+    for claim, hook in view_class.claim_hooks:
+        dependencies.update(getattr(getattr(view_class, hook), "claim_dependencies", ()))
+    return dependencies
+
+
+def loads(select_related=(), prefetch_related=(), only=()):
+    """
+    Declares what a claim hook reads from ``self.request.user``. Before the
+    hooks run, the view merges every hook's declarations into one user query
+    so related objects aren't fetched by each hook separately.
+
+    ``only`` lists the user (or ``select_related``) fields the hook reads.
+    It is applied only when every claim hook declares ``loads``, since an
+    undeclared hook could read any field.
+
+        @loads(select_related=["profile__company"], only=["profile__company__name"])
+        def get_organization(self):
+            return self.request.user.profile.company.name
+    """
+    def decorator(hook):
+        hook.claim_loads = {
+            "select_related": tuple(select_related),
+            "prefetch_related": tuple(prefetch_related),
+            "only": tuple(only),
+        }
+        return hook
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def get_claim_loads(view_class):
+    """
+    Returns the merged ``loads`` declarations of ``view_class``'s claim hooks.
+    ``only`` is ``None`` when a hook doesn't declare what it reads.
+    """
+    merged = {"select_related": set(), "prefetch_related": set(), "only": set()}
+    declarations = [getattr(getattr(view_class, hook), "claim_loads", None) for claim, hook in view_class.claim_hooks]
+    for declaration in filter(None, declarations):
+        for key, values in declaration.items():
+            merged[key].update(values)
+
+    loads = {key: tuple(sorted(values)) for key, values in merged.items()}
+    if None in declarations:
+        loads["only"] = None
+    return loads
+
+
+def loads_related(view_class):
+    """
+    Whether ``view_class``'s claim hooks need anything beyond the user row.
+    """
+    declared = get_claim_loads(view_class)
+    return bool(declared["select_related"] or declared["prefetch_related"])
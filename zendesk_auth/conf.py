@@ -0,0 +1,78 @@
+from django.conf import settings
+
+DEFAULTS = {
+    "ZENDESK_WARMUP": True,
+    "ZENDESK_JWT_SIGNER": "zendesk_auth.signers.HS256Signer",
+    "ZENDESK_JWT_SHADOW_VERIFY_RATE": 0.0,
+    "ZENDESK_PRECOMPILED_TEMPLATE": False,
+    "ZENDESK_RESPONSE_MODE": "post",
+    "ZENDESK_REDIRECT_MAX_URL_LENGTH": 2000,
+    "ZENDESK_RETURN_TO_HOSTS": (),
+    "ZENDESK_PRECONNECT": True,
+    "ZENDESK_CORS_ORIGINS": (),
+    "ZENDESK_ANONYMOUS_FAST_PATH": False,
+    "ZENDESK_BOT_USER_AGENTS": (
+        "bot", "crawl", "spider", "slurp", "curl/", "wget/", "python-requests", "python-urllib", "go-http-client",
+        "health", "monitor", "uptime", "pingdom",
+    ),
+    "ZENDESK_BOT_RESPONSE_MAX_AGE": 3600,
+    "ZENDESK_PAYLOAD_COMPACT_TAGS": False,
+    "ZENDESK_PAYLOAD_MAX_BYTES": None,
+    "ZENDESK_PAYLOAD_CLAIM_POLICIES": {"tags": "truncate", "remote_photo_url": "drop", "organization": "drop"},
+    "ZENDESK_THROTTLE_RATE": None,
+    "ZENDESK_THROTTLE_GLOBAL_RATE": None,
+    "ZENDESK_THROTTLE_LOOP_RATE": None,
+    "ZENDESK_THROTTLE_BACKEND": "zendesk_auth.throttling.LocalBuckets",
+    "ZENDESK_THROTTLE_OPTIONS": {},
+    "ZENDESK_THROTTLE_RESPONSE": "zendesk_auth.throttling.throttled_response",
+    "ZENDESK_CLAIMS_CACHE": False,
+    "ZENDESK_CLAIMS_CACHE_ALIAS": "default",
+    "ZENDESK_CLAIMS_CACHE_TIMEOUT": 300,
+    "ZENDESK_CLAIMS_CACHE_MAXSIZE": 1024,
+    "ZENDESK_CLAIMS_CACHE_LOCAL_TIMEOUT": 5,
+    "ZENDESK_CLAIMS_CACHE_VIEWS": ("zendesk_auth.views.ZendeskJWTAuthorize",),
+    "ZENDESK_CONCURRENT_CLAIMS": (),
+    "ZENDESK_CLAIM_WORKERS": 16,
+    "ZENDESK_CLAIM_TIMEOUTS": {},
+    "ZENDESK_CLAIM_DEFAULT_TIMEOUT": None,
+    "ZENDESK_CLAIM_FALLBACKS": {},
+    "ZENDESK_SESSION_CLAIMS": None,
+    "ZENDESK_SESSION_CLAIMS_VIEW": "zendesk_auth.views.ZendeskJWTAuthorize",
+    "ZENDESK_SESSION_CLAIMS_MAX_AGE": 60,
+    "ZENDESK_SESSION_CLAIMS_TIMEOUT": 1.0,
+    "ZENDESK_SESSION_CLAIMS_WORKERS": 4,
+    "ZENDESK_INSTRUMENTATION": False,
+    "ZENDESK_SERVER_TIMING": False,
+    "ZENDESK_METRICS_SINK": "zendesk_auth.instrumentation.InProcessMetrics",
+    "ZENDESK_PROFILE_DIR": None,
+    "ZENDESK_PROFILE_SAMPLE_RATE": 0.0,
+    "ZENDESK_PROFILE_MEMORY": False,
+    "ZENDESK_PROFILE_MAX_DUMPS": 100,
+    "ZENDESK_PROFILE_POLL_INTERVAL": 1.0,
+    "ZENDESK_PROFILE_SIGNAL": None,
+    "ZENDESK_PROFILE_SIGNAL_REQUESTS": 10,
+    "ZENDESK_JTI_GENERATOR": "zendesk_auth.jti.CounterJTI",
+    "ZENDESK_JTI_LEDGER": None,
+    "ZENDESK_JTI_LEDGER_OPTIONS": {},
+    "ZENDESK_AUDIT_SINK": None,
+    "ZENDESK_AUDIT_SINK_OPTIONS": {},
+    "ZENDESK_AUDIT_QUEUE_SIZE": 10000,
+    "ZENDESK_AUDIT_BATCH_SIZE": 500,
+    "ZENDESK_AUDIT_FLUSH_INTERVAL": 1.0,
+    "ZENDESK_AUDIT_OVERFLOW": "drop",
+    "ZENDESK_AUDIT_BLOCK_TIMEOUT": 0.1,
+    "ZENDESK_TENANTS": {},
+    "ZENDESK_TENANTS_LOADER": None,
+    "ZENDESK_TENANTS_RELOAD_INTERVAL": None,
+    "ZENDESK_API_EMAIL": None,
+    "ZENDESK_API_TOKEN": None,
+    "ZENDESK_SYNC_TRANSPORT": "zendesk_auth.sync.HTTPTransport",
+}
+
+
+def get_setting(name):
+    """
+    Returns the project's value for an optional zendesk_auth setting,
+    falling back to the package default.
+    """
+    return getattr(settings, name, DEFAULTS[name])
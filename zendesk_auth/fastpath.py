@@ -0,0 +1,107 @@
+"""
+Cheap responses for authorize requests that can't be from a logged-in user.
+
+With ``ZENDESK_ANONYMOUS_FAST_PATH`` on, ``ZendeskJWTAuthorize`` answers
+requests without a session cookie before the session, the user or
+``login_required`` are touched:
+
+* user agents containing one of ``ZENDESK_BOT_USER_AGENTS`` (crawlers, uptime
+  checks, HTTP libraries; matched case-insensitively) and requests without one get an empty ``200`` that shared
+  caches may keep for ``ZENDESK_BOT_RESPONSE_MAX_AGE`` seconds
+* other ``GET`` and ``HEAD`` requests get the login redirect, built from a
+  prefix computed from ``LOGIN_URL`` once per language and script prefix
+* ``OPTIONS`` requests get the allowed methods, with or without a session
+
+Only use it when users are authenticated through the session; requests
+authenticated another way (e.g. ``RemoteUserMiddleware``) without a session
+cookie would be sent to the login page.
+"""
+import re
+from functools import lru_cache
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import resolve_url
+from django.urls import get_script_prefix
+from django.utils.cache import add_never_cache_headers, patch_cache_control, patch_vary_headers
+from django.utils.translation import get_language
+
+from zendesk_auth.conf import get_setting
+
+
+def get_login_prefix():
+    """
+    Returns ``LOGIN_URL?next=``, or ``None`` when ``LOGIN_URL`` has a host
+    or query string and needs ``login_required``'s own handling.
+    """
+    # A LOGIN_URL name reverses differently under i18n_patterns or another
+    # SCRIPT_NAME, so both are part of the cache key.
+    return _get_login_prefix(get_language(), get_script_prefix())
+
+
+@lru_cache(maxsize=None)
+def _get_login_prefix(language, script_prefix):
+    login_url = resolve_url(settings.LOGIN_URL)
+    parts = urlsplit(login_url)
+    if parts.scheme or parts.netloc or parts.query:
+        return None
+    return "{}?{}=".format(login_url, REDIRECT_FIELD_NAME)
+
+
+@lru_cache(maxsize=None)
+def get_bot_pattern():
+    # Entries are plain substrings, not regular expressions.
+    return re.compile("|".join(map(re.escape, get_setting("ZENDESK_BOT_USER_AGENTS"))) or "(?!)", re.IGNORECASE)
+
+
+def is_bot(request):
+    user_agent = request.META.get("HTTP_USER_AGENT", "")
+    return not user_agent or get_bot_pattern().search(user_agent) is not None
+
+
+def bot_response():
+    response = HttpResponse(content_type="text/plain")
+    patch_cache_control(response, public=True, max_age=get_setting("ZENDESK_BOT_RESPONSE_MAX_AGE"))
+    patch_vary_headers(response, ["Cookie", "User-Agent"])
+    response["X-Robots-Tag"] = "noindex, nofollow"
+    return response
+
+
+def login_redirect(request):
+    prefix = get_login_prefix()
+    if prefix is None:
+        return None
+    response = HttpResponseRedirect(prefix + quote(request.get_full_path(), safe="/"))
+    add_never_cache_headers(response)
+    patch_vary_headers(response, ["Cookie"])
+    return response
+
+
+def get_anonymous_response(request):
+    if request.method not in ("GET", "HEAD") or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return None
+    return bot_response() if is_bot(request) else login_redirect(request)
+
+
+def get_response(view, request, *args, **kwargs):
+    """
+    Returns the fast path response for ``request``, or ``None`` when the
+    view has to handle it.
+    """
+    if not get_setting("ZENDESK_ANONYMOUS_FAST_PATH"):
+        return None
+    if request.method == "OPTIONS":
+        return view.options(request, *args, **kwargs)
+    return get_anonymous_response(request)
+
+
+@receiver(setting_changed)
+def reset_fast_path(setting, **kwargs):
+    if setting in ("LOGIN_URL", "ROOT_URLCONF"):
+        _get_login_prefix.cache_clear()
+    elif setting == "ZENDESK_BOT_USER_AGENTS":
+        get_bot_pattern.cache_clear()
@@ -0,0 +1,140 @@
+"""
+Preconnect hints toward the Zendesk host.
+
+The passthrough page POSTs the token to Zendesk as soon as it loads, so the
+browser's DNS lookup and TLS handshake with Zendesk are on the critical
+path. With ``ZENDESK_PRECONNECT`` on, the authorize views send a
+``Link: <https://yourcompany.zendesk.com>; rel=preconnect`` header (the page
+itself also has a ``<link rel="preconnect">`` tag), letting the browser open
+the connection while it is still reading the page.
+
+``PreconnectMiddleware`` adds the same header to the other HTML pages of the
+site, e.g. those linking to the help center. ``EarlyHintsMiddleware`` wraps
+an ASGI application and sends the header as a ``103 Early Hints`` response
+before the authorize views run, on servers supporting the ASGI
+``http.response.early_hint`` extension.
+
+The origin and header of each tenant are computed once per URL.
+"""
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from django.core.exceptions import DisallowedHost
+from django.http import Http404
+from django.http.request import split_domain_port
+from django.urls import Resolver404, resolve
+from django.utils.deprecation import MiddlewareMixin
+
+from zendesk_auth import tenants
+from zendesk_auth.conf import get_setting
+
+EARLY_HINT = "http.response.early_hint"
+
+AUTHORIZE_URL_NAMES = frozenset([
+    "zendesk-jwt-authorize",
+    "zendesk-jwt-authorize-async",
+    "zendesk-jwt-authorize-tenant",
+    "zendesk-jwt-authorize-tenant-async",
+])
+
+
+@lru_cache(maxsize=None)
+def get_origin(url):
+    parts = urlsplit(url)
+    return "{}://{}".format(parts.scheme, parts.netloc)
+
+
+@lru_cache(maxsize=None)
+def get_link_header(url):
+    return "<{}>; rel=preconnect".format(get_origin(url))
+
+
+def add_preconnect(response, url):
+    """
+    Adds the preconnect ``Link`` for ``url``'s origin to ``response``,
+    keeping any ``Link`` header already there.
+    """
+    link = get_link_header(url)
+    existing = response.get("Link")
+    if not existing:
+        response["Link"] = link
+    elif link not in existing:
+        response["Link"] = "{}, {}".format(existing, link)
+    return response
+
+
+def _get_tenant_url(request):
+    try:
+        return tenants.get_tenant(request).url
+    except (DisallowedHost, Http404):
+        return None
+
+
+class PreconnectMiddleware(MiddlewareMixin):
+    """
+    Adds a preconnect ``Link`` for the request's tenant to HTML responses.
+    """
+
+    def process_response(self, request, response):
+        if response.get("Content-Type", "").startswith("text/html") and get_setting("ZENDESK_PRECONNECT"):
+            url = _get_tenant_url(request)
+            if url:
+                add_preconnect(response, url)
+        return response
+
+
+def _get_path_info(scope):
+    root_path, path = scope.get("root_path", ""), scope["path"]
+    return path[len(root_path):] if root_path and path.startswith(root_path) else path
+
+
+def _get_authorize_tenant(scope):
+    try:
+        match = resolve(_get_path_info(scope))
+    except Resolver404:
+        return None, False
+    return match.kwargs.get("tenant"), match.url_name in AUTHORIZE_URL_NAMES
+
+
+def _get_host(scope):
+    host = dict(scope.get("headers", ())).get(b"host", b"")
+    return split_domain_port(host.decode("latin-1"))[0] or None
+
+
+@lru_cache(maxsize=None)
+def _get_early_hint(url):
+    return {"type": EARLY_HINT, "links": [get_link_header(url).encode("latin-1")]}
+
+
+class EarlyHintsMiddleware(object):
+    """
+    ASGI middleware sending a ``103 Early Hints`` preconnect to the tenant's
+    Zendesk origin for requests to the authorize views::
+
+        application = EarlyHintsMiddleware(get_asgi_application())
+
+    Does nothing on servers without the ``http.response.early_hint``
+    extension.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and EARLY_HINT in (scope.get("extensions") or {}):
+            await self.send_early_hint(scope, send)
+        return await self.app(scope, receive, send)
+
+    async def send_early_hint(self, scope, send):
+        if not get_setting("ZENDESK_PRECONNECT"):
+            return
+        tenant, is_authorize = _get_authorize_tenant(scope)
+        url = self.get_tenant_url(scope, tenant) if is_authorize else None
+        if url:
+            await send(_get_early_hint(url))
+
+    def get_tenant_url(self, scope, tenant):
+        try:
+            return tenants.get_registry().resolve(tenant, _get_host(scope)).url
+        except Http404:
+            return None
@@ -0,0 +1,216 @@
+"""
+Per-phase latency instrumentation for the authorize views.
+
+With ``ZENDESK_INSTRUMENTATION`` on, each request gets a ``PhaseTimer`` that
+records how long the ``auth``, ``claims``, ``sign`` and ``render`` phases
+take. When the response is complete the durations are sent through the
+``phase_timed`` signal, recorded in the metrics sink and, with
+``ZENDESK_SERVER_TIMING``, written to a ``Server-Timing`` header. When it is
+off every view shares a ``NullTimer`` whose phases are a no-op.
+"""
+import bisect
+import contextlib
+import threading
+import time
+from functools import lru_cache
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.template.response import TemplateResponse
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.signals import phase_timed
+
+PHASE_METRIC = "zendesk_auth_phase_seconds"
+PAYLOAD_METRIC = "zendesk_auth_payload_bytes"
+CLAIM_METRIC = "zendesk_auth_claim_seconds"
+
+METRIC_HELP = {
+    PHASE_METRIC: "Time spent in each phase of the Zendesk authorize view.",
+    PAYLOAD_METRIC: "Encoded size of JWT payloads and of each claim in them.",
+    CLAIM_METRIC: "Time waited for each concurrently resolved claim, by outcome.",
+}
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRIC_BUCKETS = {
+    PAYLOAD_METRIC: (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+}
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+def _format_labels(labels, **extra):
+    pairs = sorted(labels) + sorted(extra.items())
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in pairs) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class InProcessMetrics(object):
+    """
+    Thread-safe in-process histograms, rendered in the Prometheus text
+    exposition format. Each process keeps its own numbers.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(METRIC_BUCKETS.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, labels in self._histograms}):
+                lines.extend(self._render_histogram(name))
+        return "\n".join(lines) + "\n"
+
+    def _render_histogram(self, name):
+        if name in METRIC_HELP:
+            yield "# HELP {} {}".format(name, METRIC_HELP[name])
+        yield "# TYPE {} histogram".format(name)
+        for (metric, labels), histogram in sorted(self._histograms.items()):
+            if metric == name:
+                yield from _render_series(name, labels, histogram)
+
+
+def _render_series(name, labels, histogram):
+    for bound, count in histogram.cumulative_counts():
+        yield "{}_bucket{} {}".format(name, _format_labels(labels, le=_format_bound(bound)), count)
+    yield "{}_sum{} {!r}".format(name, _format_labels(labels), histogram.sum)
+    yield "{}_count{} {}".format(name, _format_labels(labels), histogram.count)
+
+
+@lru_cache(maxsize=None)
+def get_metrics_sink():
+    """
+    Returns the process wide sink named by ``ZENDESK_METRICS_SINK``.
+    """
+    return import_string(get_setting("ZENDESK_METRICS_SINK"))()
+
+
+class PhaseTimer(object):
+    enabled = True
+
+    def __init__(self, server_timing):
+        self.server_timing = server_timing
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def finish(self, view, response):
+        sink = get_metrics_sink()
+        for name, duration in self.phases:
+            sink.observe(PHASE_METRIC, duration, phase=name)
+            phase_timed.send(sender=type(view), view=view, phase=name, duration=duration)
+        if self.server_timing:
+            response["Server-Timing"] = ", ".join(
+                "{};dur={:.3f}".format(name, duration * 1000) for name, duration in self.phases)
+        return response
+
+    def attach(self, view, response):
+        """
+        Finishes the timer now, or once ``response`` is rendered if it is a
+        template response that hasn't been rendered yet.
+        """
+        if getattr(response, "is_rendered", True):
+            return self.finish(view, response)
+        response.add_post_render_callback(lambda rendered: self.finish(view, rendered))
+        return response
+
+
+class NullTimer(object):
+    enabled = False
+    _context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._context
+
+    def finish(self, view, response):
+        return response
+
+    def attach(self, view, response):
+        return response
+
+
+NULL_TIMER = NullTimer()
+
+
+class TimedTemplateResponse(TemplateResponse):
+    """
+    Template response that records its rendering as the ``render`` phase
+    of ``timer``.
+    """
+    rendering_attrs = TemplateResponse.rendering_attrs + ["timer"]
+    timer = NULL_TIMER
+
+    @property
+    def rendered_content(self):
+        with self.timer.phase("render"):
+            return super(TimedTemplateResponse, self).rendered_content
+
+
+@lru_cache(maxsize=None)
+def _instrumentation_settings():
+    return get_setting("ZENDESK_INSTRUMENTATION"), get_setting("ZENDESK_SERVER_TIMING")
+
+
+def start_timer():
+    """
+    Returns a fresh ``PhaseTimer`` for a request, or the shared ``NullTimer``
+    when instrumentation is off.
+    """
+    enabled, server_timing = _instrumentation_settings()
+    return PhaseTimer(server_timing) if enabled else NULL_TIMER
+
+
+@receiver(setting_changed)
+def reset_instrumentation(setting, **kwargs):
+    if setting in ("ZENDESK_INSTRUMENTATION", "ZENDESK_SERVER_TIMING"):
+        _instrumentation_settings.cache_clear()
+    elif setting == "ZENDESK_METRICS_SINK":
+        get_metrics_sink.cache_clear()
+
+
+def prometheus_metrics(request):
+    """
+    Serves the metrics sink in the Prometheus text format. It isn't routed by
+    ``zendesk_auth.urls``; add it to your URLconf behind whatever protection
+    your metrics endpoints need.
+    """
+    return HttpResponse(get_metrics_sink().render_prometheus(), content_type="text/plain; version=0.0.4")
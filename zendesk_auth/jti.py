@@ -0,0 +1,97 @@
+"""
+JWT id (``jti``) generators.
+
+A generator is a callable returning a new, unique string each call. The
+default, ``CounterJTI``, takes no lock and leaks nothing about the host:
+ids are a random per-process prefix and a counter.
+"""
+import itertools
+import os
+import threading
+import uuid
+from functools import lru_cache
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+
+
+def _after_fork(callback):
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=callback)
+
+
+class CounterJTI(object):
+    """
+    ``<96 random bits>-<counter>``. ``next()`` on an ``itertools.count`` is
+    atomic, so threads never wait on each other. The prefix is redrawn in
+    forked children so workers never share ids.
+    """
+
+    def __init__(self):
+        self.reset()
+        _after_fork(self.reset)
+
+    def reset(self):
+        self.prefix = os.urandom(12).hex()
+        self.counter = itertools.count()
+
+    def __call__(self):
+        return "{}-{:x}".format(self.prefix, next(self.counter))
+
+
+class PooledRandomJTI(object):
+    """
+    128 random bits per id, cut from per-thread pools of ``os.urandom``
+    output so the system call is made once per ``pool_size`` bytes.
+    """
+    id_bytes = 16
+
+    def __init__(self, pool_size=4096):
+        self.pool_size = pool_size - pool_size % self.id_bytes
+        self.reset()
+        _after_fork(self.reset)
+
+    def reset(self):
+        self.local = threading.local()
+
+    def __call__(self):
+        local = self.local
+        offset = getattr(local, "offset", self.pool_size)
+        if offset >= self.pool_size:
+            local.pool = os.urandom(self.pool_size).hex()
+            offset = 0
+        local.offset = offset + self.id_bytes
+        return local.pool[offset * 2:(offset + self.id_bytes) * 2]
+
+
+class UUID1JTI(object):
+    """
+    The original behaviour. Takes a global lock and embeds the host's MAC
+    address in every token.
+    """
+
+    def __call__(self):
+        return str(uuid.uuid1())
+
+
+class UUID4JTI(object):
+
+    def __call__(self):
+        return str(uuid.uuid4())
+
+
+@lru_cache(maxsize=None)
+def get_jti_generator():
+    """
+    Returns the process wide generator named by ``ZENDESK_JTI_GENERATOR``.
+    """
+    return import_string(get_setting("ZENDESK_JTI_GENERATOR"))()
+
+
+@receiver(setting_changed)
+def reset_jti_generator(setting, **kwargs):
+    if setting == "ZENDESK_JTI_GENERATOR":
+        get_jti_generator.cache_clear()
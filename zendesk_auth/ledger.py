@@ -0,0 +1,164 @@
+"""
+Issued-token ledgers.
+
+A ledger records the ``jti`` of every token the views sign and reports ids
+it has seen before through the ``duplicate_jti_issued`` signal and the
+``zendesk_auth.ledger`` logger. Both ledgers use bounded memory and don't
+write to the database. ``arecord_issued`` is the async view's counterpart,
+which keeps ``CacheLedger``'s cache round trip off the event loop.
+"""
+import hashlib
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.signals import duplicate_jti_issued
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=4 * self.hashes).digest()
+        for i in range(0, len(digest), 4):
+            yield int.from_bytes(digest[i:i + 4], "little") % self.bits
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.array[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(self.array[position // 8] & (1 << (position % 8)) for position in self._positions(item))
+
+
+class MemoryLedger(object):
+    """
+    Remembers the last ``capacity`` ids exactly in a ring buffer, and older
+    ids in two rotating Bloom filters of ``capacity`` ids each. Only ring
+    buffer hits are reported as duplicates. Bloom filter hits can be false
+    positives (about 1% of ids at the default sizing), so they are only
+    logged at debug level as probable duplicates.
+    """
+
+    def __init__(self, capacity=10000, bloom_bits_per_id=10, bloom_hashes=7):
+        self.capacity = capacity
+        self.bloom_bits = capacity * bloom_bits_per_id
+        self.bloom_hashes = bloom_hashes
+        self.recent = deque(maxlen=capacity)
+        self.recent_set = set()
+        self.blooms = [self._new_bloom(), self._new_bloom()]
+        self.added = 0
+        self._lock = threading.Lock()
+
+    def _new_bloom(self):
+        return BloomFilter(self.bloom_bits, self.bloom_hashes)
+
+    def seen(self, jti):
+        return jti in self.recent_set
+
+    def probably_seen(self, jti):
+        return any(jti in bloom for bloom in self.blooms)
+
+    def record(self, jti):
+        """
+        Records ``jti`` and returns ``True`` if it is still in the ring
+        buffer.
+        """
+        with self._lock:
+            duplicate = self.seen(jti)
+            probable = not duplicate and self.probably_seen(jti)
+            self._add(jti)
+        if probable:
+            logger.debug("JWT id %s was probably issued before", jti)
+        return duplicate
+
+    async def arecord(self, jti):
+        # Only touches memory, so there's nothing to wait for.
+        return self.record(jti)
+
+    def _add(self, jti):
+        if len(self.recent) == self.capacity:
+            self.recent_set.discard(self.recent[0])
+        self.recent.append(jti)
+        self.recent_set.add(jti)
+
+        self.blooms[0].add(jti)
+        self.added += 1
+        if self.added % self.capacity == 0:
+            self.blooms = [self._new_bloom(), self.blooms[0]]
+
+
+class CacheLedger(object):
+    """
+    Records ids in a Django cache with ``cache.add``, so every process sharing
+    the cache sees every id issued in the last ``timeout`` seconds.
+    """
+
+    def __init__(self, alias="default", timeout=86400):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def record(self, jti):
+        return not self.cache.add(self.make_key(jti), 1, self.timeout)
+
+    async def arecord(self, jti):
+        return not await self.cache.aadd(self.make_key(jti), 1, self.timeout)
+
+    def make_key(self, jti):
+        return "zendesk_auth:jti:{}".format(jti)
+
+
+@lru_cache(maxsize=None)
+def get_ledger():
+    """
+    Returns the process wide ledger named by ``ZENDESK_JTI_LEDGER``, or
+    ``None`` when no ledger is configured.
+    """
+    backend = get_setting("ZENDESK_JTI_LEDGER")
+    if not backend:
+        return None
+    return import_string(backend)(**get_setting("ZENDESK_JTI_LEDGER_OPTIONS"))
+
+
+def record_issued(view, payload):
+    ledger = get_ledger()
+    if ledger is not None and ledger.record(payload["jti"]):
+        report_duplicate(view, payload)
+
+
+async def arecord_issued(view, payload):
+    ledger = get_ledger()
+    if ledger is not None and await _arecord(ledger, payload["jti"]):
+        report_duplicate(view, payload)
+
+
+async def _arecord(ledger, jti):
+    # Ledgers without ``arecord`` are run in a thread.
+    if hasattr(ledger, "arecord"):
+        return await ledger.arecord(jti)
+    return await sync_to_async(ledger.record)(jti)
+
+
+def report_duplicate(view, payload):
+    logger.warning("JWT id %s was issued more than once", payload["jti"])
+    duplicate_jti_issued.send(sender=type(view), view=view, jti=payload["jti"])
+
+
+@receiver(setting_changed)
+def reset_ledger(setting, **kwargs):
+    if setting.startswith("ZENDESK_JTI_LEDGER"):
+        get_ledger.cache_clear()
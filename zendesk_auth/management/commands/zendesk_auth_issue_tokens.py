@@ -0,0 +1,184 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from zendesk_auth import audit
+from zendesk_auth.conf import get_setting
+from zendesk_auth.ledger import record_issued
+
+FIELDS = ["user_id", "external_id", "email", "jti", "url", "jwt"]
+
+_signers = {}
+
+
+def sign_batch(backend, items):
+    """
+    Signs ``(key, payload)`` pairs, reusing one signer per backend and key
+    for the life of the process.
+    """
+    tokens = []
+    for key, payload in items:
+        signer = _signers.get((backend, key))
+        if signer is None:
+            signer = _signers[(backend, key)] = import_string(backend)(key)
+        tokens.append(signer.sign(payload))
+    return tokens
+
+
+def issue_range(options, pk_range):
+    """
+    Issues tokens for the users whose pks are in ``pk_range``. Runs in the
+    pool's worker processes, each with its own database connection, so
+    loading users and running the claim hooks scale with the workers too.
+    """
+    command = Command()
+    command.setup(options)
+    queryset = command.get_queryset(options["include_inactive"]).filter(pk__range=pk_range)
+    batches = command.get_batches(queryset, options["chunk_size"])
+    rows = list(itertools.chain.from_iterable(command.sign_inline(batches)))
+    audit_log = audit.get_audit_log()
+    if audit_log is not None:
+        audit_log.flush()
+    return rows
+
+
+class JSONLWriter(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, rows):
+        self.stream.write("".join(json.dumps(row) + "\n" for row in rows))
+
+
+class CSVWriter(object):
+
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, FIELDS)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+
+WRITERS = {"jsonl": JSONLWriter, "csv": CSVWriter}
+
+
+class Command(BaseCommand):
+    help = (
+        "Issues Zendesk JWT login links for many users. User pks are streamed from the "
+        "database in chunks and each chunk is handed to a worker process that loads the "
+        "users over its own database connection, builds their claims with the view's "
+        "hooks and signs the tokens. Workers are spawned and set up Django from "
+        "DJANGO_SETTINGS_MODULE. Zendesk only accepts tokens issued in the last few "
+        "minutes, so use the output right away. It contains credentials; keep it private."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view", default="zendesk_auth.views.ZendeskJWTAuthorize",
+                            help="dotted path to the view class whose claim hooks are used")
+        parser.add_argument("--tenant", help="name of the ZENDESK_TENANTS entry to issue for")
+        parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+        parser.add_argument("--output", help="file to write to, defaults to stdout")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="users loaded and signed per batch")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="worker processes, 0 issues in this process")
+        parser.add_argument("--include-inactive", action="store_true", help="also issue for inactive users")
+
+    def handle(self, **options):
+        self.setup(options)
+        output = open(options["output"], "w", newline="") if options["output"] else self.stdout
+        try:
+            count = self.write(WRITERS[options["format"]](output), options)
+        finally:
+            if options["output"]:
+                output.close()
+        self.stderr.write("Issued {} tokens".format(count))
+
+    def setup(self, options):
+        self.view_class = import_string(options["view"])
+        self.tenant = options["tenant"]
+        self.backend = get_setting("ZENDESK_JWT_SIGNER")
+
+    def write(self, writer, options):
+        count = 0
+        for rows in self.issue(options):
+            writer.write(rows)
+            count += len(rows)
+        return count
+
+    def issue(self, options):
+        if options["workers"] < 1:
+            queryset = self.get_queryset(options["include_inactive"])
+            return self.sign_inline(self.get_batches(queryset, options["chunk_size"]))
+        return self.issue_in_pool(options)
+
+    def get_users(self, include_inactive):
+        queryset = get_user_model()._default_manager.order_by("pk")
+        if not include_inactive:
+            queryset = queryset.filter(is_active=True)
+        return queryset
+
+    def get_queryset(self, include_inactive):
+        queryset = self.get_users(include_inactive)
+        loaded = self.view_class.get_claims_queryset(queryset)
+        return queryset if loaded is None else loaded
+
+    def get_batches(self, queryset, chunk_size):
+        users = queryset.iterator(chunk_size=chunk_size)
+        for chunk in iter(lambda: list(itertools.islice(users, chunk_size)), []):
+            views = [self.view_class.for_user(user, self.tenant) for user in chunk]
+            yield views, [(view.get_token(), view.build_payload(view.get_claims())) for view in views]
+
+    def sign_inline(self, batches):
+        for views, items in batches:
+            yield self.get_rows(views, items, sign_batch(self.backend, items))
+
+    def get_pk_ranges(self, chunk_size, include_inactive):
+        pks = self.get_users(include_inactive).values_list("pk", flat=True).iterator(chunk_size=chunk_size)
+        for chunk in iter(lambda: list(itertools.islice(pks, chunk_size)), []):
+            yield chunk[0], chunk[-1]
+
+    def get_pool(self, workers):
+        # Spawned rather than forked, so no worker shares this process'
+        # database connections; each opens its own.
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(workers, mp_context=context, initializer=django.setup)
+
+    def issue_in_pool(self, options):
+        # At most two ranges per worker are in flight, so memory stays
+        # bounded however many users there are.
+        worker_options = {name: options[name] for name in ("view", "tenant", "chunk_size", "include_inactive")}
+        workers = options["workers"]
+        with self.get_pool(workers) as pool:
+            pending = deque()
+            for pk_range in self.get_pk_ranges(options["chunk_size"], options["include_inactive"]):
+                pending.append(pool.submit(issue_range, worker_options, pk_range))
+                if len(pending) > workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def get_rows(self, views, items, tokens):
+        rows = []
+        for view, (key, payload), token in zip(views, items, tokens):
+            record_issued(view, payload)
+            audit.record_issued(view, payload)
+            rows.append({
+                "user_id": view.request.user.pk,
+                "external_id": payload.get("external_id"),
+                "email": payload.get("email"),
+                "jti": payload["jti"],
+                "url": view.get_access_url(token),
+                "jwt": token,
+            })
+        return rows
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.profiling import write_arm_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Arms every process serving ZendeskJWTAuthorize to profile its next requests. "
+        "Processes pick it up within ZENDESK_PROFILE_POLL_INTERVAL seconds and write "
+        "their dumps to ZENDESK_PROFILE_DIR."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=10, help="requests each process profiles")
+
+    def handle(self, **options):
+        directory = get_setting("ZENDESK_PROFILE_DIR")
+        if not directory:
+            raise CommandError("Set ZENDESK_PROFILE_DIR to profile requests")
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1")
+        write_arm_file(directory, options["requests"])
+        self.stdout.write("Armed profiling of the next {} requests, dumps go to {}".format(
+            options["requests"], directory))
@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from zendesk_auth.sync import MAX_BATCH_SIZE, UserSync
+
+
+class Command(BaseCommand):
+    help = (
+        "Pushes users whose claims changed since the last sync to Zendesk's "
+        "create_or_update_many endpoint, in batches of up to 100. Needs "
+        "ZENDESK_API_EMAIL and ZENDESK_API_TOKEN (or API_EMAIL and API_TOKEN on the tenant)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view", default="zendesk_auth.views.ZendeskJWTAuthorize",
+                            help="dotted path to the view class whose claim hooks are used")
+        parser.add_argument("--tenant", help="name of the ZENDESK_TENANTS entry to sync")
+        parser.add_argument("--checkpoint", help="file recording progress, so an interrupted sync resumes")
+        parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="users per request, at most 100")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="users loaded from the database at a time")
+        parser.add_argument("--force", action="store_true", help="push every user, changed or not")
+        parser.add_argument("--include-inactive", action="store_true", help="also sync inactive users")
+
+    def handle(self, **options):
+        queryset = get_user_model()._default_manager.all()
+        if not options["include_inactive"]:
+            queryset = queryset.filter(is_active=True)
+
+        sync = UserSync(
+            import_string(options["view"]), options["tenant"], checkpoint=options["checkpoint"],
+            batch_size=options["batch_size"], chunk_size=options["chunk_size"], force=options["force"],
+        )
+        try:
+            stats = sync.run(queryset)
+        finally:
+            sync.transport.close()
+        self.stdout.write("Checked {checked} users, pushed {pushed} in {batches} batches".format(**stats))
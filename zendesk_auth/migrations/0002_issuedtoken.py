@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zendesk_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IssuedToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(max_length=100)),
+                ('user_pk', models.CharField(db_index=True, max_length=255)),
+                ('jti', models.CharField(db_index=True, max_length=64)),
+                ('claims_hash', models.CharField(max_length=32)),
+                ('issued_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
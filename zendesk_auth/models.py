@@ -0,0 +1,33 @@
+from django.db import models
+
+
+class SyncedUser(models.Model):
+    """
+    Hash of the claims last pushed to Zendesk for a user, so
+    ``zendesk_auth.sync`` only pushes users whose claims changed.
+    """
+    tenant = models.CharField(max_length=100)
+    user_pk = models.CharField(max_length=255)
+    claims_hash = models.CharField(max_length=32)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [("tenant", "user_pk")]
+
+    def __str__(self):
+        return "{} {}".format(self.tenant, self.user_pk)
+
+
+class IssuedToken(models.Model):
+    """
+    Audit record of a token issued to a user, written by
+    ``zendesk_auth.audit.ModelSink``.
+    """
+    tenant = models.CharField(max_length=100)
+    user_pk = models.CharField(max_length=255, db_index=True)
+    jti = models.CharField(max_length=64, db_index=True)
+    claims_hash = models.CharField(max_length=32)
+    issued_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "{} {} {}".format(self.tenant, self.user_pk, self.jti)
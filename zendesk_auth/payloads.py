@@ -0,0 +1,104 @@
+"""
+Payload stage run on every token before it is signed.
+
+``ZENDESK_PAYLOAD_COMPACT_TAGS`` rewrites ``tags`` as one comma separated
+string of unique, lowercased tags (Zendesk lowercases tags anyway), which is
+shorter than a JSON list.
+
+``ZENDESK_PAYLOAD_MAX_BYTES`` caps the size of the JSON payload. Claims in
+``ZENDESK_PAYLOAD_CLAIM_POLICIES`` are shed in the order listed until it
+fits: ``"truncate"`` drops trailing list items (or tags, or characters of a
+string) and ``"drop"`` removes the claim. Other claims are never touched.
+
+With ``ZENDESK_INSTRUMENTATION`` on, the size of the payload and of each
+claim is recorded in the ``zendesk_auth_payload_bytes`` histogram.
+"""
+import logging
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.instrumentation import PAYLOAD_METRIC, get_metrics_sink
+from zendesk_auth.signers import json_dumps
+
+logger = logging.getLogger(__name__)
+
+
+def compact_tags(tags):
+    """
+    Returns ``tags`` (a list or a comma separated string) as a comma
+    separated string of unique, lowercased tags in their original order.
+    """
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    unique = dict.fromkeys(tag.strip().lower() for tag in tags)
+    return ",".join(tag for tag in unique if tag)
+
+
+def encoded_size(value):
+    return len(json_dumps(value))
+
+
+def claim_size(claim, value):
+    # "claim":value plus the separating comma.
+    return encoded_size({claim: value}) - 1
+
+
+def truncate(claim, value, excess):
+    """
+    Returns ``value`` (a list, a string or a comma separated ``tags``
+    string) shortened by at least ``excess`` encoded bytes, or as far as it
+    goes.
+    """
+    if claim == "tags" and isinstance(value, str):
+        return ",".join(_pop_items(value.split(","), excess, overhead=-1))
+    if isinstance(value, str):
+        return "".join(_pop_items(list(value), excess, overhead=-2))
+    return _pop_items(list(value), excess, overhead=1)
+
+
+def _pop_items(items, excess, overhead):
+    # Each item saves its encoded size plus ``overhead``: the comma in a list
+    # or tags string, less the quotes of an encoded string.
+    while items and excess > 0:
+        excess -= encoded_size(items.pop()) + overhead
+    return items
+
+
+def shed(payload, claim, policy, excess):
+    value = truncate(claim, payload[claim], excess) if policy == "truncate" else None
+    if value:
+        payload[claim] = value
+    else:
+        payload.pop(claim)
+
+
+def enforce_budget(payload, max_bytes):
+    """
+    Sheds claims from ``payload`` per ``ZENDESK_PAYLOAD_CLAIM_POLICIES``
+    until it encodes to at most ``max_bytes``.
+    """
+    size = encoded_size(payload)
+    for claim, policy in get_setting("ZENDESK_PAYLOAD_CLAIM_POLICIES").items():
+        if size > max_bytes and claim in payload:
+            shed(payload, claim, policy, size - max_bytes)
+            size = encoded_size(payload)
+    if size > max_bytes:
+        logger.warning("JWT payload is %d bytes, over the %d byte budget", size, max_bytes)
+    return payload
+
+
+def record_sizes(payload):
+    sink = get_metrics_sink()
+    sink.observe(PAYLOAD_METRIC, encoded_size(payload), claim="total")
+    for claim, value in payload.items():
+        sink.observe(PAYLOAD_METRIC, claim_size(claim, value), claim=claim)
+
+
+def prepare_payload(payload):
+    if payload.get("tags") and get_setting("ZENDESK_PAYLOAD_COMPACT_TAGS"):
+        payload["tags"] = compact_tags(payload["tags"])
+    max_bytes = get_setting("ZENDESK_PAYLOAD_MAX_BYTES")
+    if max_bytes is not None:
+        enforce_budget(payload, max_bytes)
+    if get_setting("ZENDESK_INSTRUMENTATION"):
+        record_sizes(payload)
+    return payload
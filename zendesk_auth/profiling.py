@@ -0,0 +1,274 @@
+"""
+Sampled, on-demand profiling of ``ZendeskJWTAuthorize`` requests.
+
+With ``ZENDESK_PROFILE_DIR`` set, a request is profiled with cProfile (and,
+with ``ZENDESK_PROFILE_MEMORY``, tracemalloc) when it is picked by
+``ZENDESK_PROFILE_SAMPLE_RATE`` or when the process has been armed to
+profile its next requests, by:
+
+* ``manage.py zendesk_auth_profile --requests N``, which writes an arm file
+  every process picks up within ``ZENDESK_PROFILE_POLL_INTERVAL`` seconds
+* the ``ZENDESK_PROFILE_SIGNAL`` signal (e.g. ``"SIGRTMIN"``), which arms the
+  process it is sent to for ``ZENDESK_PROFILE_SIGNAL_REQUESTS`` requests.
+  Application servers handle ``SERVER_SIGNALS`` themselves (gunicorn's
+  master upgrades on SIGUSR2 and its workers reset it), so don't use those.
+
+Each profiled request is dumped to ``<timestamp>-<pid>-<n>-<view>.prof``
+(pstats format) and ``.tracemalloc`` files in the directory; only the
+newest ``ZENDESK_PROFILE_MAX_DUMPS`` are kept. A process profiles one
+request at a time. Requests that aren't sampled only cost a random number
+and a clock read.
+"""
+import cProfile
+import collections
+import itertools
+import logging
+import os
+import random
+import signal
+import threading
+import time
+import tracemalloc
+from functools import lru_cache
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from zendesk_auth.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+ARM_FILE = "armed"
+DUMP_SUFFIXES = (".prof", ".tracemalloc")
+SERVER_SIGNALS = frozenset([
+    "SIGHUP", "SIGINT", "SIGQUIT", "SIGTERM", "SIGCHLD", "SIGUSR1", "SIGUSR2", "SIGWINCH", "SIGTTIN", "SIGTTOU",
+])
+
+
+def read_arm_file(path):
+    """
+    Returns the ``(mtime, requests)`` of an arm file, ``(None, 0)`` when
+    there isn't one.
+    """
+    try:
+        with open(path) as f:
+            return os.fstat(f.fileno()).st_mtime_ns, int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return None, 0
+
+
+def write_arm_file(directory, requests):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, ARM_FILE)
+    with open(path + ".tmp", "w") as f:
+        f.write(str(requests))
+    os.replace(path + ".tmp", path)
+
+
+class Profile(object):
+    """
+    cProfile (and tracemalloc) data of one request, written by ``stop()``.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.memory = profiler.memory and not tracemalloc.is_tracing()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        if self.memory:
+            tracemalloc.start()
+
+    def stop(self):
+        self.profile.disable()
+        try:
+            snapshot = tracemalloc.take_snapshot() if self.memory else None
+            self.profiler.dump(self, snapshot)
+        except Exception:
+            logger.exception("Could not write the profile of a %s request", self.name)
+        finally:
+            if self.memory:
+                tracemalloc.stop()
+            self.profiler.release()
+
+
+class Profiler(object):
+    """
+    Decides which requests are profiled and writes their dumps to
+    ``directory``.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, memory=False, max_dumps=100, poll_interval=1.0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.memory = memory
+        self.max_dumps = max_dumps
+        self.poll_interval = poll_interval
+        self.armed = 0
+        self._arms = collections.deque()
+        self._busy = threading.Lock()
+        self._arm_lock = threading.Lock()
+        self._counter = itertools.count()
+        self._next_poll = 0.0
+        self._arm_mtime = read_arm_file(self.arm_path)[0]
+
+    @property
+    def arm_path(self):
+        return os.path.join(self.directory, ARM_FILE)
+
+    def arm(self, requests):
+        """
+        Profiles the next ``requests`` requests of this process. Safe to call
+        from a signal handler.
+        """
+        self._arms.append(requests)
+
+    def start(self, name):
+        """
+        Returns a running ``Profile`` when this request is picked, else
+        ``None``.
+        """
+        if random.random() >= self.sample_rate and not self._is_armed():
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        return self._start(name)
+
+    def _start(self, name):
+        self._disarm()
+        try:
+            return Profile(self, name)
+        except ValueError:
+            # Another profiler is already active.
+            self.release()
+            return None
+
+    def release(self):
+        self._busy.release()
+
+    def _is_armed(self):
+        if self._arms or time.monotonic() >= self._next_poll:
+            with self._arm_lock:
+                self._collect_arms()
+        return self.armed > 0
+
+    def _collect_arms(self):
+        while self._arms:
+            self.armed += self._arms.popleft()
+        if time.monotonic() >= self._next_poll:
+            self._next_poll = time.monotonic() + self.poll_interval
+            self._poll_arm_file()
+
+    def _poll_arm_file(self):
+        mtime, requests = read_arm_file(self.arm_path)
+        if mtime != self._arm_mtime:
+            self._arm_mtime = mtime
+            self.armed += requests
+
+    def _disarm(self):
+        with self._arm_lock:
+            self.armed = max(0, self.armed - 1)
+
+    def dump(self, profile, snapshot=None):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(self.directory, "{}-{}-{:06d}-{}".format(
+            time.strftime("%Y%m%dT%H%M%S"), os.getpid(), next(self._counter), profile.name))
+        profile.profile.dump_stats(stem + ".prof")
+        if snapshot is not None:
+            snapshot.dump(stem + ".tracemalloc")
+        self.rotate()
+
+    def rotate(self):
+        """
+        Removes all but the newest ``max_dumps`` dumps.
+        """
+        stems = sorted({os.path.splitext(name)[0] for name in os.listdir(self.directory)
+                        if name.endswith(DUMP_SUFFIXES)})
+        for stem in stems[:max(0, len(stems) - self.max_dumps)]:
+            for suffix in DUMP_SUFFIXES:
+                _remove(os.path.join(self.directory, stem + suffix))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_profiler():
+    """
+    Returns the process wide profiler, or ``None`` when
+    ``ZENDESK_PROFILE_DIR`` isn't set.
+    """
+    directory = get_setting("ZENDESK_PROFILE_DIR")
+    if not directory:
+        return None
+    return Profiler(
+        directory,
+        sample_rate=get_setting("ZENDESK_PROFILE_SAMPLE_RATE"),
+        memory=get_setting("ZENDESK_PROFILE_MEMORY"),
+        max_dumps=get_setting("ZENDESK_PROFILE_MAX_DUMPS"),
+        poll_interval=get_setting("ZENDESK_PROFILE_POLL_INTERVAL"),
+    )
+
+
+def start(view):
+    profiler = get_profiler()
+    if profiler is None:
+        return None
+    return profiler.start(type(view).__name__)
+
+
+def attach(profile, response):
+    """
+    Stops ``profile`` now, or once ``response`` is rendered if it is a
+    template response that hasn't been rendered yet.
+    """
+    if profile is None or getattr(response, "is_rendered", True):
+        stop(profile)
+    else:
+        response.render = _stopping_render(response, profile)
+    return response
+
+
+def _stopping_render(response, profile):
+    # Unlike a post-render callback, this also stops when rendering raises.
+    render = response.render
+
+    def render_and_stop():
+        try:
+            return render()
+        finally:
+            # Restores the class's render(), and keeps the response picklable.
+            del response.render
+            profile.stop()
+    return render_and_stop
+
+
+def stop(profile):
+    if profile is not None:
+        profile.stop()
+
+
+def handle_signal(signum, frame):
+    profiler = get_profiler()
+    if profiler is not None:
+        profiler.arm(get_setting("ZENDESK_PROFILE_SIGNAL_REQUESTS"))
+
+
+def install_signal_handler():
+    """
+    Arms the profiler on ``ZENDESK_PROFILE_SIGNAL``. Signal handlers can
+    only be installed from the main thread, so this is a no-op elsewhere.
+    """
+    name = get_setting("ZENDESK_PROFILE_SIGNAL")
+    if name and threading.current_thread() is threading.main_thread():
+        signal.signal(getattr(signal, name), handle_signal)
+
+
+@receiver(setting_changed)
+def reset_profiler(setting, **kwargs):
+    if setting.startswith("ZENDESK_PROFILE"):
+        get_profiler.cache_clear()
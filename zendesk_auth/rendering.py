@@ -0,0 +1,70 @@
+"""
+Template-free rendering of the passthrough page.
+
+The template is rendered once with a unique marker in place of every context
+value and split into static byte chunks around the markers. Each response is
+then the static chunks joined with the escaped values. Templates must output
+the values as plain ``{{ variable }}`` tags for this to work.
+"""
+import re
+import uuid
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.template.loader import select_template
+from django.utils.html import escape
+
+
+class PrecompiledTemplate(object):
+
+    def __init__(self, template_names, fields):
+        nonce = uuid.uuid4().hex
+        markers = {field: "zdm{}{}zdm".format(nonce, i) for i, field in enumerate(fields)}
+        html = select_template(template_names).render(markers)
+
+        by_marker = {marker: field for field, marker in markers.items()}
+        pieces = re.split("({})".format("|".join(markers.values())), html)
+        if nonce in "".join(pieces[::2]).lower():
+            raise ImproperlyConfigured(
+                "{} alters its context values and can't be precompiled.".format(template_names[0]))
+
+        self.chunks = [piece.encode("utf-8") for piece in pieces[::2]]
+        self.fields = [by_marker[marker] for marker in pieces[1::2]]
+        self.static_length = sum(len(chunk) for chunk in self.chunks)
+
+    def render(self, context):
+        parts = [self.chunks[0]]
+        length = self.static_length
+        for field, chunk in zip(self.fields, self.chunks[1:]):
+            value = escape(context[field]).encode("utf-8")
+            length += len(value)
+            parts.extend((value, chunk))
+        return b"".join(parts), length
+
+    def render_to_response(self, context, **response_kwargs):
+        body, length = self.render(context)
+        response = HttpResponse(body, **response_kwargs)
+        response["Content-Length"] = length
+        return response
+
+
+@lru_cache(maxsize=None)
+def _get_precompiled_template(template_names, fields):
+    return PrecompiledTemplate(template_names, fields)
+
+
+def get_precompiled_template(template_names, fields):
+    """
+    Returns the compiled template for the first of ``template_names`` that
+    the template loaders find, compiled once per process.
+    """
+    return _get_precompiled_template(tuple(template_names), tuple(sorted(fields)))
+
+
+@receiver(setting_changed)
+def clear_precompiled_templates(setting, **kwargs):
+    if setting in ("TEMPLATES", "INSTALLED_APPS"):
+        _get_precompiled_template.cache_clear()
@@ -0,0 +1,180 @@
+"""
+Concurrent resolution of a view's claims.
+
+By default the claim hooks run one after another. Hooks of the claims named
+in ``ZENDESK_CONCURRENT_CLAIMS`` (e.g. ones calling a CRM) are started
+first and run concurrently with each other and the remaining hooks: sync
+hooks on a shared pool of ``ZENDESK_CLAIM_WORKERS`` threads, ``async def``
+hooks (in the async view) on the event loop. A request then waits for its
+slowest claim rather than the sum of them.
+
+Each concurrent claim gets ``ZENDESK_CLAIM_TIMEOUTS[claim]`` seconds
+(``ZENDESK_CLAIM_DEFAULT_TIMEOUT`` when not listed), counted from the start
+of resolution. When a hook times out or raises, the claim takes its value
+from ``ZENDESK_CLAIM_FALLBACKS``, where ``None`` omits it from the token;
+claims without a fallback raise as before. Fallbacks are logged, send
+``claim_fallback`` and mark the view's claims as partial (``claims_partial``),
+so they aren't stored in the claims cache or the session; and with ``ZENDESK_INSTRUMENTATION`` on every
+concurrent claim's wait and outcome is recorded in the
+``zendesk_auth_claim_seconds`` histogram.
+
+A timed out sync hook keeps its thread until it returns, so give hooks
+their own client timeouts too.
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.instrumentation import CLAIM_METRIC, get_metrics_sink
+from zendesk_auth.signals import claim_fallback
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+TIMEOUT = "timeout"
+ERROR = "error"
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return concurrent.futures.ThreadPoolExecutor(
+        get_setting("ZENDESK_CLAIM_WORKERS"), thread_name_prefix="zendesk-auth-claim")
+
+
+def split_hooks(claim_hooks):
+    """
+    Returns ``claim_hooks`` split into those run in order and those run
+    concurrently.
+    """
+    concurrent_claims = get_setting("ZENDESK_CONCURRENT_CLAIMS")
+    if not concurrent_claims:
+        return claim_hooks, ()
+    return (tuple((claim, hook) for claim, hook in claim_hooks if claim not in concurrent_claims),
+            tuple((claim, hook) for claim, hook in claim_hooks if claim in concurrent_claims))
+
+
+def get_remaining(claim, start):
+    timeout = get_setting("ZENDESK_CLAIM_TIMEOUTS").get(claim, get_setting("ZENDESK_CLAIM_DEFAULT_TIMEOUT"))
+    return None if timeout is None else max(0, start + timeout - time.monotonic())
+
+
+def record(view, claim, outcome, start):
+    if get_setting("ZENDESK_INSTRUMENTATION"):
+        get_metrics_sink().observe(CLAIM_METRIC, time.monotonic() - start, claim=claim, outcome=outcome)
+
+
+def fallback(view, claim, reason, start, exc):
+    """
+    Returns the ``ZENDESK_CLAIM_FALLBACKS`` value of ``claim``; raises
+    ``exc``, the hook's error or timeout, when it has none.
+    """
+    fallbacks = get_setting("ZENDESK_CLAIM_FALLBACKS")
+    record(view, claim, reason, start)
+    if claim not in fallbacks:
+        raise exc
+    logger.warning("Claim %s of %s fell back after a %s", claim, type(view).__name__, reason,
+                   exc_info=reason == ERROR)
+    claim_fallback.send(sender=type(view), view=view, claim=claim, reason=reason)
+    view.claims_partial = True
+    return fallbacks[claim]
+
+
+def call_hook(method):
+    try:
+        return method()
+    finally:
+        # Pool threads outlive requests, so treat each hook like one: close
+        # connections that are broken or past CONN_MAX_AGE, keep the rest.
+        close_old_connections()
+
+
+def get_result(view, claim, future, start):
+    try:
+        value = future.result(get_remaining(claim, start))
+    except concurrent.futures.TimeoutError as exc:
+        future.cancel()
+        return fallback(view, claim, TIMEOUT, start, exc)
+    except Exception as exc:
+        return fallback(view, claim, ERROR, start, exc)
+    record(view, claim, OK, start)
+    return value
+
+
+def resolve_claims(view):
+    """
+    Returns ``{claim: value}`` for ``view``'s ``claim_hooks``.
+    """
+    in_order, concurrent_hooks = split_hooks(view.claim_hooks)
+    start = time.monotonic()
+    futures = [(claim, get_executor().submit(call_hook, getattr(view, hook))) for claim, hook in concurrent_hooks]
+    claims = {claim: getattr(view, hook)() for claim, hook in in_order}
+    for claim, future in futures:
+        claims[claim] = get_result(view, claim, future, start)
+    return _in_hook_order(view, claims) if futures else claims
+
+
+def _in_hook_order(view, claims):
+    return {claim: claims[claim] for claim, hook in view.claim_hooks}
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _call(view, hook):
+    # Overridden sync hooks may query the database, which can't be done on
+    # the event loop; the built-in ones only read attributes.
+    method = getattr(view, hook)
+    if inspect.iscoroutinefunction(method) or view.is_builtin_hook(hook):
+        return await _resolve(method())
+    return await _resolve(await sync_to_async(method)())
+
+
+def _start(method):
+    if inspect.iscoroutinefunction(method):
+        return asyncio.ensure_future(method())
+    return asyncio.get_running_loop().run_in_executor(get_executor(), call_hook, method)
+
+
+async def aget_result(view, claim, task, start):
+    try:
+        value = await asyncio.wait_for(task, get_remaining(claim, start))
+    except asyncio.TimeoutError as exc:
+        return fallback(view, claim, TIMEOUT, start, exc)
+    except Exception as exc:
+        return fallback(view, claim, ERROR, start, exc)
+    record(view, claim, OK, start)
+    return value
+
+
+async def aresolve_claims(view):
+    """
+    Async counterpart of ``resolve_claims``; hooks may be sync or
+    ``async def``. Overridden sync hooks run in a thread.
+    """
+    in_order, concurrent_hooks = split_hooks(view.claim_hooks)
+    start = time.monotonic()
+    tasks = [(claim, _start(getattr(view, hook))) for claim, hook in concurrent_hooks]
+    claims = {}
+    for claim, hook in in_order:
+        claims[claim] = await _call(view, hook)
+    values = await asyncio.gather(*(aget_result(view, claim, task, start) for claim, task in tasks))
+    claims.update(zip((claim for claim, task in tasks), values))
+    return _in_hook_order(view, claims) if tasks else claims
+
+
+@receiver(setting_changed)
+def reset_executor(setting, **kwargs):
+    if setting == "ZENDESK_CLAIM_WORKERS":
+        get_executor.cache_clear()
@@ -0,0 +1,200 @@
+"""
+Claims computed at login and carried in the session.
+
+Users usually log in right before being sent to the authorize view. With
+``ZENDESK_SESSION_CLAIMS`` set, a ``user_logged_in`` receiver runs the claim
+hooks of ``ZENDESK_SESSION_CLAIMS_VIEW`` at login and stores the non-empty
+claims in the session, stamped with the view's claims version, the user, the
+tenant and the time. The authorize views use them while they are at most
+``ZENDESK_SESSION_CLAIMS_MAX_AGE`` seconds old and compute claims as usual
+otherwise, so the lookups happen on the login request instead of the
+redirect to Zendesk.
+
+``"inline"`` computes the claims in the receiver. ``"thread"`` computes them
+on a small thread pool while the login view finishes, and
+``SessionClaimsMiddleware`` (after ``SessionMiddleware`` in ``MIDDLEWARE``)
+waits up to ``ZENDESK_SESSION_CLAIMS_TIMEOUT`` seconds for them before the
+session is saved; late claims are dropped. In both modes a hook that raises
+is logged and nothing is stored, so the login itself never fails.
+
+Stored claims aren't invalidated by ``depends_on`` signals; the max age
+bounds how stale they can be.
+"""
+import concurrent.futures
+import logging
+import time
+from functools import lru_cache
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.http import Http404
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+
+from zendesk_auth import tenants
+from zendesk_auth.cache import get_claims_version
+from zendesk_auth.conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "_zendesk_auth_claims"
+MODES = ("inline", "thread")
+
+_FUTURE_ATTR = "_zendesk_auth_claims_future"
+
+
+def make_entry(view_class, user, tenant, claims):
+    return {
+        "v": get_claims_version(view_class),
+        "u": str(user.pk),
+        "n": tenant,
+        "t": int(time.time()),
+        "c": {claim: value for claim, value in claims.items() if value},
+    }
+
+
+def compute(view_class, user, tenant):
+    view = view_class.for_user(user, tenant)
+    # The user comes from the login, not from ``get_claims_queryset``.
+    view.claims_user_loaded = False
+    if hasattr(view, "acompute_claims"):
+        claims = async_to_sync(view.acompute_claims)()
+    else:
+        claims = view.compute_claims()
+    if view.claims_partial:
+        logger.info("Not storing the Zendesk claims of user %s, some fell back", user.pk)
+        return None
+    return make_entry(view_class, user, tenant, claims)
+
+
+def compute_or_log(view_class, user, tenant):
+    try:
+        return compute(view_class, user, tenant)
+    except Exception:
+        logger.exception("Could not precompute the Zendesk claims of user %s", user.pk)
+        return None
+
+
+def compute_in_thread(view_class, user, tenant):
+    try:
+        return compute_or_log(view_class, user, tenant)
+    finally:
+        connections.close_all()
+
+
+@lru_cache(maxsize=None)
+def get_view_class():
+    return import_string(get_setting("ZENDESK_SESSION_CLAIMS_VIEW"))
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return concurrent.futures.ThreadPoolExecutor(
+        get_setting("ZENDESK_SESSION_CLAIMS_WORKERS"), thread_name_prefix="zendesk-auth-claims")
+
+
+def _get_tenant_name(request):
+    # The test client's ``login()`` sends a bare request without a host.
+    has_host = "HTTP_HOST" in request.META or "SERVER_NAME" in request.META
+    try:
+        return tenants.get_tenant(request if has_host else None).name
+    except Http404:
+        return None
+
+
+def precompute_claims(sender, request, user, **kwargs):
+    """
+    ``user_logged_in`` receiver storing (or, in ``"thread"`` mode,
+    scheduling) the user's claims for the session.
+    """
+    mode = get_setting("ZENDESK_SESSION_CLAIMS")
+    tenant = _get_tenant_name(request) if mode and hasattr(request, "session") else None
+    if tenant is None:
+        return
+    if mode == "thread":
+        setattr(request, _FUTURE_ATTR, get_executor().submit(compute_in_thread, get_view_class(), user, tenant))
+    else:
+        _store(request, compute_or_log(get_view_class(), user, tenant))
+
+
+def join(request):
+    """
+    Stores the claims scheduled at login in the session, if they are ready
+    within ``ZENDESK_SESSION_CLAIMS_TIMEOUT`` seconds.
+    """
+    future = getattr(request, _FUTURE_ATTR, None)
+    _store(request, _wait(future) if future is not None else None)
+
+
+def _store(request, entry):
+    if entry is not None:
+        request.session[SESSION_KEY] = entry
+
+
+def _wait(future):
+    try:
+        return future.result(get_setting("ZENDESK_SESSION_CLAIMS_TIMEOUT"))
+    except concurrent.futures.TimeoutError:
+        logger.info("Zendesk claims weren't ready when the login response was sent")
+        return None
+
+
+class SessionClaimsMiddleware(MiddlewareMixin):
+    """
+    Stores claims computed by ``ZENDESK_SESSION_CLAIMS = "thread"`` in the
+    session. Must come after ``SessionMiddleware``.
+    """
+
+    def process_response(self, request, response):
+        join(request)
+        return response
+
+
+def fresh_claims(view, entry):
+    """
+    Returns the claims in a session ``entry`` when they were computed for
+    ``view``'s class, user and tenant within the max age, else ``None``.
+    """
+    if entry is None or entry["v"] != get_claims_version(type(view)):
+        return None
+    if entry["u"] != str(view.request.user.pk) or entry["n"] != view.get_tenant().name:
+        return None
+    if time.time() - entry["t"] > get_setting("ZENDESK_SESSION_CLAIMS_MAX_AGE"):
+        return None
+    return entry["c"]
+
+
+def _get_session(view):
+    if not get_setting("ZENDESK_SESSION_CLAIMS"):
+        return None
+    return getattr(getattr(view, "request", None), "session", None)
+
+
+def get_claims(view):
+    session = _get_session(view)
+    if session is None:
+        return None
+    return fresh_claims(view, session.get(SESSION_KEY))
+
+
+async def aget_claims(view):
+    session = _get_session(view)
+    if session is None:
+        return None
+    return fresh_claims(view, await _aget(session, SESSION_KEY))
+
+
+async def _aget(session, key):
+    # The async session API is new in Django 5.0.
+    if hasattr(session, "aget"):
+        return await session.aget(key)
+    return await sync_to_async(session.get)(key)
+
+
+@receiver(setting_changed)
+def reset_session_claims(setting, **kwargs):
+    if setting.startswith("ZENDESK_SESSION_CLAIMS"):
+        get_view_class.cache_clear()
+        get_executor.cache_clear()
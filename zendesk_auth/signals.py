@@ -0,0 +1,18 @@
+from django.dispatch import Signal
+
+# Sent once per timed phase of an authorize request when
+# ZENDESK_INSTRUMENTATION is on. Arguments: view, phase, duration (seconds).
+phase_timed = Signal()
+
+# Sent when the configured ZENDESK_JTI_LEDGER has seen a newly issued jti
+# before. Arguments: view, jti.
+duplicate_jti_issued = Signal()
+
+# Sent when a request is over a ZENDESK_THROTTLE_* limit. Arguments: view,
+# scope ("user", "global" or "loop"), retry_after (seconds).
+request_throttled = Signal()
+
+# Sent when a concurrently resolved claim times out or fails and its
+# ZENDESK_CLAIM_FALLBACKS value is used. Arguments: view, claim, reason
+# ("timeout" or "error").
+claim_fallback = Signal()
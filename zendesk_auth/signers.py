@@ -0,0 +1,145 @@
+"""
+JWT signing backends.
+
+``HS256Signer`` does all of the constant work once per Zendesk token: the
+header segment is encoded up front and the HMAC is keyed once, then copied
+for every token it signs. ``PyJWTSigner`` goes through ``jwt.encode`` and is
+kept as the reference implementation.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import random
+from functools import lru_cache
+
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_string
+
+import jwt
+
+from zendesk_auth.conf import get_setting
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def base64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def json_dumps(payload):
+    """
+    Compact JSON exactly as PyJWT writes it. orjson is used when it is
+    installed, the payload only holds strings, integers, booleans, ``None``,
+    lists, tuples and dicts with string keys, and the output is pure
+    printable ASCII: the case where it is byte-for-byte identical to
+    ``json.dumps(ensure_ascii=True)``. Everything else goes through json,
+    including floats (orjson writes ``1e16`` where json writes ``1e+16``),
+    integers over 64 bits, and the UUIDs and datetimes orjson encodes but
+    json rejects.
+    """
+    data = _orjson_dumps(payload) if orjson is not None else None
+    if data is not None and data.isascii() and b"\x7f" not in data:
+        return data
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def _orjson_dumps(payload):
+    if not _is_plain(payload):
+        return None
+    try:
+        return orjson.dumps(payload)
+    except orjson.JSONEncodeError:
+        return None
+
+
+PLAIN_TYPES = frozenset([str, int, bool, type(None)])
+
+
+def _is_plain(value):
+    if type(value) is dict:
+        return all(type(key) is str and _is_plain(item) for key, item in value.items())
+    if type(value) in (list, tuple):
+        return all(_is_plain(item) for item in value)
+    return type(value) in PLAIN_TYPES
+
+
+class PyJWTSigner(object):
+    """
+    Reference signer, hands every payload to ``jwt.encode``.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def sign(self, payload):
+        token = jwt.encode(payload, self.key)
+        try:
+            return token.decode()
+        except AttributeError:
+            return token
+
+
+class HS256Signer(object):
+    """
+    Precompiled HS256 signer producing the same bytes as ``PyJWTSigner``.
+    """
+    header = {"typ": "JWT", "alg": "HS256"}
+
+    def __init__(self, key):
+        self.key = key
+        self._prefix = base64url_encode(json_dumps(self.header)) + b"."
+        self._hmac = hmac.new(force_bytes(key), digestmod=hashlib.sha256)
+
+    def sign(self, payload):
+        signing_input = self._prefix + base64url_encode(json_dumps(payload))
+        mac = self._hmac.copy()
+        mac.update(signing_input)
+        signature = base64url_encode(mac.digest())
+        return (signing_input + b"." + signature).decode("ascii")
+
+
+class ShadowVerifyingSigner(object):
+    """
+    Signs with ``signer`` and, for a sample of ``rate`` of the calls, also
+    signs with ``reference``. A mismatch is logged and the reference token is
+    returned so a broken signer can never hand Zendesk a bad token.
+    """
+
+    def __init__(self, signer, reference, rate):
+        self.signer = signer
+        self.reference = reference
+        self.rate = rate
+
+    def sign(self, payload):
+        token = self.signer.sign(payload)
+        if random.random() >= self.rate:
+            return token
+
+        expected = self.reference.sign(payload)
+        if token != expected:
+            logger.error("JWT signer %r produced a token that does not match %r",
+                         self.signer, self.reference)
+        return expected
+
+
+@lru_cache(maxsize=32)
+def _build_signer(backend, key, shadow_rate):
+    signer = import_string(backend)(key)
+    if shadow_rate > 0:
+        signer = ShadowVerifyingSigner(signer, PyJWTSigner(key), shadow_rate)
+    return signer
+
+
+def get_signer(key):
+    """
+    Returns the configured signer for ``key``, built once per key.
+    """
+    return _build_signer(get_setting("ZENDESK_JWT_SIGNER"), key,
+                         get_setting("ZENDESK_JWT_SHADOW_VERIFY_RATE"))
@@ -0,0 +1,226 @@
+"""
+Incremental push of user profiles to Zendesk.
+
+``UserSync`` builds every user's claims with a view's claim hooks, hashes
+the resulting Zendesk user and compares it with the hash stored in
+``SyncedUser`` by the last sync. Changed users are pushed in batches of 100
+to ``/api/v2/users/create_or_update_many.json`` and their hashes stored once
+Zendesk accepts the batch. Zendesk processes the batch as a background job;
+``UserSync`` does not wait for it.
+"""
+import base64
+import datetime
+import email.utils
+import hashlib
+import http.client
+import itertools
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.models import SyncedUser
+from zendesk_auth.tenants import get_tenant
+
+logger = logging.getLogger(__name__)
+
+CREATE_OR_UPDATE_MANY_PATH = "/api/v2/users/create_or_update_many.json"
+
+# Zendesk's limit for create_or_update_many.
+MAX_BATCH_SIZE = 100
+
+
+class TransportError(Exception):
+    pass
+
+
+class HTTPTransport(object):
+    """
+    Posts JSON to one Zendesk instance over a single kept-alive connection,
+    retrying connection errors, 429 and 5xx responses with backoff
+    (honouring ``Retry-After``).
+    """
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, base_url, email, api_token, timeout=30, retries=5, backoff=1.0):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        credentials = "{}/token:{}".format(email, api_token).encode("utf-8")
+        self.headers = {
+            "Authorization": "Basic " + base64.b64encode(credentials).decode("ascii"),
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        self.retries = retries
+        self.backoff = backoff
+
+    def post(self, path, data):
+        body = json.dumps(data).encode("utf-8")
+        for attempt in range(self.retries + 1):
+            status, headers, content = self._request(path, body)
+            if status is not None and status < 500 and status != 429:
+                return self._decode(status, content)
+            self.sleep(self._delay(attempt, headers))
+        raise TransportError("POST {} failed after {} attempts (last status {})".format(
+            path, self.retries + 1, status))
+
+    def _request(self, path, body):
+        try:
+            self.connection.request("POST", path, body, self.headers)
+            response = self.connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        except (OSError, http.client.HTTPException) as error:
+            logger.warning("Zendesk request failed: %s", error)
+            self.connection.close()
+            return None, {}, b""
+
+    def _delay(self, attempt, headers):
+        backoff = self.backoff * 2 ** attempt
+        retry_after = headers.get("Retry-After")
+        if not retry_after:
+            return backoff
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            return self._seconds_until(retry_after, backoff)
+
+    def _seconds_until(self, http_date, default):
+        # Retry-After may also be an HTTP-date; fall back to backoff when
+        # it's neither that nor a number of seconds.
+        try:
+            retry_at = email.utils.parsedate_to_datetime(http_date)
+            return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return default
+
+    def _decode(self, status, content):
+        if status >= 300:
+            raise TransportError("Zendesk responded {}: {}".format(status, content[:500]))
+        return json.loads(content.decode("utf-8")) if content else {}
+
+    def close(self):
+        self.connection.close()
+
+
+def to_zendesk_user(claims):
+    """
+    Maps JWT claims to a user for Zendesk's users API.
+    """
+    user = {key: claims[key] for key in ("email", "name", "external_id", "remote_photo_url") if claims.get(key)}
+    if claims.get("organization"):
+        user["organization"] = {"name": claims["organization"]}
+    if claims.get("tags"):
+        tags = claims["tags"]
+        user["tags"] = tags.split(",") if isinstance(tags, str) else list(tags)
+    return user
+
+
+def hash_zendesk_user(user):
+    data = json.dumps(user, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class UserSync(object):
+    """
+    Pushes the users of ``queryset`` whose claims changed since the last
+    sync. ``checkpoint`` is a file recording the last user pk processed, so
+    an interrupted sync resumes where it stopped.
+    """
+
+    def __init__(self, view_class, tenant=None, transport=None, checkpoint=None,
+                 batch_size=MAX_BATCH_SIZE, chunk_size=2000, force=False):
+        self.view_class = view_class
+        self.tenant = get_tenant(name=tenant)
+        self.transport = transport or import_string(get_setting("ZENDESK_SYNC_TRANSPORT"))(
+            self.tenant.url, self.tenant.api_email, self.tenant.api_token)
+        self.checkpoint = checkpoint
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.chunk_size = chunk_size
+        self.force = force
+        self.stats = {"checked": 0, "pushed": 0, "batches": 0}
+
+    def run(self, queryset):
+        queryset = self._resume(queryset.order_by("pk"))
+        loaded = self.view_class.get_claims_queryset(queryset)
+        users = (queryset if loaded is None else loaded).iterator(chunk_size=self.chunk_size)
+
+        pending = []
+        for chunk in iter(lambda: list(itertools.islice(users, self.chunk_size)), []):
+            pending.extend(self.get_changed(chunk))
+            pending = self.push_full_batches(pending, chunk[-1].pk)
+        self.push(pending)
+        self._clear_checkpoint()
+        return self.stats
+
+    def get_changed(self, users):
+        """
+        Returns ``(user_pk, zendesk_user, hash)`` for the users of ``users``
+        whose hash differs from the stored one.
+        """
+        entries = []
+        for user in users:
+            view = self.view_class.for_user(user, self.tenant.name)
+            zendesk_user = to_zendesk_user(view.get_claims())
+            entries.append((str(user.pk), zendesk_user, hash_zendesk_user(zendesk_user)))
+        self.stats["checked"] += len(entries)
+
+        stored = {} if self.force else dict(SyncedUser.objects.filter(
+            tenant=self.tenant.name, user_pk__in=[pk for pk, user, digest in entries]
+        ).values_list("user_pk", "claims_hash"))
+        return [entry for entry in entries if stored.get(entry[0]) != entry[2]]
+
+    def push_full_batches(self, pending, last_pk):
+        """
+        Pushes full batches of ``pending`` and checkpoints the last user pk
+        all users up to which are synced: ``last_pk`` (the chunk's last pk)
+        when nothing is left over, else the last user pushed.
+        """
+        pushed_pk = None
+        while len(pending) >= self.batch_size:
+            self.push(pending[:self.batch_size])
+            pushed_pk, pending = pending[self.batch_size - 1][0], pending[self.batch_size:]
+        checkpoint = pushed_pk if pending else last_pk
+        if checkpoint is not None:
+            self._save_checkpoint(checkpoint)
+        return pending
+
+    def push(self, entries):
+        if not entries:
+            return
+        self.transport.post(CREATE_OR_UPDATE_MANY_PATH, {"users": [user for pk, user, digest in entries]})
+        self._store_hashes(entries)
+        self.stats["pushed"] += len(entries)
+        self.stats["batches"] += 1
+
+    def _store_hashes(self, entries):
+        records = {record.user_pk: record for record in SyncedUser.objects.filter(
+            tenant=self.tenant.name, user_pk__in=[pk for pk, user, digest in entries])}
+        now = timezone.now()
+        for pk, user, digest in entries:
+            record = records.setdefault(pk, SyncedUser(tenant=self.tenant.name, user_pk=pk))
+            record.claims_hash, record.synced_at = digest, now
+
+        SyncedUser.objects.bulk_create([record for record in records.values() if record.pk is None])
+        SyncedUser.objects.bulk_update(
+            [record for record in records.values() if record.pk is not None], ["claims_hash", "synced_at"])
+
+    def _resume(self, queryset):
+        if not (self.checkpoint and os.path.exists(self.checkpoint)):
+            return queryset
+        with open(self.checkpoint) as f:
+            return queryset.filter(pk__gt=json.load(f)["last_pk"])
+
+    def _save_checkpoint(self, last_pk):
+        if self.checkpoint:
+            with open(self.checkpoint, "w") as f:
+                json.dump({"last_pk": str(last_pk)}, f)
+
+    def _clear_checkpoint(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
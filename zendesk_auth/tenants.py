@@ -0,0 +1,152 @@
+"""
+Registry of Zendesk instances (brands) served by one deployment.
+
+    ZENDESK_TENANTS = {
+        "acme": {
+            "URL": "https://acme.zendesk.com",
+            "TOKEN": "...",
+            "HOSTS": ["support.acme.com"],
+            "CLAIMS": {"tags": ["acme"]},
+        },
+    }
+
+Requests are matched to a tenant by the ``tenant`` URL kwarg, then by host,
+then fall back to the ``default`` tenant built from ``ZENDESK_URL`` and
+``ZENDESK_TOKEN``. ``CLAIMS`` are static claims added to every token of the
+tenant; values from the claim hooks take precedence. ``API_EMAIL`` and
+``API_TOKEN`` are the API credentials ``zendesk_auth.sync`` uses.
+
+The registry is built once and rebuilt when the settings change, when
+``reload()`` is called, or, with ``ZENDESK_TENANTS_RELOAD_INTERVAL``, when it
+is older than that many seconds. ``ZENDESK_TENANTS_LOADER`` names a callable
+returning the tenants dict, for tenants kept in a file or secret store. One
+thread rebuilds a stale registry while the others wait for it; when the
+loader fails, the previous registry is kept for another interval.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import Http404
+from django.http.request import split_domain_port
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.signers import get_signer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+
+class Tenant(object):
+
+    def __init__(self, name, url, token, hosts=(), claims=None, api_email=None, api_token=None):
+        self.name = name
+        self.url = url
+        self.token = token
+        self.hosts = tuple(hosts)
+        self.claims = dict(claims or {})
+        self.api_email = api_email
+        self.api_token = api_token
+        self.signer = get_signer(token)
+
+    def __repr__(self):
+        return "<Tenant {}>".format(self.name)
+
+
+class TenantRegistry(object):
+
+    def __init__(self, tenants):
+        self.tenants = {tenant.name: tenant for tenant in tenants}
+        self.by_host = {host.lower(): tenant for tenant in tenants for host in tenant.hosts}
+        self.built = time.monotonic()
+
+    def resolve(self, name=None, host=None):
+        """
+        Returns the tenant named ``name``, else the one serving ``host``,
+        else the default tenant. Raises ``Http404`` when there is no match.
+        """
+        tenant = self.tenants.get(name) if name else self.by_host.get(host, self.tenants.get(DEFAULT_TENANT))
+        if tenant is None:
+            raise Http404("No Zendesk tenant for this request")
+        return tenant
+
+
+def load_tenants():
+    loader = get_setting("ZENDESK_TENANTS_LOADER")
+    tenants = dict(import_string(loader)() if loader else get_setting("ZENDESK_TENANTS"))
+    if getattr(settings, "ZENDESK_URL", None) and DEFAULT_TENANT not in tenants:
+        tenants[DEFAULT_TENANT] = {
+            "URL": settings.ZENDESK_URL,
+            "TOKEN": settings.ZENDESK_TOKEN,
+            "API_EMAIL": get_setting("ZENDESK_API_EMAIL"),
+            "API_TOKEN": get_setting("ZENDESK_API_TOKEN"),
+        }
+    return [
+        Tenant(name, config["URL"], config["TOKEN"], config.get("HOSTS", ()), config.get("CLAIMS"),
+               config.get("API_EMAIL"), config.get("API_TOKEN"))
+        for name, config in tenants.items()
+    ]
+
+
+_registry = None
+_lock = threading.Lock()
+
+
+def reload():
+    """
+    Rebuilds the registry from the settings or ``ZENDESK_TENANTS_LOADER``.
+    Requests keep using the previous registry until the new one is ready.
+    """
+    global _registry
+    with _lock:
+        _registry = TenantRegistry(load_tenants())
+    return _registry
+
+
+def get_registry():
+    registry = _registry
+    if registry is None or _is_stale(registry):
+        registry = _rebuild(registry)
+    return registry
+
+
+def _rebuild(current):
+    # Another thread may have rebuilt the registry while this one waited.
+    global _registry
+    with _lock:
+        if _registry is current or _registry is None:
+            _registry = _build(_registry)
+        return _registry
+
+
+def _build(previous):
+    try:
+        return TenantRegistry(load_tenants())
+    except Exception:
+        if previous is None:
+            raise
+        logger.exception("Could not reload the Zendesk tenants, keeping the previous ones")
+        previous.built = time.monotonic()
+        return previous
+
+
+def _is_stale(registry):
+    interval = get_setting("ZENDESK_TENANTS_RELOAD_INTERVAL")
+    return interval is not None and time.monotonic() - registry.built > interval
+
+
+def get_tenant(request=None, name=None):
+    host = split_domain_port(request.get_host())[0] if request is not None else None
+    return get_registry().resolve(name, host)
+
+
+@receiver(setting_changed)
+def reset_registry(setting, **kwargs):
+    global _registry
+    if setting.startswith("ZENDESK_"):
+        _registry = None
@@ -0,0 +1,24 @@
+"""
+Helpers for testing projects that use zendesk_auth.
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def query_budget(max_queries, using=DEFAULT_DB_ALIAS):
+    """
+    Fails with ``AssertionError`` when the block runs more than
+    ``max_queries`` queries.
+
+        with query_budget(4):
+            self.client.get(reverse("zendesk-jwt-authorize"))
+    """
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+
+    if len(context) > max_queries:
+        raise AssertionError("{} queries executed, the budget is {}:\n{}".format(
+            len(context), max_queries, "\n".join(query["sql"] for query in context.captured_queries)))
@@ -7,16 +7,57 @@ try:
 except ImportError:
     import mock  # python27
 
-from django.contrib.auth.models import User
+import asyncio
+import concurrent.futures
+import csv
+import datetime
+import email.utils
+import io
+import json
+import os
+import pstats
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import Group, User
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core import checks as django_checks
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils import translation
 from django import test
+import django
 from django.conf import settings
 import jwt
 
-from zendesk_auth import views
+from zendesk_auth import (
+    audit, cache, checks, fastpath, hints, instrumentation, jti, ledger, payloads, profiling, rendering, resolution,
+    session_claims, signers, sync, tenants, throttling, views, warmup,
+)
+from zendesk_auth.management.commands import zendesk_auth_issue_tokens as issue_tokens
+from zendesk_auth.models import IssuedToken, SyncedUser
+from zendesk_auth.claims import depends_on, get_claim_loads, loads
+from zendesk_auth.signals import claim_fallback, duplicate_jti_issued, phase_timed, request_throttled
+from zendesk_auth.testing import query_budget
 
 TEST_ZENDESK_URL = "http://mycompany.zendesk.com"
 TEST_ZENDESK_TOKEN = "my-zendesk-token-for-tests"
+PYJWT_SIGNER = "zendesk_auth.signers.PyJWTSigner"
 
 
 def create_user(username="test",
@@ -155,8 +196,9 @@ class AuthorizeJWTTests(test.TestCase):
         expected_string = '<form id="jwtForm" method="post" action="{}/access/jwt">'.format(settings.ZENDESK_URL)
         self.assertContains(response, expected_string, count=1)
 
+    @test.utils.override_settings(ZENDESK_JWT_SIGNER=PYJWT_SIGNER)
     @mock.patch('zendesk_auth.views.time')
-    @mock.patch('zendesk_auth.views.uuid')
+    @mock.patch.object(views.ZendeskJWTAuthorize, 'get_jti')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_email')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_user_name')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_external_id')
@@ -165,9 +207,9 @@ class AuthorizeJWTTests(test.TestCase):
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_remote_photo_url')
     def test_get_jwt_string_returns_encoded_string(
             self, get_photo, get_tags, get_organization, get_id, get_name,
-            get_email, uuid, time):
+            get_email, get_jti, time):
         time.time.return_value = 123456
-        uuid.uuid1.return_value = "abcd1234"
+        get_jti.return_value = "abcd1234"
         get_email.return_value = "test@example.com"
         get_name.return_value = "Tester McGee"
         get_id.return_value = "TST1234"
@@ -181,7 +223,7 @@ class AuthorizeJWTTests(test.TestCase):
 
         payload = {
             "iat": time.time.return_value,
-            "jti": uuid.uuid1.return_value,
+            "jti": get_jti.return_value,
             "email": get_email.return_value,
             "name": get_name.return_value,
             "external_id": get_id.return_value,
@@ -198,10 +240,11 @@ class AuthorizeJWTTests(test.TestCase):
         get_tags.assert_called_once_with()
         get_photo.assert_called_once_with()
         time.time.assert_called_once_with()
-        uuid.uuid1.assert_called_once_with()
+        get_jti.assert_called_once_with()
 
+    @test.utils.override_settings(ZENDESK_JWT_SIGNER=PYJWT_SIGNER)
     @mock.patch('zendesk_auth.views.time')
-    @mock.patch('zendesk_auth.views.uuid')
+    @mock.patch.object(views.ZendeskJWTAuthorize, 'get_jti')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_email')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_user_name')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_external_id')
@@ -210,9 +253,9 @@ class AuthorizeJWTTests(test.TestCase):
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_remote_photo_url')
     def test_only_encodes_parameters_that_have_a_value(
             self, get_photo, get_tags, get_organization, get_id, get_name,
-            get_email, uuid, time):
+            get_email, get_jti, time):
         time.time.return_value = 123456
-        uuid.uuid1.return_value = "abcd1234"
+        get_jti.return_value = "abcd1234"
         get_email.return_value = "test@example.com"
         get_name.return_value = "Tester McGee"
         get_id.return_value = ""
@@ -226,7 +269,7 @@ class AuthorizeJWTTests(test.TestCase):
 
         expected_payload = {
             "iat": time.time.return_value,
-            "jti": uuid.uuid1.return_value,
+            "jti": get_jti.return_value,
             "email": get_email.return_value,
             "name": get_name.return_value,
             "tags": get_tags.return_value,
@@ -241,10 +284,10 @@ class AuthorizeJWTTests(test.TestCase):
         get_tags.assert_called_once_with()
         get_photo.assert_called_once_with()
         time.time.assert_called_once_with()
-        uuid.uuid1.assert_called_once_with()
+        get_jti.assert_called_once_with()
 
     @mock.patch('zendesk_auth.views.time')
-    @mock.patch('zendesk_auth.views.uuid')
+    @mock.patch.object(views.ZendeskJWTAuthorize, 'get_jti')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_email')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_user_name')
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_external_id')
@@ -253,9 +296,9 @@ class AuthorizeJWTTests(test.TestCase):
     @mock.patch.object(views.ZendeskJWTAuthorize, 'get_remote_photo_url')
     def test_jwt_string_is_returned_as_str_not_bytes(
             self, get_photo, get_tags, get_organization, get_id, get_name,
-            get_email, uuid, time):
+            get_email, get_jti, time):
         time.time.return_value = 123456
-        uuid.uuid1.return_value = "abcd1234"
+        get_jti.return_value = "abcd1234"
         get_email.return_value = "test@example.com"
         get_name.return_value = "Tester McGee"
         get_id.return_value = ""
@@ -276,3 +319,2097 @@ class AuthorizeJWTTests(test.TestCase):
         except AttributeError:
             expected = encode.return_value
         self.assertEqual(expected, jwt_string)
+
+
+SIGNER_TEST_PAYLOADS = [
+    {},
+    {"iat": 123456, "jti": "abcd1234", "email": "test@example.com"},
+    {"iat": 123456, "name": u"Jörg Ångström ☃", "tags": []},
+    {"name": "".join(chr(i) for i in range(128)), "tags": ["foo", "bar"]},
+    {"organization": "Acme, Inc.", "tags": ["tag{}".format(i) for i in range(500)]},
+    {"remote_photo_url": "http://s3.amazonaws.com/a/b%2Fc.jpg", "external_id": "x" * 5000},
+    {"score": 1e16, "ratio": [0.1, 2.5e-7]},
+    {"external_id": 2 ** 70},
+    {"external_id": uuid.UUID("12345678-1234-5678-1234-567812345678")},
+    {"updated_at": datetime.datetime(2024, 1, 2, 3, 4, 5)},
+]
+
+
+class SignerTests(test.SimpleTestCase):
+
+    def assert_signs_like_pyjwt(self, payload):
+        try:
+            expected = jwt.encode(payload, TEST_ZENDESK_TOKEN)
+        except TypeError:
+            with self.assertRaises(TypeError):
+                signers.HS256Signer(TEST_ZENDESK_TOKEN).sign(payload)
+        else:
+            self.assertEqual(expected, signers.HS256Signer(TEST_ZENDESK_TOKEN).sign(payload))
+
+    def test_hs256_signer_matches_pyjwt_byte_for_byte(self):
+        for payload in SIGNER_TEST_PAYLOADS:
+            with self.subTest(payload=payload):
+                self.assert_signs_like_pyjwt(payload)
+
+    def test_hs256_signer_matches_pyjwt_without_orjson(self):
+        with mock.patch.object(signers, "orjson", None):
+            for payload in SIGNER_TEST_PAYLOADS:
+                with self.subTest(payload=payload):
+                    self.assert_signs_like_pyjwt(payload)
+
+    def test_hs256_signer_tokens_decode_with_pyjwt(self):
+        payload = SIGNER_TEST_PAYLOADS[2]
+        token = signers.HS256Signer(TEST_ZENDESK_TOKEN).sign(payload)
+        self.assertEqual(payload, jwt.decode(token, TEST_ZENDESK_TOKEN, algorithms=["HS256"]))
+
+    def test_get_signer_returns_configured_backend(self):
+        with self.settings(ZENDESK_JWT_SIGNER=PYJWT_SIGNER):
+            self.assertIsInstance(signers.get_signer(TEST_ZENDESK_TOKEN), signers.PyJWTSigner)
+        self.assertIsInstance(signers.get_signer(TEST_ZENDESK_TOKEN), signers.HS256Signer)
+
+    def test_get_signer_is_built_once_per_token(self):
+        self.assertIs(signers.get_signer("token-a"), signers.get_signer("token-a"))
+        self.assertIsNot(signers.get_signer("token-a"), signers.get_signer("token-b"))
+
+    @test.utils.override_settings(ZENDESK_JWT_SHADOW_VERIFY_RATE=1.0)
+    def test_shadow_verify_returns_token_when_signers_agree(self):
+        signer = signers.get_signer(TEST_ZENDESK_TOKEN)
+        self.assertIsInstance(signer, signers.ShadowVerifyingSigner)
+        with mock.patch.object(signers.logger, "error") as log_error:
+            token = signer.sign(SIGNER_TEST_PAYLOADS[1])
+        self.assertEqual(jwt.encode(SIGNER_TEST_PAYLOADS[1], TEST_ZENDESK_TOKEN), token)
+        self.assertFalse(log_error.called)
+
+    def test_shadow_verify_logs_and_returns_reference_token_on_mismatch(self):
+        broken = mock.Mock()
+        broken.sign.return_value = "bad-token"
+        signer = signers.ShadowVerifyingSigner(broken, signers.PyJWTSigner(TEST_ZENDESK_TOKEN), 1.0)
+
+        with mock.patch.object(signers.logger, "error") as log_error:
+            token = signer.sign(SIGNER_TEST_PAYLOADS[1])
+        self.assertEqual(jwt.encode(SIGNER_TEST_PAYLOADS[1], TEST_ZENDESK_TOKEN), token)
+        self.assertEqual(1, log_error.call_count)
+
+    def test_shadow_verify_skips_reference_when_not_sampled(self):
+        reference = mock.Mock()
+        signer = signers.ShadowVerifyingSigner(signers.HS256Signer(TEST_ZENDESK_TOKEN), reference, 0.0)
+
+        signer.sign(SIGNER_TEST_PAYLOADS[1])
+        self.assertFalse(reference.sign.called)
+
+
+PASSTHROUGH_TEMPLATE = "zendesk_auth/zendesk_auth_passthrough.html"
+
+
+class PrecompiledTemplateTests(test.SimpleTestCase):
+
+    def setUp(self):
+        self.context = {"zendesk_url": TEST_ZENDESK_URL, "jwt_string": "a.b<c>&\"d\""}
+
+    def test_renders_same_html_as_template_engine(self):
+        template = rendering.get_precompiled_template([PASSTHROUGH_TEMPLATE], self.context)
+        body, length = template.render(self.context)
+
+        self.assertEqual(render_to_string(PASSTHROUGH_TEMPLATE, self.context).encode("utf-8"), body)
+        self.assertEqual(len(body), length)
+
+    def test_response_has_content_length(self):
+        template = rendering.get_precompiled_template([PASSTHROUGH_TEMPLATE], self.context)
+        response = template.render_to_response(self.context)
+
+        self.assertEqual(str(len(response.content)), response["Content-Length"])
+
+    def test_template_is_compiled_once(self):
+        self.assertIs(
+            rendering.get_precompiled_template([PASSTHROUGH_TEMPLATE], self.context),
+            rendering.get_precompiled_template([PASSTHROUGH_TEMPLATE], self.context))
+
+    def test_precompiles_project_override_of_template(self):
+        template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, template_dir)
+        os.makedirs(os.path.join(template_dir, "zendesk_auth"))
+        with open(os.path.join(template_dir, PASSTHROUGH_TEMPLATE), "w") as f:
+            f.write("<p>{{ zendesk_url }}|{{ jwt_string }}|{{ zendesk_url }}</p>")
+
+        templates = [dict(settings.TEMPLATES[0], DIRS=[template_dir])]
+        with self.settings(TEMPLATES=templates):
+            template = rendering.get_precompiled_template([PASSTHROUGH_TEMPLATE], self.context)
+            body, length = template.render(self.context)
+
+        expected = "<p>{0}|a.b&lt;c&gt;&amp;&quot;d&quot;|{0}</p>".format(TEST_ZENDESK_URL)
+        self.assertEqual(expected.encode("utf-8"), body)
+
+    def test_raises_improperly_configured_when_template_alters_values(self):
+        template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, template_dir)
+        with open(os.path.join(template_dir, "altered.html"), "w") as f:
+            f.write("{{ jwt_string|upper }}")
+
+        templates = [dict(settings.TEMPLATES[0], DIRS=[template_dir])]
+        with self.settings(TEMPLATES=templates):
+            with self.assertRaises(ImproperlyConfigured):
+                rendering.get_precompiled_template(["altered.html"], self.context)
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_PRECOMPILED_TEMPLATE=True)
+class PrecompiledAuthorizeTests(test.TestCase):
+
+    @mock.patch('zendesk_auth.views.ZendeskJWTAuthorize.get_jwt_string')
+    def test_get_request_renders_precompiled_passthrough_page(self, get_jwt_string):
+        get_jwt_string.return_value = "abcd"
+        create_user("test",  password="pswd")
+
+        self.client.login(username='test', password='pswd')
+        response = self.client.get("/zendesk-jwt-authorize/")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("text/html; charset=utf-8", response["Content-Type"])
+        self.assertEqual(str(len(response.content)), response["Content-Length"])
+        self.assertContains(response, '<input id="jwtInput" type="hidden" name="jwt" value="abcd" />', count=1)
+        self.assertContains(
+            response, '<form id="jwtForm" method="post" action="{}/access/jwt">'.format(TEST_ZENDESK_URL), count=1)
+        self.assertIn("no-cache", response["Cache-Control"])
+
+
+@test.utils.override_settings(
+    ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_RESPONSE_MODE="redirect")
+class RedirectModeTests(test.TestCase):
+
+    def setUp(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+    def assert_redirects_to_zendesk(self, response, return_to=None):
+        self.assertEqual(302, response.status_code)
+        self.assertIn("no-cache", response["Cache-Control"])
+        url, query = response["Location"].split("?")
+        self.assertEqual("https://mycompany.zendesk.com/access/jwt", url)
+        params = parse_qs(query)
+        self.assertEqual(return_to, params.get("return_to", [None])[0])
+        payload = jwt.decode(params["jwt"][0], TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+        self.assertEqual("test@example.com", payload["email"])
+
+    def test_redirects_straight_to_zendesk(self):
+        response = self.client.get("/zendesk-jwt-authorize/")
+        self.assert_redirects_to_zendesk(response)
+
+    def test_passes_return_to_on_zendesk_host(self):
+        return_to = "https://mycompany.zendesk.com/hc/en-us/requests?a=1&b=2"
+        response = self.client.get("/zendesk-jwt-authorize/", {"return_to": return_to})
+        self.assert_redirects_to_zendesk(response, return_to)
+
+    @test.utils.override_settings(ZENDESK_RETURN_TO_HOSTS=["help.mycompany.com"])
+    def test_passes_return_to_on_configured_host(self):
+        response = self.client.get("/zendesk-jwt-authorize/", {"return_to": "https://help.mycompany.com/hc"})
+        self.assert_redirects_to_zendesk(response, "https://help.mycompany.com/hc")
+
+    def test_drops_return_to_on_other_host_or_scheme(self):
+        for return_to in ["https://evil.example.com/", "http://mycompany.zendesk.com/hc", "javascript:alert(1)"]:
+            response = self.client.get("/zendesk-jwt-authorize/", {"return_to": return_to})
+            self.assert_redirects_to_zendesk(response)
+
+    @test.utils.override_settings(ZENDESK_REDIRECT_MAX_URL_LENGTH=100)
+    def test_falls_back_to_post_page_when_url_is_too_long(self):
+        return_to = "https://mycompany.zendesk.com/hc"
+        response = self.client.get("/zendesk-jwt-authorize/", {"return_to": return_to})
+
+        self.assertEqual(200, response.status_code)
+        self.assertContains(
+            response, '<input id="returnToInput" type="hidden" name="return_to" value="{}" />'.format(return_to))
+
+    @test.utils.override_settings(ZENDESK_REDIRECT_MAX_URL_LENGTH=100, ZENDESK_PRECOMPILED_TEMPLATE=True)
+    def test_precompiled_post_page_passes_return_to(self):
+        response = self.client.get("/zendesk-jwt-authorize/", {"return_to": "/hc?a=1&b=2"})
+        self.assertContains(
+            response, '<input id="returnToInput" type="hidden" name="return_to" value="/hc?a=1&amp;b=2" />')
+
+    @test.utils.override_settings(ZENDESK_RESPONSE_MODE="post")
+    def test_post_mode_renders_page(self):
+        response = self.client.get("/zendesk-jwt-authorize/")
+        self.assertContains(response, 'name="return_to" value=""', count=1)
+
+    async def test_async_view_redirects(self):
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get("/zendesk-jwt-authorize/async/")
+        self.assert_redirects_to_zendesk(response)
+
+    def test_access_url_logs_in_with_get(self):
+        view = views.ZendeskJWTAuthorize.for_user(User.objects.get())
+        self.assertEqual("https://mycompany.zendesk.com/access/jwt?jwt=a.b_c-d", view.get_access_url("a.b_c-d"))
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_CORS_ORIGINS=["https://app.example.com"],
+    CSRF_TRUSTED_ORIGINS=["https://app.example.com"])
+class TokenEndpointTests(test.TestCase):
+
+    def setUp(self):
+        self.token_url = reverse('zendesk-jwt-token')
+        self.client = test.Client(enforce_csrf_checks=True)
+
+    def login(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+        self.client.get("/admin/login/")
+        return self.client.cookies[settings.CSRF_COOKIE_NAME].value
+
+    def test_returns_token_and_login_url_as_json(self):
+        csrf_token = self.login()
+        response = self.client.post(self.token_url + "?return_to=/hc", HTTP_X_CSRFTOKEN=csrf_token)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/json", response["Content-Type"])
+        self.assertIn("no-cache", response["Cache-Control"])
+        data = response.json()
+        payload = jwt.decode(data["jwt"], TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+        self.assertEqual("test@example.com", payload["email"])
+        self.assertEqual(
+            "{}/access/jwt?jwt={}&return_to=%2Fhc".format(TEST_ZENDESK_URL, data["jwt"]), data["url"])
+
+    def test_returns_401_json_when_anonymous(self):
+        self.client.get("/admin/login/")
+        csrf_token = self.client.cookies[settings.CSRF_COOKIE_NAME].value
+        response = self.client.post(self.token_url, HTTP_X_CSRFTOKEN=csrf_token)
+
+        self.assertEqual(401, response.status_code)
+        self.assertEqual({"error": "not_authenticated", "login_url": settings.LOGIN_URL}, response.json())
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_rejects_post_without_csrf_token(self):
+        self.login()
+        self.assertEqual(403, self.client.post(self.token_url).status_code)
+
+    def test_rejects_get(self):
+        self.login()
+        self.assertEqual(405, self.client.get(self.token_url).status_code)
+
+    def test_allows_configured_origin_with_credentials(self):
+        csrf_token = self.login()
+        response = self.client.post(
+            self.token_url, HTTP_X_CSRFTOKEN=csrf_token, HTTP_ORIGIN="https://app.example.com")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("https://app.example.com", response["Access-Control-Allow-Origin"])
+        self.assertEqual("true", response["Access-Control-Allow-Credentials"])
+        self.assertIn("Origin", response["Vary"])
+
+    def test_answers_preflight_for_configured_origin(self):
+        response = self.client.options(self.token_url, HTTP_ORIGIN="https://app.example.com")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("https://app.example.com", response["Access-Control-Allow-Origin"])
+        self.assertEqual("POST, OPTIONS", response["Access-Control-Allow-Methods"])
+        self.assertEqual("Content-Type, X-CSRFTOKEN", response["Access-Control-Allow-Headers"])
+
+    def test_does_not_allow_other_origins(self):
+        response = self.client.options(self.token_url, HTTP_ORIGIN="https://evil.example.com")
+        self.assertNotIn("Access-Control-Allow-Origin", response)
+
+    def test_tenant_route_uses_tenant(self):
+        csrf_token = self.login()
+        with self.settings(ZENDESK_TENANTS=TEST_TENANTS):
+            response = self.client.post(
+                reverse('zendesk-jwt-token-tenant', kwargs={"tenant": "acme"}), HTTP_X_CSRFTOKEN=csrf_token)
+        self.assertTrue(response.json()["url"].startswith(TEST_TENANTS["acme"]["URL"] + "/access/jwt?"))
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_THROTTLE_RATE="2/m")
+class ThrottlingTests(test.TestCase):
+
+    def setUp(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+    def get(self, url="/zendesk-jwt-authorize/", **params):
+        return self.client.get(url, params)
+
+    def test_throttles_user_over_rate_with_429(self):
+        self.assertEqual([200, 200], [self.get().status_code for i in range(2)])
+
+        response = self.get()
+        self.assertEqual(429, response.status_code)
+        self.assertEqual("30", response["Retry-After"])
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_users_have_separate_buckets(self):
+        self.get(), self.get()
+        create_user("other", password="pswd")
+        self.client.login(username='other', password='pswd')
+        self.assertEqual(200, self.get().status_code)
+
+    @test.utils.override_settings(ZENDESK_THROTTLE_RATE=None, ZENDESK_THROTTLE_GLOBAL_RATE="1/h")
+    def test_global_rate_applies_to_all_users(self):
+        self.assertEqual(200, self.get().status_code)
+        create_user("other", password="pswd")
+        self.client.login(username='other', password='pswd')
+        self.assertEqual(429, self.get().status_code)
+
+    @test.utils.override_settings(ZENDESK_THROTTLE_RATE=None, ZENDESK_THROTTLE_LOOP_RATE="2/10s")
+    def test_detects_loop_on_repeated_return_to(self):
+        self.assertEqual(200, self.get(return_to="/hc/a").status_code)
+        self.assertEqual(200, self.get(return_to="/hc/a").status_code)
+        self.assertEqual(200, self.get(return_to="/hc/b").status_code)
+        self.assertEqual(200, self.get().status_code)
+
+        handler = mock.Mock()
+        request_throttled.connect(handler)
+        self.addCleanup(request_throttled.disconnect, handler)
+        with self.assertLogs("zendesk_auth.throttling", "WARNING"):
+            self.assertEqual(429, self.get(return_to="/hc/a").status_code)
+        self.assertEqual("loop", handler.call_args[1]["scope"])
+
+    def test_does_not_throttle_anonymous_redirect_to_login(self):
+        self.client.logout()
+        self.assertEqual([302] * 3, [self.get().status_code for i in range(3)])
+
+    @test.utils.override_settings(
+        ZENDESK_THROTTLE_RESPONSE="zendesk_auth.tests.teapot_response", ZENDESK_THROTTLE_RATE="1/m")
+    def test_uses_configured_response(self):
+        self.get()
+        response = self.get()
+        self.assertEqual(418, response.status_code)
+        self.assertEqual(b"user", response.content)
+
+    @test.utils.override_settings(ZENDESK_THROTTLE_RATE="1/m")
+    def test_throttles_token_endpoint(self):
+        self.assertEqual(200, self.client.post("/zendesk-jwt-token/").status_code)
+        self.assertEqual(429, self.client.post("/zendesk-jwt-token/").status_code)
+
+    async def test_throttles_async_view(self):
+        self.async_client.cookies = self.client.cookies
+        statuses = [(await self.async_client.get("/zendesk-jwt-authorize/async/")).status_code for i in range(3)]
+        self.assertEqual([200, 200, 429], statuses)
+
+    @test.utils.override_settings(
+        ZENDESK_THROTTLE_BACKEND="zendesk_auth.throttling.CacheBuckets", ZENDESK_THROTTLE_OPTIONS={"alias": "default"})
+    def test_cache_backend(self):
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+        with mock.patch("zendesk_auth.throttling.time.time", return_value=120.0):
+            self.assertEqual([200, 200, 429], [self.get().status_code for i in range(3)])
+        with mock.patch("zendesk_auth.throttling.time.time", return_value=180.0):
+            self.assertEqual(200, self.get().status_code)
+
+
+def teapot_response(request, scope, retry_after):
+    return HttpResponse(scope, status=418)
+
+
+class TokenBucketTests(test.SimpleTestCase):
+
+    def test_parses_rates(self):
+        self.assertEqual((30, 60), throttling.parse_rate("30/m"))
+        self.assertEqual((3, 10), throttling.parse_rate("3/10s"))
+        self.assertEqual((100, 86400), throttling.parse_rate("100/day"))
+        with self.assertRaises(ImproperlyConfigured):
+            throttling.parse_rate("lots")
+
+    def test_local_bucket_refills_over_period(self):
+        buckets = throttling.LocalBuckets()
+        with mock.patch("zendesk_auth.throttling.time.monotonic", return_value=100.0):
+            self.assertEqual([0, 0], [buckets.take("k", 2, 10) for i in range(2)])
+            self.assertEqual(5.0, buckets.take("k", 2, 10))
+        with mock.patch("zendesk_auth.throttling.time.monotonic", return_value=105.0):
+            self.assertEqual(0, buckets.take("k", 2, 10))
+            self.assertEqual(5.0, buckets.take("k", 2, 10))
+
+    def test_local_buckets_are_bounded(self):
+        buckets = throttling.LocalBuckets(maxsize=2)
+        for key in "abc":
+            buckets.take(key, 1, 60)
+        self.assertEqual(["b", "c"], list(buckets._buckets))
+
+
+class AsyncOrganizationAuthorize(views.AsyncZendeskJWTAuthorize):
+
+    async def get_organization(self):
+        user = await User.objects.aget(pk=self.request.user.pk)
+        return "Org of {}".format(user.username)
+
+
+class AsyncSyncTagsAuthorize(views.AsyncZendeskJWTAuthorize):
+
+    def get_tags(self):
+        return sorted(User.objects.filter(pk=self.request.user.pk).values_list("username", flat=True))
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN)
+class AsyncAuthorizeJWTTests(test.TestCase):
+
+    def setUp(self):
+        self.authorize_url = reverse('zendesk-jwt-authorize-async')
+
+    def login(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+        self.async_client.cookies = self.client.cookies
+
+    def test_view_is_async(self):
+        self.assertTrue(views.AsyncZendeskJWTAuthorize.view_is_async)
+
+    async def test_redirects_to_login_when_not_logged_in(self):
+        response = await self.async_client.get(self.authorize_url)
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(True, response['Location'].endswith(
+            r'{}?next={}'.format(settings.LOGIN_URL, self.authorize_url)))
+
+    async def test_head_request_does_not_sign(self):
+        await sync_to_async(self.login)()
+        with mock.patch.object(views, "get_signer") as get_signer:
+            response = await self.async_client.head(self.authorize_url)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b"", response.content)
+        self.assertIn("no-cache", response["Cache-Control"])
+        get_signer.assert_not_called()
+
+    async def test_anonymous_head_request_redirects_to_login(self):
+        response = await self.async_client.head(self.authorize_url)
+        self.assertEqual(302, response.status_code)
+
+    async def test_get_request_contains_signed_jwt_and_is_never_cached(self):
+        await sync_to_async(self.login)()
+        response = await self.async_client.get(self.authorize_url)
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertContains(
+            response, '<form id="jwtForm" method="post" action="{}/access/jwt">'.format(TEST_ZENDESK_URL), count=1)
+        token = re.search(r'name="jwt" value="([^"]+)"', response.content.decode()).group(1)
+        payload = jwt.decode(token, TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+        self.assertEqual("test@example.com", payload["email"])
+        self.assertEqual("test", payload["external_id"])
+
+    async def test_supports_async_claim_hooks(self):
+        await sync_to_async(create_user)("joe", email="joe@example.com")
+        user = await User.objects.aget(username="joe")
+        request = test.RequestFactory().get("/")
+        request.user = user
+
+        view = AsyncOrganizationAuthorize(request=request)
+        claims = await view.aget_claims()
+        self.assertEqual("Org of joe", claims["organization"])
+        self.assertEqual("joe@example.com", claims["email"])
+
+    async def test_sync_claim_hooks_may_query_the_database(self):
+        await sync_to_async(create_user)("joe", email="joe@example.com")
+        request = test.RequestFactory().get("/")
+        request.user = await User.objects.aget(username="joe")
+
+        claims = await AsyncSyncTagsAuthorize(request=request).aget_claims()
+        self.assertEqual(["joe"], claims["tags"])
+
+
+class GroupTagsAuthorize(views.ZendeskJWTAuthorize):
+
+    @depends_on("auth.User_groups")
+    def get_tags(self):
+        return sorted(self.request.user.groups.values_list("name", flat=True))
+
+
+# Imported only through ZENDESK_CLAIMS_CACHE_VIEWS, like a project's views
+# in a process that never loads the URLconf.
+LATE_VIEWS_MODULE = """
+from zendesk_auth.claims import depends_on
+from zendesk_auth.models import SyncedUser
+from zendesk_auth.views import ZendeskJWTAuthorize
+
+
+class SyncedTagsAuthorize(ZendeskJWTAuthorize):
+
+    @depends_on("zendesk_auth.SyncedUser", user_field="user_pk")
+    def get_tags(self):
+        return sorted(SyncedUser.objects.filter(user_pk=self.request.user.pk).values_list("tenant", flat=True))
+"""
+
+
+@test.utils.override_settings(ZENDESK_CLAIMS_CACHE=True)
+class ClaimsCacheTests(test.TestCase):
+
+    def setUp(self):
+        caches["default"].clear()
+        self.user = create_user("joe", email="joe@example.com")
+
+    def get_claims(self, view_class=views.ZendeskJWTAuthorize):
+        request = test.RequestFactory().get("/")
+        request.user = User.objects.get(pk=self.user.pk)
+        return view_class(request=request).get_claims()
+
+    def test_claims_are_computed_once_per_user(self):
+        with mock.patch.object(views.ZendeskJWTAuthorize, "get_email", return_value="joe@example.com") as get_email:
+            self.get_claims()
+            claims = self.get_claims()
+
+        self.assertEqual("joe@example.com", claims["email"])
+        get_email.assert_called_once_with()
+
+    def test_claims_are_read_from_shared_cache_when_not_in_local_lru(self):
+        self.get_claims()
+        cache.get_claims_cache().local.clear()
+
+        with mock.patch.object(views.ZendeskJWTAuthorize, "get_email") as get_email:
+            claims = self.get_claims()
+        self.assertEqual("joe@example.com", claims["email"])
+        self.assertFalse(get_email.called)
+
+    def test_claims_are_not_cached_when_setting_is_off(self):
+        with self.settings(ZENDESK_CLAIMS_CACHE=False):
+            with mock.patch.object(views.ZendeskJWTAuthorize, "get_email") as get_email:
+                self.get_claims()
+                self.get_claims()
+        self.assertEqual(2, get_email.call_count)
+
+    def test_saving_user_invalidates_cached_claims(self):
+        self.get_claims()
+        self.user.email = "joe@new.example.com"
+        self.user.save()
+
+        self.assertEqual("joe@new.example.com", self.get_claims()["email"])
+
+    def test_invalidation_does_not_need_the_tenant_registry(self):
+        self.get_claims()
+        self.user.email = "joe@new.example.com"
+        with mock.patch.object(tenants, "_registry", None):
+            self.user.save()
+
+        self.assertEqual("joe@new.example.com", self.get_claims()["email"])
+
+    def test_last_login_update_does_not_invalidate_cached_claims(self):
+        self.get_claims()
+        User.objects.filter(pk=self.user.pk).update(email="joe@new.example.com")
+        self.user.save(update_fields=["last_login"])
+
+        self.assertEqual("joe@example.com", self.get_claims()["email"])
+
+    def test_m2m_change_invalidates_cached_claims(self):
+        self.assertEqual([], self.get_claims(GroupTagsAuthorize)["tags"])
+        self.user.groups.add(Group.objects.create(name="vip"))
+
+        self.assertEqual(["vip"], self.get_claims(GroupTagsAuthorize)["tags"])
+
+    def test_reverse_m2m_change_invalidates_cached_claims(self):
+        group = Group.objects.create(name="vip")
+        self.get_claims(GroupTagsAuthorize)
+        group.user_set.add(self.user)
+
+        self.assertEqual(["vip"], self.get_claims(GroupTagsAuthorize)["tags"])
+
+    def test_configured_views_invalidate_before_they_are_imported(self):
+        module_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, module_dir)
+        with open(os.path.join(module_dir, "zendesk_auth_late_views.py"), "w") as f:
+            f.write(LATE_VIEWS_MODULE)
+        sys.path.insert(0, module_dir)
+        self.addCleanup(sys.path.remove, module_dir)
+        self.addCleanup(sys.modules.pop, "zendesk_auth_late_views", None)
+
+        with self.settings(ZENDESK_CLAIMS_CACHE_VIEWS=["zendesk_auth_late_views.SyncedTagsAuthorize"]):
+            self.assertNotIn("zendesk_auth_late_views", sys.modules)
+            cache.register_configured_views()
+        view_class = sys.modules["zendesk_auth_late_views"].SyncedTagsAuthorize
+
+        self.assertEqual([], self.get_claims(view_class)["tags"])
+        SyncedUser.objects.create(tenant="default", user_pk=str(self.user.pk), claims_hash="x")
+        self.assertEqual(["default"], self.get_claims(view_class)["tags"])
+
+    def test_views_have_distinct_claims_versions(self):
+        self.assertNotEqual(
+            cache.get_claims_version(views.ZendeskJWTAuthorize), cache.get_claims_version(GroupTagsAuthorize))
+
+
+class LocalLRUTests(test.SimpleTestCase):
+
+    def test_evicts_least_recently_used_entry(self):
+        lru = cache.LocalLRU(maxsize=2, timeout=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+
+        self.assertEqual((1, None, 3), (lru.get("a"), lru.get("b"), lru.get("c")))
+
+    def test_entries_expire_after_timeout(self):
+        lru = cache.LocalLRU(maxsize=2, timeout=60)
+        lru.set("a", 1)
+        with mock.patch.object(cache.time, "monotonic", return_value=cache.time.monotonic() + 61):
+            self.assertEqual(None, lru.get("a"))
+
+
+class PrefetchedGroupTagsAuthorize(views.ZendeskJWTAuthorize):
+
+    @loads(prefetch_related=["groups"], only=["is_active"])
+    def get_tags(self):
+        return sorted(group.name for group in self.request.user.groups.all())
+
+
+class UndeclaredGroupTagsAuthorize(PrefetchedGroupTagsAuthorize):
+
+    def get_organization(self):
+        return self.request.user.date_joined.isoformat()
+
+
+class ClaimLoadsTests(test.TestCase):
+
+    def setUp(self):
+        self.user = create_user("joe", email="joe@example.com")
+        self.user.groups.add(Group.objects.create(name="b"), Group.objects.create(name="a"))
+
+    def get_view(self, view_class):
+        request = test.RequestFactory().get("/")
+        request.user = User.objects.get(pk=self.user.pk)
+        return view_class(request=request)
+
+    def test_merges_hook_declarations(self):
+        self.assertEqual({
+            "select_related": (),
+            "prefetch_related": ("groups",),
+            "only": ("first_name", "is_active", "last_name", "username"),
+        }, get_claim_loads(PrefetchedGroupTagsAuthorize))
+
+    def test_only_is_none_when_a_hook_is_undeclared(self):
+        self.assertEqual(None, get_claim_loads(UndeclaredGroupTagsAuthorize)["only"])
+
+    def test_user_row_is_not_reloaded_when_nothing_related_is_declared(self):
+        self.assertEqual(None, self.get_view(views.ZendeskJWTAuthorize).get_claims_user_queryset())
+
+    def test_claims_are_computed_with_one_batched_user_query(self):
+        view = self.get_view(PrefetchedGroupTagsAuthorize)
+
+        with self.assertNumQueries(2):
+            claims = view.get_claims()
+        self.assertEqual(["a", "b"], claims["tags"])
+        self.assertEqual("joe@example.com", claims["email"])
+
+    def test_undeclared_hooks_can_read_any_user_field(self):
+        view = self.get_view(UndeclaredGroupTagsAuthorize)
+
+        with self.assertNumQueries(2):
+            claims = view.get_claims()
+        self.assertEqual(self.user.date_joined.isoformat(), claims["organization"])
+
+
+class QueryBudgetTests(test.TestCase):
+
+    def test_passes_when_queries_are_within_budget(self):
+        with query_budget(1) as context:
+            User.objects.count()
+        self.assertEqual(1, len(context))
+
+    def test_fails_when_queries_exceed_budget(self):
+        with self.assertRaisesMessage(AssertionError, "2 queries executed, the budget is 1"):
+            with query_budget(1):
+                User.objects.count()
+                User.objects.count()
+
+    @test.utils.override_settings(ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN)
+    def test_authorize_request_stays_within_budget(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+        with query_budget(2):
+            self.client.get(reverse('zendesk-jwt-authorize'))
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN,
+    ZENDESK_INSTRUMENTATION=True, ZENDESK_SERVER_TIMING=True)
+class InstrumentationTests(test.TestCase):
+
+    def setUp(self):
+        instrumentation.get_metrics_sink.cache_clear()
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+    def get_phases(self, response):
+        return [timing.split(";")[0] for timing in response["Server-Timing"].split(", ")]
+
+    def test_server_timing_header_lists_every_phase(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize'))
+        self.assertEqual(["auth", "claims", "sign", "render"], self.get_phases(response))
+
+    @test.utils.override_settings(ZENDESK_PRECOMPILED_TEMPLATE=True)
+    def test_precompiled_rendering_is_timed(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize'))
+        self.assertEqual(["auth", "claims", "sign", "render"], self.get_phases(response))
+
+    def test_async_view_is_timed(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize-async'))
+        self.assertEqual(["auth", "claims", "sign", "render"], self.get_phases(response))
+
+    @test.utils.override_settings(ZENDESK_SERVER_TIMING=False)
+    def test_server_timing_header_is_optional(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize'))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test_phase_timed_signal_is_sent_for_each_phase(self):
+        receiver = mock.Mock()
+        phase_timed.connect(receiver)
+        self.addCleanup(phase_timed.disconnect, receiver)
+
+        self.client.get(reverse('zendesk-jwt-authorize'))
+        phases = [call[1]["phase"] for call in receiver.call_args_list]
+        self.assertEqual(["auth", "claims", "sign", "render"], phases)
+        self.assertTrue(all(call[1]["duration"] >= 0 for call in receiver.call_args_list))
+
+    def test_phases_are_exposed_in_prometheus_format(self):
+        self.client.get(reverse('zendesk-jwt-authorize'))
+        self.client.get(reverse('zendesk-jwt-authorize'))
+
+        response = instrumentation.prometheus_metrics(test.RequestFactory().get("/"))
+        content = response.content.decode()
+        self.assertIn("# TYPE zendesk_auth_phase_seconds histogram", content)
+        self.assertIn('zendesk_auth_phase_seconds_bucket{phase="sign",le="+Inf"} 2', content)
+        self.assertIn('zendesk_auth_phase_seconds_count{phase="claims"} 2', content)
+
+    @test.utils.override_settings(ZENDESK_INSTRUMENTATION=False)
+    def test_disabled_instrumentation_shares_null_timer(self):
+        self.assertIs(instrumentation.NULL_TIMER, instrumentation.start_timer())
+        response = self.client.get(reverse('zendesk-jwt-authorize'))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class HistogramTests(test.SimpleTestCase):
+
+    def test_cumulative_counts(self):
+        histogram = instrumentation.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        self.assertEqual([(0.1, 2), (1.0, 3), (float("inf"), 4)], list(histogram.cumulative_counts()))
+        self.assertEqual(2.65, histogram.sum)
+
+
+class BigProfileAuthorize(views.ZendeskJWTAuthorize):
+
+    def get_tags(self):
+        return ["Tag{}".format(i) for i in range(200)] + ["tag0", " TAG1 "]
+
+    def get_remote_photo_url(self):
+        return "https://example.com/" + "p" * 100
+
+
+@test.utils.override_settings(ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN)
+class PayloadTests(test.TestCase):
+
+    def build_payload(self):
+        view = BigProfileAuthorize.for_user(create_user("joe", email="joe@example.com"))
+        return view.build_payload(view.get_claims())
+
+    def test_payload_is_unchanged_by_default(self):
+        payload = self.build_payload()
+        self.assertEqual(202, len(payload["tags"]))
+        self.assertIn("remote_photo_url", payload)
+
+    @test.utils.override_settings(ZENDESK_PAYLOAD_COMPACT_TAGS=True)
+    def test_compacts_tags(self):
+        payload = self.build_payload()
+        self.assertEqual(",".join("tag{}".format(i) for i in range(200)), payload["tags"])
+
+    def test_compact_tags_dedupes_and_drops_empty_tags(self):
+        self.assertEqual("vip,beta", payloads.compact_tags("VIP, beta,,vip"))
+        self.assertEqual("vip", payloads.compact_tags(["vip", "Vip", ""]))
+
+    @test.utils.override_settings(ZENDESK_PAYLOAD_COMPACT_TAGS=True, ZENDESK_PAYLOAD_MAX_BYTES=400)
+    def test_sheds_claims_in_policy_order_to_fit_budget(self):
+        payload = self.build_payload()
+
+        self.assertLessEqual(len(signers.json_dumps(payload)), 400)
+        self.assertIn("remote_photo_url", payload)
+        self.assertTrue(payload["tags"].startswith("tag0,tag1,"))
+        self.assertLess(payload["tags"].count(","), 199)
+        self.assertEqual(["email", "external_id", "iat", "jti", "name", "remote_photo_url", "tags"], sorted(payload))
+
+    @test.utils.override_settings(
+        ZENDESK_PAYLOAD_MAX_BYTES=150, ZENDESK_PAYLOAD_CLAIM_POLICIES={"remote_photo_url": "drop", "tags": "truncate"})
+    def test_uses_configured_policies(self):
+        payload = self.build_payload()
+        self.assertNotIn("remote_photo_url", payload)
+        self.assertEqual(["Tag0", "Tag1"], payload["tags"][:2])
+        self.assertLess(len(payload["tags"]), 202)
+        self.assertLessEqual(len(signers.json_dumps(payload)), 150)
+
+    @test.utils.override_settings(ZENDESK_PAYLOAD_MAX_BYTES=10)
+    def test_warns_when_required_claims_exceed_budget(self):
+        with self.assertLogs("zendesk_auth.payloads", "WARNING"):
+            payload = self.build_payload()
+        self.assertEqual(["email", "external_id", "iat", "jti", "name"], sorted(payload))
+
+    def test_truncate(self):
+        self.assertEqual("a,bb", payloads.truncate("tags", "a,bb,ccc", 4))
+        self.assertEqual(["x"], payloads.truncate("tags", ["x", "yy"], 3))
+        self.assertEqual("Acme, In", payloads.truncate("organization", "Acme, Inc.", 2))
+
+    @test.utils.override_settings(ZENDESK_INSTRUMENTATION=True)
+    def test_records_payload_and_claim_sizes(self):
+        instrumentation.get_metrics_sink.cache_clear()
+        payload = self.build_payload()
+
+        output = instrumentation.get_metrics_sink().render_prometheus()
+        self.assertIn("# TYPE zendesk_auth_payload_bytes histogram", output)
+        self.assertIn('zendesk_auth_payload_bytes_sum{{claim="total"}} {}'.format(
+            len(signers.json_dumps(payload))), output)
+        self.assertIn('zendesk_auth_payload_bytes_sum{{claim="email"}} {}'.format(
+            len('"email":"joe@example.com",')), output)
+        self.assertIn('zendesk_auth_payload_bytes_bucket{claim="email",le="32"} 1', output)
+
+
+class JTIGeneratorTests(test.SimpleTestCase):
+
+    def assert_unique(self, generator, count=5000):
+        ids = [generator() for _ in range(count)]
+        self.assertEqual(count, len(set(ids)))
+        self.assertTrue(all(isinstance(i, str) for i in ids))
+
+    def test_counter_ids_are_unique(self):
+        self.assert_unique(jti.CounterJTI())
+
+    def test_counter_ids_differ_between_processes(self):
+        generator = jti.CounterJTI()
+        first = generator()
+        generator.reset()
+        self.assertNotEqual(first, generator())
+
+    def test_pooled_random_ids_are_unique_across_pool_refills(self):
+        generator = jti.PooledRandomJTI(pool_size=64)
+        self.assert_unique(generator)
+        self.assertEqual(32, len(generator()))
+
+    def test_counter_ids_are_unique_across_threads(self):
+        generator = jti.CounterJTI()
+        ids = []
+
+        def issue():
+            ids.extend(generator() for _ in range(2000))
+
+        threads = [threading.Thread(target=issue) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(16000, len(set(ids)))
+
+    def test_uuid_generators(self):
+        self.assert_unique(jti.UUID1JTI(), count=100)
+        self.assert_unique(jti.UUID4JTI(), count=100)
+
+    def test_get_jti_generator_returns_configured_generator(self):
+        self.assertIsInstance(jti.get_jti_generator(), jti.CounterJTI)
+        with self.settings(ZENDESK_JTI_GENERATOR="zendesk_auth.jti.UUID4JTI"):
+            self.assertIsInstance(jti.get_jti_generator(), jti.UUID4JTI)
+
+    def test_view_uses_configured_generator(self):
+        with self.settings(ZENDESK_JTI_GENERATOR="zendesk_auth.jti.UUID1JTI"):
+            value = views.ZendeskJWTAuthorize().get_jti()
+        self.assertEqual(value, str(uuid.UUID(value)))
+
+
+class LedgerTests(test.SimpleTestCase):
+
+    def test_memory_ledger_reports_duplicates(self):
+        issued = ledger.MemoryLedger(capacity=10)
+        self.assertFalse(issued.record("a"))
+        self.assertFalse(issued.record("b"))
+        self.assertTrue(issued.record("a"))
+
+    def test_memory_ledger_logs_ids_older_than_ring_buffer_as_probable(self):
+        issued = ledger.MemoryLedger(capacity=100)
+        issued.record("old")
+        for i in range(150):
+            issued.record("id-{}".format(i))
+
+        self.assertNotIn("old", issued.recent_set)
+        self.assertTrue(issued.probably_seen("old"))
+        with mock.patch.object(ledger.logger, "debug") as log_debug:
+            self.assertFalse(issued.record("old"))
+        log_debug.assert_called_once_with("JWT id %s was probably issued before", "old")
+
+    def test_memory_ledger_reports_no_false_duplicates(self):
+        issued = ledger.MemoryLedger()
+        generate = jti.CounterJTI()
+        self.assertFalse(any(issued.record(generate()) for i in range(50000)))
+
+    def test_memory_ledger_is_bounded(self):
+        issued = ledger.MemoryLedger(capacity=100)
+        for i in range(1000):
+            issued.record("id-{}".format(i))
+
+        self.assertEqual(100, len(issued.recent_set))
+        self.assertEqual(2, len(issued.blooms))
+        false_positives = sum(issued.probably_seen("new-{}".format(i)) for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_cache_ledger_reports_duplicates(self):
+        caches["default"].clear()
+        issued = ledger.CacheLedger()
+        self.assertFalse(issued.record("a"))
+        self.assertTrue(issued.record("a"))
+
+    @test.utils.override_settings(
+        ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_JTI_LEDGER="zendesk_auth.ledger.CacheLedger")
+    async def test_async_view_records_with_async_cache_api(self):
+        await caches["default"].aclear()
+        receiver = mock.Mock()
+        duplicate_jti_issued.connect(receiver)
+        self.addCleanup(duplicate_jti_issued.disconnect, receiver)
+        view = views.AsyncZendeskJWTAuthorize()
+
+        with mock.patch.object(ledger.CacheLedger, "record", side_effect=AssertionError), \
+                mock.patch.object(ledger.logger, "warning"):
+            await view.asign_payload({"jti": "abc"})
+            self.assertFalse(receiver.called)
+            await view.asign_payload({"jti": "abc"})
+        self.assertEqual(1, receiver.call_count)
+
+    @test.utils.override_settings(
+        ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_JTI_LEDGER="zendesk_auth.ledger.MemoryLedger",
+        ZENDESK_JTI_LEDGER_OPTIONS={"capacity": 10})
+    def test_duplicate_issuance_sends_signal(self):
+        receiver = mock.Mock()
+        duplicate_jti_issued.connect(receiver)
+        self.addCleanup(duplicate_jti_issued.disconnect, receiver)
+        view = views.ZendeskJWTAuthorize()
+
+        with mock.patch.object(ledger.logger, "warning"):
+            view.sign_payload({"jti": "abc"})
+            self.assertFalse(receiver.called)
+            view.sign_payload({"jti": "abc"})
+        receiver.assert_called_once_with(
+            signal=duplicate_jti_issued, sender=views.ZendeskJWTAuthorize, view=view, jti="abc")
+
+
+class ListSink(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def write(self, records):
+        self.batches.append(records)
+
+
+class BlockingSink(ListSink):
+
+    def __init__(self):
+        super(BlockingSink, self).__init__()
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, records):
+        self.writing.set()
+        self.release.wait(5)
+        super(BlockingSink, self).write(records)
+
+
+def audit_event(i):
+    return "default", i, {"iat": 1700000000, "jti": "jti-{}".format(i), "email": "user{}@example.com".format(i)}
+
+
+class AuditLogTests(test.SimpleTestCase):
+
+    def make_log(self, sink, **kwargs):
+        audit_log = audit.AuditLog(sink, **kwargs)
+        self.addCleanup(audit_log.close)
+        return audit_log
+
+    def test_writes_records_in_batches_by_size(self):
+        sink = ListSink()
+        audit_log = self.make_log(sink, batch_size=2, flush_interval=60)
+        for i in range(4):
+            audit_log.record(audit_event(i))
+        audit_log.flush()
+
+        self.assertEqual([2, 2], [len(batch) for batch in sink.batches])
+        self.assertEqual({
+            "tenant": "default",
+            "user_pk": "0",
+            "jti": "jti-0",
+            "claims_hash": audit.hash_claims({"email": "user0@example.com"}),
+            "issued_at": datetime.datetime(2023, 11, 14, 22, 13, 20, tzinfo=datetime.timezone.utc),
+        }, sink.batches[0][0])
+
+    def test_writes_partial_batch_after_interval(self):
+        sink = ListSink()
+        audit_log = self.make_log(sink, batch_size=100, flush_interval=0.01)
+        audit_log.record(audit_event(1))
+        audit_log.flush()
+        self.assertEqual([["jti-1"]], [[record["jti"] for record in batch] for batch in sink.batches])
+
+    def test_claims_hash_ignores_iat_and_jti(self):
+        self.assertEqual(
+            audit.hash_claims({"iat": 1, "jti": "a", "email": "joe@example.com"}),
+            audit.hash_claims({"iat": 2, "jti": "b", "email": "joe@example.com"}))
+
+    def test_drops_events_when_queue_is_full(self):
+        sink = BlockingSink()
+        audit_log = self.make_log(sink, queue_size=2, batch_size=1)
+        audit_log.record(audit_event(0))
+        sink.writing.wait(5)
+
+        with self.assertLogs("zendesk_auth.audit", "WARNING"):
+            for i in range(1, 4):
+                audit_log.record(audit_event(i))
+        self.assertEqual(1, audit_log.dropped)
+
+        sink.release.set()
+        audit_log.flush()
+        self.assertEqual(["jti-0", "jti-1", "jti-2"], [batch[0]["jti"] for batch in sink.batches])
+
+    def test_blocks_for_room_when_configured(self):
+        sink = BlockingSink()
+        audit_log = self.make_log(sink, queue_size=1, batch_size=1, overflow="block", block_timeout=5)
+        audit_log.record(audit_event(0))
+        sink.writing.wait(5)
+        audit_log.record(audit_event(1))
+
+        threading.Timer(0.05, sink.release.set).start()
+        audit_log.record(audit_event(2))
+        audit_log.flush()
+        self.assertEqual(0, audit_log.dropped)
+        self.assertEqual(3, len(sink.batches))
+
+    def test_record_nowait_drops_instead_of_blocking(self):
+        sink = BlockingSink()
+        audit_log = self.make_log(sink, queue_size=1, batch_size=1, overflow="block", block_timeout=5)
+        audit_log.record(audit_event(0))
+        sink.writing.wait(5)
+        audit_log.record_nowait(audit_event(1))
+
+        started = time.monotonic()
+        with self.assertLogs("zendesk_auth.audit", "WARNING"):
+            audit_log.record_nowait(audit_event(2))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(1, audit_log.dropped)
+        sink.release.set()
+
+    def test_rejects_unknown_overflow_policy(self):
+        with self.assertRaises(ImproperlyConfigured):
+            audit.AuditLog(ListSink(), overflow="explode")
+
+    def test_close_writes_queued_events_and_closes_sink(self):
+        sink = ListSink()
+        sink.close = mock.Mock()
+        audit_log = audit.AuditLog(sink, flush_interval=60)
+        audit_log.record(audit_event(0))
+        audit_log.close()
+
+        self.assertEqual(1, len(sink.batches))
+        sink.close.assert_called_once_with()
+
+    def test_jsonl_sink_rotates_files(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        path = os.path.join(log_dir, "audit.jsonl")
+        sink = audit.JSONLSink(path, max_bytes=1, backup_count=2)
+        self.addCleanup(sink.close)
+
+        for i in range(3):
+            sink.write([audit.to_record(audit_event(i))])
+        self.assertEqual(["audit.jsonl.1", "audit.jsonl.2"], sorted(os.listdir(log_dir)))
+        with open(path + ".1") as f:
+            record = json.loads(f.read())
+        self.assertEqual("jti-2", record["jti"])
+        self.assertEqual("2023-11-14T22:13:20+00:00", record["issued_at"])
+
+
+@test.utils.override_settings(ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN)
+class AuditIntegrationTests(test.TestCase):
+
+    def test_model_sink_bulk_creates_records(self):
+        with self.assertNumQueries(1):
+            audit.ModelSink().write([audit.to_record(audit_event(i)) for i in range(3)])
+        self.assertEqual(["jti-0", "jti-1", "jti-2"], list(IssuedToken.objects.order_by("jti").values_list(
+            "jti", flat=True)))
+
+    def test_authorize_view_queues_issued_token(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        path = os.path.join(log_dir, "audit.jsonl")
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+        with self.settings(
+                ZENDESK_AUDIT_SINK="zendesk_auth.audit.JSONLSink", ZENDESK_AUDIT_SINK_OPTIONS={"path": path}):
+            response = self.client.get("/zendesk-jwt-authorize/")
+            audit.get_audit_log().flush()
+
+        token = re.search(r'name="jwt" value="([^"]+)"', response.content.decode()).group(1)
+        payload = jwt.decode(token, TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+        with open(path) as f:
+            record = json.loads(f.read())
+        self.assertEqual(payload["jti"], record["jti"])
+        self.assertEqual(str(User.objects.get().pk), record["user_pk"])
+        self.assertEqual(audit.hash_claims(payload), record["claims_hash"])
+
+    async def test_async_view_never_blocks_on_a_full_queue(self):
+        await sync_to_async(create_user)("test", password="pswd")
+        await sync_to_async(self.client.login)(username="test", password="pswd")
+        self.async_client.cookies = self.client.cookies
+
+        with self.settings(ZENDESK_AUDIT_SINK="zendesk_auth.tests.ListSink", ZENDESK_AUDIT_OVERFLOW="block"), \
+                mock.patch.object(audit.AuditLog, "record") as record, \
+                mock.patch.object(audit.AuditLog, "record_nowait") as record_nowait:
+            response = await self.async_client.get("/zendesk-jwt-authorize/async/")
+
+        self.assertEqual(200, response.status_code)
+        record.assert_not_called()
+        self.assertEqual(1, record_nowait.call_count)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(audit.get_audit_log())
+
+
+TEST_TENANTS = {
+    "acme": {
+        "URL": "https://acme.zendesk.com",
+        "TOKEN": "acme-token",
+        "HOSTS": ["support.acme.com"],
+        "CLAIMS": {"tags": ["acme"]},
+    },
+    "globex": {"URL": "https://globex.zendesk.com", "TOKEN": "globex-token", "HOSTS": ["help.globex.com"]},
+}
+
+
+def load_test_tenants():
+    return load_test_tenants.tenants
+
+
+class TenantTagsAuthorize(views.ZendeskJWTAuthorize):
+
+    def get_tags(self):
+        return [self.get_tenant().name]
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_TENANTS=TEST_TENANTS,
+    ALLOWED_HOSTS=["*"])
+class TenantTests(test.TestCase):
+
+    def setUp(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+    def get_form(self, response):
+        content = response.content.decode()
+        action = re.search(r'action="([^"]+)/access/jwt"', content).group(1)
+        token = re.search(r'name="jwt" value="([^"]+)"', content).group(1)
+        return action, token
+
+    def test_dispatches_on_tenant_url_kwarg(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize-tenant', kwargs={"tenant": "globex"}))
+
+        action, token = self.get_form(response)
+        self.assertEqual("https://globex.zendesk.com", action)
+        jwt.decode(token, "globex-token", algorithms=["HS256"])
+
+    def test_dispatches_on_host(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize'), HTTP_HOST="support.acme.com:443")
+
+        action, token = self.get_form(response)
+        self.assertEqual("https://acme.zendesk.com", action)
+        self.assertEqual(["acme"], jwt.decode(token, "acme-token", algorithms=["HS256"])["tags"])
+
+    def test_falls_back_to_default_tenant_from_settings(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize'))
+
+        action, token = self.get_form(response)
+        self.assertEqual(TEST_ZENDESK_URL, action)
+        jwt.decode(token, TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+
+    def test_unknown_tenant_is_not_found(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize-tenant', kwargs={"tenant": "initech"}))
+        self.assertEqual(404, response.status_code)
+
+    def test_async_view_dispatches_on_tenant_url_kwarg(self):
+        response = self.client.get(reverse('zendesk-jwt-authorize-tenant-async', kwargs={"tenant": "acme"}))
+        self.assertEqual("https://acme.zendesk.com", self.get_form(response)[0])
+
+    def test_signers_are_precomputed_per_tenant(self):
+        registry = tenants.get_registry()
+        self.assertIs(signers.get_signer("acme-token"), registry.tenants["acme"].signer)
+        self.assertIs(registry, tenants.get_registry())
+
+    def test_registry_is_rebuilt_when_settings_change(self):
+        with self.settings(ZENDESK_TENANTS={"initech": {"URL": "https://initech.zendesk.com", "TOKEN": "t"}}):
+            self.assertEqual({"initech", "default"}, set(tenants.get_registry().tenants))
+        self.assertEqual({"acme", "globex", "default"}, set(tenants.get_registry().tenants))
+
+    @test.utils.override_settings(
+        ZENDESK_TENANTS_LOADER="zendesk_auth.tests.load_test_tenants", ZENDESK_TENANTS_RELOAD_INTERVAL=60)
+    def test_loader_is_reread_after_reload_interval(self):
+        load_test_tenants.tenants = {"acme": dict(TEST_TENANTS["acme"], TOKEN="old-token")}
+        self.assertEqual("old-token", tenants.get_tenant(name="acme").token)
+
+        load_test_tenants.tenants = {"acme": dict(TEST_TENANTS["acme"], TOKEN="new-token")}
+        self.assertEqual("old-token", tenants.get_tenant(name="acme").token)
+        with mock.patch.object(tenants.time, "monotonic", return_value=tenants.time.monotonic() + 61):
+            self.assertEqual("new-token", tenants.get_tenant(name="acme").token)
+
+    def test_reload_rereads_loader(self):
+        load_test_tenants.tenants = {"acme": TEST_TENANTS["acme"]}
+        with self.settings(ZENDESK_TENANTS_LOADER="zendesk_auth.tests.load_test_tenants"):
+            tenants.get_registry()
+            load_test_tenants.tenants = {"globex": TEST_TENANTS["globex"]}
+            tenants.reload()
+            self.assertEqual({"globex", "default"}, set(tenants.get_registry().tenants))
+
+    @test.utils.override_settings(ZENDESK_TENANTS_RELOAD_INTERVAL=60)
+    def test_failing_reload_keeps_previous_registry_for_another_interval(self):
+        registry = tenants.get_registry()
+        later = tenants.time.monotonic() + 61
+        with mock.patch.object(tenants, "load_tenants", side_effect=RuntimeError) as load_tenants, \
+                mock.patch.object(tenants.logger, "exception") as log_exception, \
+                mock.patch.object(tenants.time, "monotonic", return_value=later):
+            self.assertIs(registry, tenants.get_registry())
+            self.assertIs(registry, tenants.get_registry())
+        self.assertEqual(1, load_tenants.call_count)
+        self.assertEqual(1, log_exception.call_count)
+
+    def test_stale_registry_rebuilt_by_another_thread_is_not_rebuilt_again(self):
+        stale = tenants.get_registry()
+        rebuilt = tenants.reload()
+        with mock.patch.object(tenants, "load_tenants") as load_tenants:
+            self.assertIs(rebuilt, tenants._rebuild(stale))
+        self.assertFalse(load_tenants.called)
+
+    @test.utils.override_settings(ZENDESK_CLAIMS_CACHE=True)
+    def test_claims_cache_is_per_tenant(self):
+        caches["default"].clear()
+        request = test.RequestFactory().get("/")
+        request.user = User.objects.get()
+        for name in ("acme", "globex", "acme"):
+            view = TenantTagsAuthorize(request=request)
+            view.tenant = tenants.get_tenant(name=name)
+            self.assertEqual([name], view.get_claims()["tags"])
+
+
+@test.utils.override_settings(ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN)
+class IssueTokensCommandTests(test.TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            create_user("user{}".format(i), email="user{}@example.com".format(i))
+        create_user("inactive", is_active=False)
+
+    def issue(self, *args):
+        stdout = io.StringIO()
+        call_command("zendesk_auth_issue_tokens", *args, stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def assert_valid_rows(self, rows):
+        self.assertEqual(["user{}".format(i) for i in range(5)], [row["external_id"] for row in rows])
+        for row in rows:
+            payload = jwt.decode(row["jwt"], TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+            self.assertEqual(row["email"], payload["email"])
+            self.assertEqual(row["jti"], payload["jti"])
+            self.assertEqual("{}/access/jwt?jwt={}".format(TEST_ZENDESK_URL, row["jwt"]), row["url"])
+
+    def test_writes_jsonl_signed_in_process(self):
+        output = self.issue("--workers", "0", "--chunk-size", "2")
+        self.assert_valid_rows([json.loads(line) for line in output.splitlines()])
+
+    def test_writes_to_output_file(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        path = os.path.join(output_dir, "tokens.jsonl")
+
+        self.issue("--workers", "0", "--output", path)
+        with open(path) as f:
+            self.assert_valid_rows([json.loads(line) for line in f])
+
+    def test_includes_inactive_users_when_asked(self):
+        output = self.issue("--workers", "0", "--include-inactive")
+        self.assertEqual(6, len(output.splitlines()))
+
+    def test_loads_declared_relations_per_chunk(self):
+        with self.assertNumQueries(3):
+            output = self.issue(
+                "--workers", "0", "--chunk-size", "3", "--view", "zendesk_auth.tests.PrefetchedGroupTagsAuthorize")
+        self.assertEqual(5, len(output.splitlines()))
+
+
+@test.utils.override_settings(ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN)
+class IssueTokensPoolTests(test.TransactionTestCase):
+    """
+    Workers open their own database connections, so they only see committed
+    users; threads stand in for the spawned processes.
+    """
+
+    setUp = IssueTokensCommandTests.setUp
+    issue = IssueTokensCommandTests.issue
+    assert_valid_rows = IssueTokensCommandTests.assert_valid_rows
+
+    def test_workers_load_users_and_run_hooks_for_their_pk_range(self):
+        pks = list(User.objects.filter(is_active=True).order_by("pk").values_list("pk", flat=True))
+        issue_range = issue_tokens.issue_range
+        with mock.patch.object(issue_tokens.Command, "get_pool", lambda self, workers:
+                               concurrent.futures.ThreadPoolExecutor(workers)), \
+                mock.patch.object(issue_tokens, "issue_range", wraps=issue_range) as worker:
+            output = self.issue("--workers", "2", "--chunk-size", "2", "--format", "csv")
+
+        self.assert_valid_rows(list(csv.DictReader(io.StringIO(output))))
+        self.assertEqual([(pks[0], pks[1]), (pks[2], pks[3]), (pks[4], pks[4])],
+                         [call.args[1] for call in worker.call_args_list])
+
+    def test_pool_spawns_workers_that_set_up_django(self):
+        with issue_tokens.Command().get_pool(1) as pool:
+            self.assertEqual("spawn", pool._mp_context.get_start_method())
+            self.assertEqual(django.setup, pool._initializer)
+
+
+class StubZendeskHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((self.path, dict(self.headers), json.loads(body)))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        content = json.dumps({"job_status": {"id": str(len(self.server.received))}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class UserSyncTests(test.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubZendeskHandler)
+        self.server.received, self.server.statuses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        override = self.settings(
+            ZENDESK_URL="http://127.0.0.1:{}".format(self.server.server_port), ZENDESK_TOKEN=TEST_ZENDESK_TOKEN,
+            ZENDESK_API_EMAIL="agent@example.com", ZENDESK_API_TOKEN="api-token",
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        User.objects.bulk_create([
+            User(username="user{}".format(i), email="user{}@example.com".format(i)) for i in range(5)])
+
+    def run_sync(self, **kwargs):
+        user_sync = sync.UserSync(views.ZendeskJWTAuthorize, **kwargs)
+        self.addCleanup(user_sync.transport.close)
+        return user_sync.run(User.objects.order_by("pk"))
+
+    def pushed_users(self):
+        return [user["external_id"] for path, headers, body in self.server.received for user in body["users"]]
+
+    def test_pushes_users_to_create_or_update_many_with_api_token(self):
+        self.assertEqual({"checked": 5, "pushed": 5, "batches": 1}, self.run_sync())
+
+        path, headers, body = self.server.received[0]
+        self.assertEqual(sync.CREATE_OR_UPDATE_MANY_PATH, path)
+        self.assertEqual("Basic YWdlbnRAZXhhbXBsZS5jb20vdG9rZW46YXBpLXRva2Vu", headers["Authorization"])
+        self.assertEqual(
+            {"email": "user0@example.com", "name": "user0", "external_id": "user0"}, body["users"][0])
+
+    def test_pushes_batches_of_at_most_100(self):
+        User.objects.bulk_create([User(username="bulk{}".format(i)) for i in range(245)])
+        self.assertEqual({"checked": 250, "pushed": 250, "batches": 3}, self.run_sync(batch_size=500, chunk_size=70))
+        self.assertEqual([100, 100, 50], [len(body["users"]) for path, headers, body in self.server.received])
+        self.assertEqual(250, SyncedUser.objects.filter(tenant="default").count())
+
+    def test_only_pushes_users_whose_claims_changed(self):
+        self.run_sync()
+        self.assertEqual({"checked": 5, "pushed": 0, "batches": 0}, self.run_sync())
+
+        User.objects.filter(username="user3").update(email="new@example.com")
+        self.assertEqual({"checked": 5, "pushed": 1, "batches": 1}, self.run_sync())
+        self.assertEqual("new@example.com", self.server.received[-1][2]["users"][0]["email"])
+
+    def test_force_pushes_unchanged_users(self):
+        self.run_sync()
+        self.assertEqual(5, self.run_sync(force=True)["pushed"])
+
+    def test_retries_rate_limited_and_server_errors(self):
+        self.server.statuses = [429, 503]
+        with mock.patch.object(sync.HTTPTransport, "sleep") as sleep:
+            self.assertEqual(5, self.run_sync()["pushed"])
+        self.assertEqual(2, sleep.call_count)
+        self.assertEqual(3, len(self.server.received))
+
+    def test_retry_after_may_be_seconds_or_an_http_date(self):
+        transport = sync.HTTPTransport("http://127.0.0.1:1", "agent@example.com", "api-token", backoff=0.5)
+        in_a_minute = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+
+        self.assertEqual(7.0, transport._delay(0, {"Retry-After": "7"}))
+        self.assertAlmostEqual(60, transport._delay(0, {"Retry-After": email.utils.format_datetime(in_a_minute)}),
+                               delta=2)
+        self.assertEqual(0.0, transport._delay(0, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}))
+        self.assertEqual(1.0, transport._delay(1, {"Retry-After": "soon"}))
+        self.assertEqual(2.0, transport._delay(2, {}))
+
+    def test_does_not_store_hashes_when_zendesk_rejects_batch(self):
+        self.server.statuses = [422]
+        with self.assertRaises(sync.TransportError):
+            self.run_sync()
+        self.assertFalse(SyncedUser.objects.exists())
+
+    def test_resumes_from_checkpoint_after_failure(self):
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir)
+        checkpoint = os.path.join(checkpoint_dir, "sync.json")
+
+        self.server.statuses = [200, 400]
+        with self.assertRaises(sync.TransportError):
+            self.run_sync(checkpoint=checkpoint, batch_size=2, chunk_size=2)
+        self.assertEqual(["user0", "user1", "user2", "user3"], self.pushed_users())
+
+        self.server.received = []
+        self.assertEqual(3, self.run_sync(checkpoint=checkpoint, batch_size=2, chunk_size=2)["checked"])
+        self.assertEqual(["user2", "user3", "user4"], self.pushed_users())
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoints_last_pushed_user_when_batches_carry_over_chunks(self):
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir)
+        checkpoint = os.path.join(checkpoint_dir, "sync.json")
+
+        self.server.statuses = [200, 200, 400]
+        with self.assertRaises(sync.TransportError):
+            self.run_sync(checkpoint=checkpoint, batch_size=2, chunk_size=3)
+        self.assertEqual(["user0", "user1", "user2", "user3", "user4"], self.pushed_users())
+
+        self.server.received = []
+        self.assertEqual(1, self.run_sync(checkpoint=checkpoint, batch_size=2, chunk_size=3)["checked"])
+        self.assertEqual(["user4"], self.pushed_users())
+
+    def test_management_command(self):
+        stdout = io.StringIO()
+        call_command("zendesk_auth_sync", stdout=stdout)
+        self.assertEqual("Checked 5 users, pushed 5 in 1 batches\n", stdout.getvalue())
+
+
+class SettingsChecksTests(test.SimpleTestCase):
+
+    def check_ids(self):
+        return [message.id for message in checks.check_settings()]
+
+    @test.utils.override_settings(ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN="token")
+    def test_valid_settings_pass(self):
+        self.assertEqual([], self.check_ids())
+        self.assertEqual([], django_checks.run_checks(tags=["zendesk_auth"]))
+
+    @test.utils.override_settings(ZENDESK_URL=None)
+    def test_requires_url_or_tenants(self):
+        self.assertEqual(["zendesk_auth.E001"], self.check_ids())
+
+    @test.utils.override_settings(ZENDESK_URL="mycompany.zendesk.com", ZENDESK_TOKEN="token")
+    def test_requires_absolute_url(self):
+        self.assertEqual(["zendesk_auth.E002"], self.check_ids())
+
+    @test.utils.override_settings(ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN="")
+    def test_requires_token(self):
+        self.assertEqual(["zendesk_auth.E003"], self.check_ids())
+
+    @test.utils.override_settings(ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN="token")
+    def test_warns_about_http(self):
+        self.assertEqual(["zendesk_auth.W001"], self.check_ids())
+
+    @test.utils.override_settings(ZENDESK_URL="https://mycompany.zendesk.com/", ZENDESK_TOKEN="token")
+    def test_warns_about_trailing_slash(self):
+        self.assertEqual(["zendesk_auth.W002"], self.check_ids())
+
+    @test.utils.override_settings(
+        ZENDESK_URL=None, ZENDESK_TENANTS={"acme": {"URL": "https://acme.zendesk.com", "TOKEN": ""}})
+    def test_checks_tenants(self):
+        self.assertEqual(["zendesk_auth.E003"], self.check_ids())
+
+    @test.utils.override_settings(ZENDESK_URL=None, ZENDESK_TENANTS_LOADER="zendesk_auth.tests.load_test_tenants")
+    def test_loaded_tenants_are_not_checked(self):
+        self.assertEqual([], self.check_ids())
+
+    @test.utils.override_settings(
+        ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN="token", ZENDESK_SESSION_CLAIMS="later")
+    def test_checks_session_claims_mode(self):
+        self.assertEqual(["zendesk_auth.E004"], self.check_ids())
+
+    @test.utils.override_settings(
+        ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN="token", ZENDESK_SESSION_CLAIMS="thread")
+    def test_thread_session_claims_need_middleware(self):
+        self.assertEqual(["zendesk_auth.W003"], self.check_ids())
+        with self.modify_settings(MIDDLEWARE={"append": "zendesk_auth.session_claims.SessionClaimsMiddleware"}):
+            self.assertEqual([], self.check_ids())
+
+    @test.utils.override_settings(
+        ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN="token", ZENDESK_PROFILE_SIGNAL="SIGUSR2")
+    def test_warns_about_profile_signals_app_servers_handle(self):
+        self.assertEqual(["zendesk_auth.W004"], self.check_ids())
+        with self.settings(ZENDESK_PROFILE_SIGNAL="SIGRTMIN"):
+            self.assertEqual([], self.check_ids())
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_PRECOMPILED_TEMPLATE=True)
+class WarmupTests(test.SimpleTestCase):
+
+    def test_builds_precompiled_template_and_registry(self):
+        rendering._get_precompiled_template.cache_clear()
+        warmup.warmup()
+
+        self.assertEqual(1, rendering._get_precompiled_template.cache_info().currsize)
+        self.assertIsNotNone(tenants._registry)
+        self.assertEqual(TEST_ZENDESK_TOKEN, tenants._registry.tenants["default"].signer.key)
+
+    def test_first_request_reuses_warmed_template(self):
+        rendering._get_precompiled_template.cache_clear()
+        warmup.warmup()
+        view = views.ZendeskJWTAuthorize.for_user(User(username="joe"))
+        view.render_to_response(
+            {"zendesk_url": TEST_ZENDESK_URL, "zendesk_origin": TEST_ZENDESK_URL, "jwt_string": "abc", "return_to": ""})
+        self.assertEqual(1, rendering._get_precompiled_template.cache_info().hits)
+
+    def test_logs_failing_step_and_continues(self):
+        failing = mock.Mock(side_effect=RuntimeError, __name__="failing")
+        following = mock.Mock()
+        with mock.patch.object(warmup, "WARMERS", (failing, following)):
+            with self.assertLogs("zendesk_auth.warmup", "WARNING"):
+                warmup.warmup()
+        following.assert_called_once_with()
+
+    @test.utils.override_settings(ZENDESK_CLAIMS_CACHE=True, ZENDESK_WARMUP=False)
+    def test_ready_registers_configured_claims_cache_views(self):
+        with mock.patch.object(cache, "register_configured_views") as register_configured_views, \
+                mock.patch.object(os, "register_at_fork"):
+            django_apps.get_app_config("zendesk_auth").ready()
+        register_configured_views.assert_called_once_with()
+
+    @test.utils.override_settings(ZENDESK_CLAIMS_CACHE=True)
+    def test_reset_after_fork_drops_connection_holders(self):
+        claims_cache = cache.get_claims_cache()
+        warmup.reset_after_fork()
+        self.assertIsNot(claims_cache, cache.get_claims_cache())
+
+
+class ProfilingTests(test.TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+    def profile_settings(self, **kwargs):
+        kwargs.setdefault("ZENDESK_PROFILE_DIR", self.profile_dir)
+        kwargs.setdefault("ZENDESK_PROFILE_POLL_INTERVAL", 0)
+        return self.settings(**kwargs)
+
+    def get_dumps(self, suffix=".prof"):
+        return sorted(name for name in os.listdir(self.profile_dir) if name.endswith(suffix))
+
+    def test_sampled_request_is_dumped_in_pstats_format(self):
+        with self.profile_settings(ZENDESK_PROFILE_SAMPLE_RATE=1.0):
+            response = self.client.get("/zendesk-jwt-authorize/")
+
+        self.assertEqual(200, response.status_code)
+        [dump] = self.get_dumps()
+        self.assertTrue(dump.endswith("-ZendeskJWTAuthorize.prof"))
+        stats = pstats.Stats(os.path.join(self.profile_dir, dump))
+        functions = {name for filename, line, name in stats.stats}
+        self.assertIn("get_jwt_string", functions)
+        self.assertIn("render", functions)
+
+    def test_unsampled_requests_are_not_dumped(self):
+        with self.profile_settings():
+            self.client.get("/zendesk-jwt-authorize/")
+        self.assertEqual([], self.get_dumps())
+
+    def test_armed_profiler_dumps_next_requests(self):
+        with self.profile_settings():
+            profiling.get_profiler().arm(2)
+            for _ in range(3):
+                self.client.get("/zendesk-jwt-authorize/")
+        self.assertEqual(2, len(self.get_dumps()))
+
+    def test_command_arms_running_processes(self):
+        with self.profile_settings():
+            profiling.get_profiler()
+            call_command("zendesk_auth_profile", "--requests", "1", stdout=io.StringIO())
+            self.client.get("/zendesk-jwt-authorize/")
+            self.client.get("/zendesk-jwt-authorize/")
+        self.assertEqual(1, len(self.get_dumps()))
+
+    def test_command_needs_profile_dir(self):
+        with self.assertRaises(CommandError):
+            call_command("zendesk_auth_profile", stdout=io.StringIO())
+
+    def test_signal_arms_profiler(self):
+        name = "SIGRTMIN" if hasattr(signal, "SIGRTMIN") else "SIGPROF"
+        signum = getattr(signal, name)
+        previous = signal.getsignal(signum)
+        self.addCleanup(signal.signal, signum, previous)
+        with self.profile_settings(ZENDESK_PROFILE_SIGNAL=name, ZENDESK_PROFILE_SIGNAL_REQUESTS=1):
+            profiling.install_signal_handler()
+            os.kill(os.getpid(), signum)
+            self.client.get("/zendesk-jwt-authorize/")
+            self.client.get("/zendesk-jwt-authorize/")
+        self.assertEqual(1, len(self.get_dumps()))
+
+    def test_memory_snapshot_is_dumped(self):
+        with self.profile_settings(ZENDESK_PROFILE_SAMPLE_RATE=1.0, ZENDESK_PROFILE_MEMORY=True):
+            self.client.get("/zendesk-jwt-authorize/")
+
+        [dump] = self.get_dumps(".tracemalloc")
+        snapshot = tracemalloc.Snapshot.load(os.path.join(self.profile_dir, dump))
+        self.assertTrue(snapshot.traces)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_keeps_newest_dumps(self):
+        with self.profile_settings(ZENDESK_PROFILE_SAMPLE_RATE=1.0, ZENDESK_PROFILE_MAX_DUMPS=2):
+            for _ in range(4):
+                self.client.get("/zendesk-jwt-authorize/")
+        self.assertEqual(["000002", "000003"], [name.split("-")[2] for name in self.get_dumps()])
+
+    def test_failed_dump_is_logged_not_raised(self):
+        path = os.path.join(self.profile_dir, "not-a-directory")
+        open(path, "w").close()
+        with self.profile_settings(ZENDESK_PROFILE_DIR=path, ZENDESK_PROFILE_SAMPLE_RATE=1.0):
+            with self.assertLogs("zendesk_auth.profiling", "ERROR"):
+                response = self.client.get("/zendesk-jwt-authorize/")
+            self.assertEqual(200, response.status_code)
+            self.assertFalse(profiling.get_profiler()._busy.locked())
+
+    def test_failed_render_stops_profile(self):
+        rendered_content = mock.PropertyMock(side_effect=RuntimeError)
+        with self.profile_settings(ZENDESK_PROFILE_SAMPLE_RATE=1.0):
+            with mock.patch.object(instrumentation.TimedTemplateResponse, "rendered_content", rendered_content):
+                with self.assertRaises(RuntimeError):
+                    self.client.get("/zendesk-jwt-authorize/")
+            self.assertFalse(profiling.get_profiler()._busy.locked())
+        self.assertEqual(1, len(self.get_dumps()))
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(profiling.get_profiler())
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_SESSION_CLAIMS="inline")
+class SessionClaimsTests(test.TestCase):
+
+    def setUp(self):
+        self.user = create_user("test", first_name="Joe", password="pswd")
+
+    def login(self):
+        self.client.login(username='test', password='pswd')
+        return self.client.session[session_claims.SESSION_KEY]
+
+    def get_payload(self, url="/zendesk-jwt-authorize/"):
+        response = self.client.get(url)
+        token = re.search(r'name="jwt" value="([^"]+)"', response.content.decode()).group(1)
+        return jwt.decode(token, TEST_ZENDESK_TOKEN, algorithms=["HS256"])
+
+    def test_login_stores_compact_claims(self):
+        entry = self.login()
+        self.assertEqual({"email": "test@example.com", "name": "Joe", "external_id": "test"}, entry["c"])
+        self.assertEqual(cache.get_claims_version(views.ZendeskJWTAuthorize), entry["v"])
+        self.assertEqual(str(self.user.pk), entry["u"])
+        self.assertEqual("default", entry["n"])
+
+    def test_authorize_uses_session_claims(self):
+        self.login()
+        with mock.patch.object(views.ZendeskJWTAuthorize, "compute_claims") as compute_claims:
+            payload = self.get_payload()
+        compute_claims.assert_not_called()
+        self.assertEqual("Joe", payload["name"])
+        self.assertEqual("test@example.com", payload["email"])
+
+    @test.utils.override_settings(ZENDESK_SESSION_CLAIMS_VIEW="zendesk_auth.views.AsyncZendeskJWTAuthorize")
+    def test_async_authorize_uses_session_claims(self):
+        self.login()
+        with mock.patch.object(views.AsyncZendeskJWTAuthorize, "acompute_claims") as acompute_claims:
+            payload = self.get_payload("/zendesk-jwt-authorize/async/")
+        acompute_claims.assert_not_called()
+        self.assertEqual("Joe", payload["name"])
+
+    def test_stale_claims_are_recomputed(self):
+        self.login()
+        with self.settings(ZENDESK_SESSION_CLAIMS_MAX_AGE=-1):
+            with mock.patch.object(views.ZendeskJWTAuthorize, "compute_claims", return_value={"name": "Fresh"}):
+                self.assertEqual("Fresh", self.get_payload()["name"])
+
+    def test_claims_of_other_views_users_and_tenants_are_ignored(self):
+        entry = self.login()
+        view = views.ZendeskJWTAuthorize.for_user(self.user)
+        self.assertEqual(entry["c"], session_claims.fresh_claims(view, entry))
+        self.assertIsNone(session_claims.fresh_claims(GroupTagsAuthorize.for_user(self.user), entry))
+        self.assertIsNone(session_claims.fresh_claims(view, dict(entry, u="0")))
+        self.assertIsNone(session_claims.fresh_claims(view, dict(entry, n="acme")))
+
+    def test_failing_hook_is_logged_and_does_not_break_login(self):
+        with mock.patch.object(views.ZendeskJWTAuthorize, "get_organization", side_effect=RuntimeError):
+            with self.assertLogs("zendesk_auth.session_claims", "ERROR"):
+                self.assertTrue(self.client.login(username='test', password='pswd'))
+        self.assertNotIn(session_claims.SESSION_KEY, self.client.session)
+        self.assertEqual("Joe", self.get_payload()["name"])
+
+    @test.utils.override_settings(ZENDESK_SESSION_CLAIMS=None)
+    def test_disabled_by_default(self):
+        self.client.login(username='test', password='pswd')
+        self.assertNotIn(session_claims.SESSION_KEY, self.client.session)
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_SESSION_CLAIMS="thread")
+class ThreadedSessionClaimsTests(test.TransactionTestCase):
+
+    def setUp(self):
+        self.user = create_user("test")
+        self.request = test.RequestFactory().post("/login/")
+        SessionMiddleware(lambda request: HttpResponse()).process_request(self.request)
+
+    def test_claims_computed_in_thread_are_joined_into_session(self):
+        session_claims.precompute_claims(None, self.request, self.user)
+        self.assertNotIn(session_claims.SESSION_KEY, self.request.session)
+
+        session_claims.SessionClaimsMiddleware(lambda request: HttpResponse())(self.request)
+        self.assertEqual("test@example.com", self.request.session[session_claims.SESSION_KEY]["c"]["email"])
+
+    def test_late_claims_are_dropped(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(session_claims, "compute", side_effect=lambda *args: release.wait()):
+            with self.settings(ZENDESK_SESSION_CLAIMS_TIMEOUT=0.01):
+                session_claims.precompute_claims(None, self.request, self.user)
+                session_claims.join(self.request)
+        self.assertNotIn(session_claims.SESSION_KEY, self.request.session)
+
+    def test_failures_are_logged(self):
+        with mock.patch.object(session_claims, "compute", side_effect=RuntimeError):
+            with self.assertLogs("zendesk_auth.session_claims", "ERROR"):
+                session_claims.precompute_claims(None, self.request, self.user)
+                session_claims.join(self.request)
+        self.assertNotIn(session_claims.SESSION_KEY, self.request.session)
+
+
+@test.utils.override_settings(
+    ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_TENANTS=TEST_TENANTS,
+    ALLOWED_HOSTS=["*"])
+class PreconnectTests(test.TestCase):
+    preconnect = "<https://mycompany.zendesk.com>; rel=preconnect"
+
+    def setUp(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+
+    def test_authorize_page_preconnects_to_zendesk(self):
+        response = self.client.get("/zendesk-jwt-authorize/")
+        self.assertEqual(self.preconnect, response["Link"])
+        self.assertContains(response, '<link rel="preconnect" href="https://mycompany.zendesk.com" />', count=1)
+
+    @test.utils.override_settings(ZENDESK_PRECOMPILED_TEMPLATE=True)
+    def test_precompiled_page_preconnects_to_zendesk(self):
+        response = self.client.get("/acme/zendesk-jwt-authorize/")
+        self.assertEqual("<https://acme.zendesk.com>; rel=preconnect", response["Link"])
+        self.assertContains(response, '<link rel="preconnect" href="https://acme.zendesk.com" />', count=1)
+
+    def test_async_authorize_page_preconnects_to_zendesk(self):
+        response = self.client.get("/zendesk-jwt-authorize/async/")
+        self.assertEqual(self.preconnect, response["Link"])
+
+    @test.utils.override_settings(ZENDESK_PRECONNECT=False)
+    def test_header_can_be_turned_off(self):
+        self.assertNotIn("Link", self.client.get("/zendesk-jwt-authorize/"))
+
+    @test.utils.override_settings(ZENDESK_RESPONSE_MODE="redirect")
+    def test_redirects_have_no_header(self):
+        self.assertNotIn("Link", self.client.get("/zendesk-jwt-authorize/"))
+
+    def test_middleware_preconnects_html_pages_to_the_hosts_tenant(self):
+        middleware = hints.PreconnectMiddleware(lambda request: HttpResponse())
+        request = test.RequestFactory().get("/", HTTP_HOST="support.acme.com")
+        response = HttpResponse(headers={"Link": "</app.css>; rel=preload; as=style"})
+
+        self.assertEqual("</app.css>; rel=preload; as=style, <https://acme.zendesk.com>; rel=preconnect",
+                         middleware.process_response(request, response)["Link"])
+        self.assertNotIn("Link", middleware.process_response(request, JsonResponse({})))
+
+    def test_middleware_ignores_unknown_hosts(self):
+        middleware = hints.PreconnectMiddleware(lambda request: HttpResponse())
+        request = test.RequestFactory().get("/", HTTP_HOST="bad host")
+        self.assertNotIn("Link", middleware.process_response(request, HttpResponse()))
+
+
+@test.utils.override_settings(
+    ZENDESK_URL="https://mycompany.zendesk.com", ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_TENANTS=TEST_TENANTS)
+class EarlyHintsTests(test.SimpleTestCase):
+
+    def call(self, path, host=b"testserver", extensions=None):
+        messages = []
+        app = mock.AsyncMock()
+        scope = {"type": "http", "path": path, "headers": [(b"host", host)],
+                 "extensions": {hints.EARLY_HINT: {}} if extensions is None else extensions}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(hints.EarlyHintsMiddleware(app))(scope, None, send)
+        app.assert_awaited_once_with(scope, None, send)
+        return messages
+
+    def test_sends_early_hint_for_authorize_views(self):
+        self.assertEqual([{"type": hints.EARLY_HINT, "links": [b"<https://mycompany.zendesk.com>; rel=preconnect"]}],
+                         self.call("/zendesk-jwt-authorize/"))
+
+    def test_hints_the_tenants_origin(self):
+        self.assertEqual([b"<https://acme.zendesk.com>; rel=preconnect"],
+                         self.call("/zendesk-jwt-authorize/async/", host=b"support.acme.com:443")[0]["links"])
+        self.assertEqual([b"<https://globex.zendesk.com>; rel=preconnect"],
+                         self.call("/globex/zendesk-jwt-authorize/")[0]["links"])
+
+    def test_skips_other_paths_and_servers_without_the_extension(self):
+        self.assertEqual([], self.call("/zendesk-jwt-token/"))
+        self.assertEqual([], self.call("/nowhere/"))
+        self.assertEqual([], self.call("/zendesk-jwt-authorize/", extensions={}))
+
+    @test.utils.override_settings(ZENDESK_PRECONNECT=False)
+    def test_can_be_turned_off(self):
+        self.assertEqual([], self.call("/zendesk-jwt-authorize/"))
+
+
+class SlowClaimsAuthorize(views.ZendeskJWTAuthorize):
+    organization_delay = 0.2
+    tags_delay = 0.2
+
+    def get_organization(self):
+        time.sleep(self.organization_delay)
+        return "Acme"
+
+    def get_tags(self):
+        time.sleep(self.tags_delay)
+        return "vip"
+
+
+class FailingClaimsAuthorize(views.ZendeskJWTAuthorize):
+
+    def get_organization(self):
+        raise ConnectionError("CRM is down")
+
+
+class AsyncSlowClaimsAuthorize(views.AsyncZendeskJWTAuthorize):
+    delay = 0.2
+
+    async def get_organization(self):
+        await asyncio.sleep(self.delay)
+        return "Acme"
+
+    def get_tags(self):
+        time.sleep(self.delay)
+        return "vip"
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN,
+    ZENDESK_CONCURRENT_CLAIMS=("organization", "tags"))
+class ClaimResolutionTests(test.SimpleTestCase):
+
+    def setUp(self):
+        self.user = User(pk=1, username="joe", email="joe@example.com")
+        self.fallbacks = []
+        claim_fallback.connect(self.on_fallback)
+        self.addCleanup(claim_fallback.disconnect, self.on_fallback)
+
+    def on_fallback(self, sender, view, claim, reason, **kwargs):
+        self.fallbacks.append((claim, reason))
+
+    def test_fallback_raises_the_given_error_outside_an_except_block(self):
+        view = SlowClaimsAuthorize.for_user(self.user)
+        error = ValueError("hook failed")
+        with self.assertRaises(ValueError) as raised:
+            resolution.fallback(view, "tags", resolution.ERROR, time.monotonic(), error)
+        self.assertIs(error, raised.exception)
+
+    def test_pool_threads_keep_persistent_connections(self):
+        with mock.patch.object(resolution, "close_old_connections") as close_old_connections:
+            self.assertEqual("value", resolution.call_hook(lambda: "value"))
+        close_old_connections.assert_called_once_with()
+
+    def test_concurrent_hooks_overlap_and_keep_hook_order(self):
+        start = time.monotonic()
+        claims = SlowClaimsAuthorize.for_user(self.user).compute_claims()
+
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(["email", "name", "external_id", "organization", "tags", "remote_photo_url"], list(claims))
+        self.assertEqual(("Acme", "vip"), (claims["organization"], claims["tags"]))
+
+    @test.utils.override_settings(ZENDESK_CONCURRENT_CLAIMS=())
+    def test_hooks_run_in_order_by_default(self):
+        with mock.patch.object(resolution, "get_executor") as get_executor:
+            claims = SlowClaimsAuthorize.for_user(self.user).compute_claims()
+        get_executor.assert_not_called()
+        self.assertEqual("Acme", claims["organization"])
+
+    @test.utils.override_settings(
+        ZENDESK_CLAIM_TIMEOUTS={"tags": 0.05}, ZENDESK_CLAIM_FALLBACKS={"tags": "fallback"},
+        ZENDESK_INSTRUMENTATION=True)
+    def test_timed_out_claim_uses_fallback(self):
+        instrumentation.get_metrics_sink.cache_clear()
+        self.addCleanup(instrumentation.get_metrics_sink.cache_clear)
+        with mock.patch.object(SlowClaimsAuthorize, "organization_delay", 0):
+            with self.assertLogs("zendesk_auth.resolution", "WARNING"):
+                claims = SlowClaimsAuthorize.for_user(self.user).compute_claims()
+
+        self.assertEqual(("Acme", "fallback"), (claims["organization"], claims["tags"]))
+        self.assertEqual([("tags", "timeout")], self.fallbacks)
+        metrics = instrumentation.get_metrics_sink().render_prometheus()
+        self.assertIn('zendesk_auth_claim_seconds_count{claim="tags",outcome="timeout"} 1', metrics)
+        self.assertIn('zendesk_auth_claim_seconds_count{claim="organization",outcome="ok"} 1', metrics)
+
+    @test.utils.override_settings(ZENDESK_CLAIM_FALLBACKS={"organization": None})
+    def test_failed_claim_can_be_omitted(self):
+        view = FailingClaimsAuthorize.for_user(self.user)
+        with self.assertLogs("zendesk_auth.resolution", "WARNING"):
+            payload = view.build_payload(view.compute_claims())
+
+        self.assertNotIn("organization", payload)
+        self.assertEqual("joe@example.com", payload["email"])
+        self.assertEqual([("organization", "error")], self.fallbacks)
+
+    @test.utils.override_settings(ZENDESK_CLAIM_FALLBACKS={"organization": None}, ZENDESK_CLAIMS_CACHE=True)
+    def test_claims_that_fell_back_are_not_cached(self):
+        caches["default"].clear()
+        view = FailingClaimsAuthorize.for_user(self.user)
+        with self.assertLogs("zendesk_auth.resolution", "WARNING"):
+            self.assertNotIn("organization", view.build_payload(view.get_claims()))
+        self.assertTrue(view.claims_partial)
+
+        with mock.patch.object(FailingClaimsAuthorize, "get_organization", return_value="Acme") as get_organization:
+            self.assertEqual("Acme", FailingClaimsAuthorize.for_user(self.user).get_claims()["organization"])
+            self.assertEqual("Acme", FailingClaimsAuthorize.for_user(self.user).get_claims()["organization"])
+        get_organization.assert_called_once_with()
+
+    @test.utils.override_settings(ZENDESK_CLAIM_FALLBACKS={"organization": None})
+    def test_claims_that_fell_back_are_not_stored_in_session(self):
+        with self.assertLogs("zendesk_auth.resolution", "WARNING"):
+            self.assertIsNone(session_claims.compute(FailingClaimsAuthorize, self.user, None))
+
+    @test.utils.override_settings(ZENDESK_CLAIM_DEFAULT_TIMEOUT=0.05)
+    def test_claims_without_fallback_raise(self):
+        with self.assertRaises(ConnectionError):
+            FailingClaimsAuthorize.for_user(self.user).compute_claims()
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            SlowClaimsAuthorize.for_user(self.user).compute_claims()
+
+    async def test_async_hooks_are_gathered(self):
+        start = time.monotonic()
+        claims = await AsyncSlowClaimsAuthorize.for_user(self.user).acompute_claims()
+
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(("Acme", "vip"), (claims["organization"], claims["tags"]))
+        self.assertEqual("email", list(claims)[0])
+
+    @test.utils.override_settings(ZENDESK_CLAIM_TIMEOUTS={"organization": 0.05},
+                                  ZENDESK_CLAIM_FALLBACKS={"organization": "Unknown"})
+    async def test_async_timed_out_claim_uses_fallback(self):
+        with self.assertLogs("zendesk_auth.resolution", "WARNING"):
+            claims = await AsyncSlowClaimsAuthorize.for_user(self.user).acompute_claims()
+        self.assertEqual(("Unknown", "vip"), (claims["organization"], claims["tags"]))
+        self.assertEqual([("organization", "timeout")], self.fallbacks)
+
+    @test.utils.override_settings(ZENDESK_CLAIM_TIMEOUTS={"organization": 0.05},
+                                  ZENDESK_CLAIM_FALLBACKS={"organization": "Unknown"}, ZENDESK_CLAIMS_CACHE=True)
+    async def test_async_claims_that_fell_back_are_not_cached(self):
+        await caches["default"].aclear()
+        with self.assertLogs("zendesk_auth.resolution", "WARNING"):
+            await AsyncSlowClaimsAuthorize.for_user(self.user).aget_claims()
+        with mock.patch.object(AsyncSlowClaimsAuthorize, "delay", 0):
+            claims = await AsyncSlowClaimsAuthorize.for_user(self.user).aget_claims()
+        self.assertEqual("Acme", claims["organization"])
+
+
+BROWSER_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+
+
+@test.utils.override_settings(
+    ZENDESK_URL=TEST_ZENDESK_URL, ZENDESK_TOKEN=TEST_ZENDESK_TOKEN, ZENDESK_ANONYMOUS_FAST_PATH=True)
+class AnonymousFastPathTests(test.TestCase):
+    authorize_url = "/zendesk-jwt-authorize/?return_to=https%3A%2F%2Fmycompany.zendesk.com%2Fhc&timestamp=1"
+
+    def setUp(self):
+        self.client = test.Client(HTTP_USER_AGENT=BROWSER_USER_AGENT)
+
+    def get_slow_response(self, method="get"):
+        with self.settings(ZENDESK_ANONYMOUS_FAST_PATH=False):
+            return getattr(self.client, method)(self.authorize_url)
+
+    def test_redirects_to_login_without_touching_the_session(self):
+        with mock.patch.object(views, "_load_user") as load_user, self.assertNumQueries(0):
+            response = self.client.get(self.authorize_url)
+
+        load_user.assert_not_called()
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(self.get_slow_response()["Location"], response["Location"])
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("Cookie", response["Vary"])
+
+    def test_head_redirects_to_login(self):
+        response = self.client.head(self.authorize_url)
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(self.get_slow_response("head")["Location"], response["Location"])
+
+    def test_login_prefix_follows_the_active_language(self):
+        def resolve_url(login_url):
+            return "/{}{}".format(translation.get_language(), login_url)
+
+        with mock.patch.object(fastpath, "resolve_url", side_effect=resolve_url), \
+                self.settings(LOGIN_URL="/login/"):
+            with translation.override("fr"):
+                self.assertEqual("/fr/login/?next=", fastpath.get_login_prefix())
+            with translation.override("de"):
+                self.assertEqual("/de/login/?next=", fastpath.get_login_prefix())
+
+    @test.utils.override_settings(LOGIN_URL="https://accounts.example.com/login")
+    def test_absolute_login_url_falls_back_to_login_required(self):
+        response = self.client.get(self.authorize_url)
+        self.assertEqual(302, response.status_code)
+        self.assertTrue(response["Location"].startswith("https://accounts.example.com/login?next=http"))
+
+    def test_bots_get_cacheable_empty_response(self):
+        for user_agent in ("Googlebot/2.1 (+http://www.google.com/bot.html)", "ELB-HealthChecker/2.0", ""):
+            response = self.client.get(self.authorize_url, HTTP_USER_AGENT=user_agent)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b"", response.content)
+            self.assertEqual("public, max-age=3600", response["Cache-Control"])
+            self.assertEqual("Cookie, User-Agent", response["Vary"])
+            self.assertEqual("noindex, nofollow", response["X-Robots-Tag"])
+
+    @test.utils.override_settings(ZENDESK_BOT_USER_AGENTS=["Mozilla/5.0 (compatible; Foo)", "[unbalanced"])
+    def test_bot_user_agents_are_matched_literally(self):
+        self.assertTrue(fastpath.is_bot(test.RequestFactory().get(
+            "/", HTTP_USER_AGENT="Mozilla/5.0 (compatible; Foo)")))
+        self.assertTrue(fastpath.is_bot(test.RequestFactory().get("/", HTTP_USER_AGENT="x [UNBALANCED")))
+        self.assertFalse(fastpath.is_bot(test.RequestFactory().get("/", HTTP_USER_AGENT="Mozilla/5.0 Foo")))
+
+    def test_options_lists_allowed_methods(self):
+        response = self.client.options(self.authorize_url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("GET, HEAD, OPTIONS", response["Allow"])
+
+    def test_logged_in_users_take_the_full_path(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+        response = self.client.get(self.authorize_url, HTTP_USER_AGENT="curl/8.5.0")
+        self.assertContains(response, 'name="jwt"', count=1)
+
+    def test_head_of_logged_in_user_signs_no_token(self):
+        create_user("test", password="pswd")
+        self.client.login(username='test', password='pswd')
+        with mock.patch.object(views.ZendeskJWTAuthorize, "sign_payload") as sign_payload:
+            response = self.client.head(self.authorize_url)
+        self.assertEqual(200, response.status_code)
+        sign_payload.assert_not_called()
+
+    @test.utils.override_settings(ZENDESK_ANONYMOUS_FAST_PATH=False)
+    def test_disabled_by_default(self):
+        with mock.patch.object(fastpath, "get_anonymous_response") as get_anonymous_response:
+            response = self.client.get(self.authorize_url, HTTP_USER_AGENT="Googlebot/2.1")
+        get_anonymous_response.assert_not_called()
+        self.assertEqual(302, response.status_code)
@@ -0,0 +1,181 @@
+"""
+Token-bucket throttling for the authorize views.
+
+Rates are ``"<tokens>/<period>"``, e.g. ``"30/m"`` or ``"3/10s"``; a bucket
+holds that many tokens and refills over the period. Each signed token takes
+one from every bucket that applies:
+
+* ``ZENDESK_THROTTLE_RATE`` - one bucket per user
+* ``ZENDESK_THROTTLE_GLOBAL_RATE`` - one bucket for all users
+* ``ZENDESK_THROTTLE_LOOP_RATE`` - one bucket per user and ``return_to``,
+  catching redirect loops between Zendesk and the login page
+
+When a bucket is empty the request gets ``ZENDESK_THROTTLE_RESPONSE`` and
+the ``request_throttled`` signal is sent.
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+from zendesk_auth.conf import get_setting
+from zendesk_auth.signals import request_throttled
+
+logger = logging.getLogger(__name__)
+
+RATE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """
+    Returns ``(tokens, period in seconds)`` for a rate like ``"3/10s"``.
+    """
+    match = re.fullmatch(r"(\d+)/(\d*)([smhd])[a-z]*", rate)
+    if match is None:
+        raise ImproperlyConfigured("Invalid zendesk_auth throttle rate {!r}".format(rate))
+    tokens, multiplier, unit = match.groups()
+    return int(tokens), int(multiplier or 1) * RATE_UNITS[unit]
+
+
+class LocalBuckets(object):
+    """
+    In-process token buckets for single-node deployments. The least
+    recently used buckets beyond ``maxsize`` are dropped (refilled).
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        """
+        Takes a token from ``key``'s bucket. Returns 0 if there was one,
+        else the number of seconds until there will be.
+        """
+        now = time.monotonic()
+        rate = capacity / period
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return 0 if allowed else (1 - tokens) / rate
+
+
+class CacheBuckets(object):
+    """
+    Buckets shared through a Django cache, for multi-node deployments. Uses
+    one atomic ``incr`` per take, so a bucket is refilled all at once at the
+    end of each period rather than continuously.
+    """
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, period):
+        now = time.time()
+        window = int(now // period)
+        cache_key = "zendesk_auth:throttle:{}:{}".format(key, window)
+        self.cache.add(cache_key, 0, period + 1)
+        try:
+            count = self.cache.incr(cache_key)
+        except ValueError:
+            # Expired between add and incr.
+            self.cache.set(cache_key, 1, period + 1)
+            count = 1
+        return 0 if count <= capacity else (window + 1) * period - now
+
+
+@lru_cache(maxsize=None)
+def get_buckets():
+    """
+    Returns the process wide backend named by ``ZENDESK_THROTTLE_BACKEND``.
+    """
+    return import_string(get_setting("ZENDESK_THROTTLE_BACKEND"))(**get_setting("ZENDESK_THROTTLE_OPTIONS"))
+
+
+def _user_limit(request):
+    rate = get_setting("ZENDESK_THROTTLE_RATE")
+    return ("user", "user:{}".format(request.user.pk), rate) if rate else None
+
+
+def _global_limit(request):
+    rate = get_setting("ZENDESK_THROTTLE_GLOBAL_RATE")
+    return ("global", "global", rate) if rate else None
+
+
+def _loop_limit(request):
+    rate = get_setting("ZENDESK_THROTTLE_LOOP_RATE")
+    return_to = request.GET.get("return_to")
+    if not (rate and return_to):
+        return None
+    digest = hashlib.blake2b(return_to.encode("utf-8"), digest_size=8).hexdigest()
+    return "loop", "loop:{}:{}".format(request.user.pk, digest), rate
+
+
+LIMITS = (_user_limit, _global_limit, _loop_limit)
+
+
+def get_limits(request):
+    """
+    Returns ``(scope, key, rate)`` for the buckets ``request`` takes from.
+    """
+    return [limit for limit in (get_limit(request) for get_limit in LIMITS) if limit]
+
+
+def throttled_response(request, scope, retry_after):
+    response = HttpResponse("Too many requests, try again later.", status=429, content_type="text/plain")
+    response["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def _check(view, limits):
+    buckets = get_buckets()
+    for scope, key, rate in limits:
+        retry_after = buckets.take(key, *parse_rate(rate))
+        if retry_after:
+            return _throttle(view, scope, retry_after)
+    return None
+
+
+def _throttle(view, scope, retry_after):
+    log = logger.warning if scope == "loop" else logger.info
+    log("Throttled %s (%s) for user %s", view.request.path, scope, view.request.user.pk)
+    request_throttled.send(sender=type(view), view=view, scope=scope, retry_after=retry_after)
+    return import_string(get_setting("ZENDESK_THROTTLE_RESPONSE"))(view.request, scope, retry_after)
+
+
+def check(view):
+    """
+    Returns the throttled response when ``view.request`` is over a limit,
+    else ``None``.
+    """
+    limits = get_limits(view.request)
+    return _check(view, limits) if limits else None
+
+
+async def acheck(view):
+    limits = get_limits(view.request)
+    return await sync_to_async(_check)(view, limits) if limits else None
+
+
+@receiver(setting_changed)
+def reset_buckets(setting, **kwargs):
+    if setting.startswith("ZENDESK_THROTTLE"):
+        get_buckets.cache_clear()
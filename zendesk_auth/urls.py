@@ -1,14 +1,30 @@
-import django
-if django.get_version() >= '2.0.0':
-    from django.urls import re_path as url
-else:
-    from django.conf.urls import url
+from django.urls import re_path as url
 
-from zendesk_auth.views import ZendeskJWTAuthorize
+from zendesk_auth.views import AsyncZendeskJWTAuthorize, ZendeskJWTAuthorize, ZendeskJWTToken
 
 urlpatterns = [
     url(
         r'^zendesk-jwt-authorize/$',
         ZendeskJWTAuthorize.as_view(),
         name="zendesk-jwt-authorize"),
+    url(
+        r'^zendesk-jwt-authorize/async/$',
+        AsyncZendeskJWTAuthorize.as_view(),
+        name="zendesk-jwt-authorize-async"),
+    url(
+        r'^zendesk-jwt-token/$',
+        ZendeskJWTToken.as_view(),
+        name="zendesk-jwt-token"),
+    url(
+        r'^(?P<tenant>[\w-]+)/zendesk-jwt-authorize/$',
+        ZendeskJWTAuthorize.as_view(),
+        name="zendesk-jwt-authorize-tenant"),
+    url(
+        r'^(?P<tenant>[\w-]+)/zendesk-jwt-authorize/async/$',
+        AsyncZendeskJWTAuthorize.as_view(),
+        name="zendesk-jwt-authorize-tenant-async"),
+    url(
+        r'^(?P<tenant>[\w-]+)/zendesk-jwt-token/$',
+        ZendeskJWTToken.as_view(),
+        name="zendesk-jwt-token-tenant"),
 ]
@@ -1,57 +1,237 @@
-
 import time
-import uuid
+from urllib.parse import urlencode, urlsplit
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.shortcuts import resolve_url
+from django.template.loader import render_to_string
+from django.utils.cache import add_never_cache_headers, patch_vary_headers
 from django.utils.decorators import method_decorator
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.cache import never_cache
-from django.views.generic import TemplateView
+from django.views.decorators.csrf import csrf_protect
+from django.views.generic import TemplateView, View
+from django.views.generic.base import TemplateResponseMixin
 
-import jwt
+from zendesk_auth import audit, cache, fastpath, hints, profiling, resolution, session_claims, tenants, throttling
+from zendesk_auth.claims import depends_on, get_claim_loads, loads, loads_related
+from zendesk_auth.conf import get_setting
+from zendesk_auth.instrumentation import NULL_TIMER, TimedTemplateResponse, start_timer
+from zendesk_auth.jti import get_jti_generator
+from zendesk_auth.ledger import arecord_issued, record_issued
+from zendesk_auth.payloads import prepare_payload
+from zendesk_auth.rendering import get_precompiled_template
+from zendesk_auth.signers import get_signer
 
 
-class ZendeskJWTAuthorize(TemplateView):
+class ZendeskJWTMixin(object):
     """
-    View that is hit from zendesk, makes sure user is logged in, then passes
-    information back to Zendesk to validate the authentication.
-
-    Zendesk is moving everyone to JWT Authentication:
-    https://support.zendesk.com/entries/23675367-Setting-up-single-sign-on-with-JWT-JSON-Web-Token-
+    Builds and signs the Zendesk JWT for ``self.request.user``.
 
+    Each claim comes from the ``get_*`` hook named in ``claim_hooks``.
+    Override the hooks to customize what is sent to Zendesk. With
+    ``ZENDESK_CLAIMS_CACHE`` on, claims are cached per user until a model a
+    hook declares with ``depends_on`` changes; bump ``claims_version`` when
+    hook logic changes. With ``ZENDESK_SESSION_CLAIMS`` set, claims computed
+    at login are read from the session first.
     """
-    template_name = "zendesk_auth/zendesk_auth_passthrough.html"
+    claims_version = "1"
+    timer = NULL_TIMER
+    tenant = None
+    claims_user_loaded = False
+    # Set when a claim fell back (see ``zendesk_auth.resolution``).
+    claims_partial = False
+    claim_hooks = (
+        ("email", "get_email"),
+        ("name", "get_user_name"),
+        ("external_id", "get_external_id"),
+        ("organization", "get_organization"),
+        ("tags", "get_tags"),
+        ("remote_photo_url", "get_remote_photo_url"),
+    )
 
-    def get_context_data(self, **kwargs):
-        kwargs.update(
-            zendesk_url=settings.ZENDESK_URL,
-            jwt_string=self.get_jwt_string(),
-        )
-        return kwargs
+    def __init_subclass__(cls, **kwargs):
+        super(ZendeskJWTMixin, cls).__init_subclass__(**kwargs)
+        cache.register_view(cls)
 
-    @method_decorator(never_cache)
-    @method_decorator(login_required)
-    def dispatch(self, request, *args, **kwargs):
-        return super(ZendeskJWTAuthorize, self).dispatch(request, *args, **kwargs)
+    def setup(self, request, *args, **kwargs):
+        super(ZendeskJWTMixin, self).setup(request, *args, **kwargs)
+        self.timer = start_timer()
 
-    def get_jwt_string(self):
+    @classmethod
+    def for_user(cls, user, tenant=None, **initkwargs):
+        """
+        Returns a view that builds ``user``'s token outside of a request, e.g.
+        from a management command. ``user`` must already be loaded with what
+        ``get_claims_queryset`` adds.
+        """
+        request = HttpRequest()
+        request.user = user
+        view = cls(**initkwargs)
+        view.setup(request, tenant=tenant)
+        view.tenant = tenants.get_tenant(name=tenant)
+        view.claims_user_loaded = True
+        return view
+
+    def check_throttle(self):
+        """
+        Returns a 429 response when the user is over one of the
+        ``ZENDESK_THROTTLE_*`` limits, else ``None``.
+        """
+        return throttling.check(self)
+
+    def get_claims(self):
+        claims = session_claims.get_claims(self)
+        if claims is not None:
+            return claims
+
+        claims_cache = cache.get_claims_cache()
+        if claims_cache is None:
+            return self.compute_claims()
+        return self.get_cached_claims(claims_cache)
+
+    def get_cached_claims(self, claims_cache):
+        key = self.get_claims_cache_key(claims_cache.get_generation(self.request.user.pk))
+        claims = claims_cache.get(key)
+        if claims is None:
+            claims = self.compute_claims()
+            # Fallback values shouldn't outlive the request that needed them.
+            if not self.claims_partial:
+                claims_cache.set(key, claims)
+        return claims
+
+    def compute_claims(self):
+        self.load_claims_user()
+        return resolution.resolve_claims(self)
+
+    @classmethod
+    def get_claims_queryset(cls, queryset):
+        """
+        Applies the claim hooks' ``loads`` declarations to a user queryset.
+        Returns ``None`` when they don't need anything beyond the user row.
+        """
+        if not loads_related(cls):
+            return None
+
+        declared = get_claim_loads(cls)
+        queryset = queryset.select_related(*declared["select_related"]).prefetch_related(
+            *declared["prefetch_related"])
+        if declared["only"] is not None:
+            model = queryset.model
+            queryset = queryset.only(model.USERNAME_FIELD, model.get_email_field_name(), *declared["only"])
+        return queryset
+
+    def get_claims_user_queryset(self):
+        if not loads_related(type(self)):
+            return None
+        user = self.request.user
+        return self.get_claims_queryset(type(user)._default_manager.filter(pk=user.pk))
+
+    def load_claims_user(self):
+        if self.claims_user_loaded:
+            return
+        queryset = self.get_claims_user_queryset()
+        if queryset is not None:
+            self.request.user = queryset.get()
+
+    def is_builtin_hook(self, hook):
+        """
+        Returns whether ``hook`` is still this mixin's own implementation,
+        which only reads attributes of the loaded user.
+        """
+        return getattr(type(self), hook) is getattr(ZendeskJWTMixin, hook, None)
+
+    def get_claims_cache_key(self, generation=0):
+        return cache.make_key(
+            cache.get_claims_version(type(self)), self.get_tenant().name, self.request.user.pk, generation)
+
+    def build_payload(self, claims):
         payload = {
             "iat": int(time.time()),  # issued at time
-            "jti": str(uuid.uuid1()),  # web token id
-            "email": self.get_email(),
-            "name": self.get_user_name(),
-            "external_id": self.get_external_id(),
-            "organization": self.get_organization(),
-            "tags": self.get_tags(),
-            "remote_photo_url": self.get_remote_photo_url(),
+            "jti": self.get_jti(),  # web token id
         }
-        clean_payload = {k: v for k, v in payload.items() if v}
+        payload.update(self.get_tenant().claims)
+        payload.update((k, v) for k, v in claims.items() if v)
+        return prepare_payload({k: v for k, v in payload.items() if v})
 
-        try:
-            return jwt.encode(clean_payload, settings.ZENDESK_TOKEN).decode()
-        except AttributeError:
-            return jwt.encode(clean_payload, settings.ZENDESK_TOKEN)
+    def get_jti(self):
+        return get_jti_generator()()
+
+    def sign_payload(self, payload):
+        token = get_signer(self.get_token()).sign(payload)
+        record_issued(self, payload)
+        audit.record_issued(self, payload)
+        return token
+
+    def get_jwt_string(self):
+        with self.timer.phase("claims"):
+            payload = self.build_payload(self.get_claims())
+        with self.timer.phase("sign"):
+            return self.sign_payload(payload)
+
+    def get_tenant(self):
+        """
+        Returns the ``zendesk_auth.tenants.Tenant`` this request is for.
+        """
+        if self.tenant is None:
+            kwargs = getattr(self, "kwargs", {})
+            self.tenant = tenants.get_tenant(getattr(self, "request", None), kwargs.get("tenant"))
+        return self.tenant
+
+    def get_zendesk_url(self):
+        return self.get_tenant().url
+
+    def get_return_to(self):
+        """
+        Returns the ``return_to`` Zendesk passed in, if it points at the
+        Zendesk instance or one of ``ZENDESK_RETURN_TO_HOSTS``.
+        """
+        return_to = self.request.GET.get("return_to", "")
+        zendesk_url = urlsplit(self.get_zendesk_url())
+        allowed_hosts = {zendesk_url.netloc, *get_setting("ZENDESK_RETURN_TO_HOSTS")}
+        if url_has_allowed_host_and_scheme(return_to, allowed_hosts, require_https=zendesk_url.scheme == "https"):
+            return return_to
+        return ""
+
+    def get_access_url(self, jwt_string, return_to=""):
+        """
+        Returns the ``/access/jwt`` URL that logs the user in to Zendesk with
+        a GET request.
+        """
+        params = {"jwt": jwt_string}
+        if return_to:
+            params["return_to"] = return_to
+        return "{}/access/jwt?{}".format(self.get_zendesk_url(), urlencode(params))
+
+    def add_preconnect(self, response):
+        """
+        With ``ZENDESK_PRECONNECT`` on, adds a ``Link`` header asking the
+        browser to connect to Zendesk while it reads the passthrough page.
+        """
+        if get_setting("ZENDESK_PRECONNECT"):
+            hints.add_preconnect(response, self.get_zendesk_url())
+        return response
+
+    def get_redirect_response(self, context):
+        """
+        With ``ZENDESK_RESPONSE_MODE = "redirect"``, returns a redirect
+        straight to Zendesk, skipping the POST page. Returns ``None`` (so the
+        page is rendered) otherwise or when the URL would be longer than
+        ``ZENDESK_REDIRECT_MAX_URL_LENGTH``.
+        """
+        if get_setting("ZENDESK_RESPONSE_MODE") != "redirect":
+            return None
+        url = self.get_access_url(context["jwt_string"], context["return_to"])
+        if len(url) > get_setting("ZENDESK_REDIRECT_MAX_URL_LENGTH"):
+            return None
+        return HttpResponseRedirect(url)
 
+    @depends_on(settings.AUTH_USER_MODEL)
+    @loads(only=["first_name", "last_name", "username"])
     def get_user_name(self):
         """
         Required by Zendesk remote auth API.
@@ -62,12 +242,16 @@ class ZendeskJWTAuthorize(TemplateView):
         full_name = u"{} {}".format(u.first_name, u.last_name).strip()
         return full_name or u.username
 
+    @depends_on(settings.AUTH_USER_MODEL)
+    @loads()
     def get_email(self):
         """
         Required by Zendesk remote auth API.
         """
         return self.request.user.email
 
+    @depends_on(settings.AUTH_USER_MODEL)
+    @loads()
     def get_external_id(self):
         """
         Use when username is not the unique identifier for your users and
@@ -76,12 +260,14 @@ class ZendeskJWTAuthorize(TemplateView):
         """
         return self.request.user.get_username()
 
+    @loads()
     def get_organization(self):
         """
         Use when you want to tie the user to an Organization in Zendesk
         """
         return ''
 
+    @loads()
     def get_tags(self):
         """
         Use when you want to add tags to the user's Zendesk Profile.
@@ -89,6 +275,7 @@ class ZendeskJWTAuthorize(TemplateView):
         """
         return ''
 
+    @loads()
     def get_remote_photo_url(self):
         """
         If you use this, the url must be publicly available and not behind
@@ -97,7 +284,243 @@ class ZendeskJWTAuthorize(TemplateView):
         return ''
 
     def get_token(self):
-        return settings.ZENDESK_TOKEN
+        return self.get_tenant().token
 
     def get_timestamp(self):
         return self.request.GET.get('timestamp', '')
+
+
+def _load_user(request):
+    # Touching the lazy user makes the auth middleware load the session and user.
+    return request.user.is_authenticated
+
+
+class ZendeskJWTAuthorize(ZendeskJWTMixin, TemplateView):
+    """
+    View that is hit from zendesk, makes sure user is logged in, then passes
+    information back to Zendesk to validate the authentication.
+
+    Zendesk is moving everyone to JWT Authentication:
+    https://support.zendesk.com/entries/23675367-Setting-up-single-sign-on-with-JWT-JSON-Web-Token-
+
+    """
+    template_name = "zendesk_auth/zendesk_auth_passthrough.html"
+    response_class = TimedTemplateResponse
+
+    def get_context_data(self, **kwargs):
+        kwargs.update(
+            zendesk_url=self.get_zendesk_url(),
+            zendesk_origin=hints.get_origin(self.get_zendesk_url()),
+            jwt_string=self.get_jwt_string(),
+            return_to=self.get_return_to(),
+        )
+        return kwargs
+
+    def render_to_response(self, context, **response_kwargs):
+        redirect = self.get_redirect_response(context)
+        if redirect is not None:
+            return redirect
+        return self.add_preconnect(self.render_passthrough(context, **response_kwargs))
+
+    def render_passthrough(self, context, **response_kwargs):
+        if not get_setting("ZENDESK_PRECOMPILED_TEMPLATE"):
+            response = super(ZendeskJWTAuthorize, self).render_to_response(context, **response_kwargs)
+            response.timer = self.timer
+            return response
+
+        with self.timer.phase("render"):
+            template = get_precompiled_template(self.get_template_names(), context)
+            response_kwargs.setdefault("content_type", self.content_type)
+            return template.render_to_response(context, **response_kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Runs before never_cache so bot responses stay cacheable.
+        response = fastpath.get_response(self, request, *args, **kwargs)
+        if response is not None:
+            return response
+        return self.full_dispatch(request, *args, **kwargs)
+
+    @method_decorator(never_cache)
+    def full_dispatch(self, request, *args, **kwargs):
+        profile = profiling.start(self)
+        try:
+            with self.timer.phase("auth"):
+                _load_user(request)
+            response = self.authorized_dispatch(request, *args, **kwargs)
+        except BaseException:
+            profiling.stop(profile)
+            raise
+        return profiling.attach(profile, self.timer.attach(self, response))
+
+    @method_decorator(login_required)
+    def authorized_dispatch(self, request, *args, **kwargs):
+        throttled = self.check_throttle()
+        if throttled is not None:
+            return throttled
+        return super(ZendeskJWTAuthorize, self).dispatch(request, *args, **kwargs)
+
+    def head(self, request, *args, **kwargs):
+        # HEAD responses have no body to carry the token, so don't sign one.
+        return HttpResponse()
+
+
+def _csrf_header():
+    # CSRF_HEADER_NAME is the WSGI environ key, e.g. "HTTP_X_CSRFTOKEN".
+    return settings.CSRF_HEADER_NAME[len("HTTP_"):].replace("_", "-")
+
+
+def _add_cors_headers(request, response, preflight=False):
+    patch_vary_headers(response, ["Origin"])
+    origin = request.headers.get("Origin")
+    if origin not in get_setting("ZENDESK_CORS_ORIGINS"):
+        return response
+    response["Access-Control-Allow-Origin"] = origin
+    response["Access-Control-Allow-Credentials"] = "true"
+    if preflight:
+        response["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+        response["Access-Control-Allow-Headers"] = "Content-Type, " + _csrf_header()
+        response["Access-Control-Max-Age"] = "600"
+    return response
+
+
+class ZendeskJWTToken(ZendeskJWTMixin, View):
+    """
+    Returns the token as JSON, for single-page apps that fetch it in the
+    background and open Zendesk themselves::
+
+        {"url": "<zendesk>/access/jwt?jwt=...", "jwt": "..."}
+
+    ``url`` logs in with a GET; ``jwt`` can be POSTed to
+    ``<zendesk>/access/jwt`` instead. Requests must be POSTs with a CSRF
+    token. Anonymous users get a 401 with the login URL rather than a
+    redirect. Origins in ``ZENDESK_CORS_ORIGINS`` may call it cross-origin
+    with credentials (they also need to be in ``CSRF_TRUSTED_ORIGINS``).
+    """
+    http_method_names = ["post", "options"]
+
+    @method_decorator(never_cache)
+    def dispatch(self, request, *args, **kwargs):
+        with self.timer.phase("auth"):
+            _load_user(request)
+        response = super(ZendeskJWTToken, self).dispatch(request, *args, **kwargs)
+        return self.timer.finish(self, _add_cors_headers(request, response))
+
+    @method_decorator(csrf_protect)
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse(
+                {"error": "not_authenticated", "login_url": resolve_url(settings.LOGIN_URL)}, status=401)
+        throttled = self.check_throttle()
+        if throttled is not None:
+            return throttled
+
+        jwt_string = self.get_jwt_string()
+        return JsonResponse({"url": self.get_access_url(jwt_string, self.get_return_to()), "jwt": jwt_string})
+
+    def options(self, request, *args, **kwargs):
+        response = super(ZendeskJWTToken, self).options(request, *args, **kwargs)
+        return _add_cors_headers(request, response, preflight=True)
+
+
+async def _get_user(request):
+    if hasattr(request, "auser"):
+        return await request.auser()
+    return await sync_to_async(get_user)(request)
+
+
+class AsyncZendeskJWTAuthorize(ZendeskJWTMixin, TemplateResponseMixin, View):
+    """
+    Async counterpart of ``ZendeskJWTAuthorize`` for ASGI deployments. The
+    user and session are loaded with ``request.auser()`` and the page is
+    rendered inline, so no request is handed to a thread.
+
+    Claim hooks may be sync or ``async def``. Overridden sync hooks run in a
+    thread through ``sync_to_async``, so they may use the ORM; async hooks
+    with the async ORM API (``aget``, ``afirst``, ``async for``...) avoid the
+    thread hop.
+    """
+    template_name = "zendesk_auth/zendesk_auth_passthrough.html"
+
+    async def get(self, request, *args, **kwargs):
+        return await self.arespond(request, self.aget_response, **kwargs)
+
+    async def head(self, request, *args, **kwargs):
+        # HEAD responses have no body to carry the token, so don't sign one.
+        return await self.arespond(request, self.ahead_response, **kwargs)
+
+    async def arespond(self, request, get_response, **kwargs):
+        with self.timer.phase("auth"):
+            user = await _get_user(request)
+        if not user.is_authenticated:
+            return self.timer.finish(self, redirect_to_login(request.get_full_path()))
+
+        request.user = user
+        response = await throttling.acheck(self)
+        if response is None:
+            response = await get_response(**kwargs)
+        add_never_cache_headers(response)
+        return self.timer.finish(self, response)
+
+    async def ahead_response(self, **kwargs):
+        return HttpResponse()
+
+    async def aget_response(self, **kwargs):
+        context = await self.aget_context_data(**kwargs)
+        response = self.get_redirect_response(context)
+        if response is None:
+            with self.timer.phase("render"):
+                response = self.add_preconnect(self.render_passthrough(context))
+        return response
+
+    async def aget_context_data(self, **kwargs):
+        kwargs.update(
+            zendesk_url=self.get_zendesk_url(),
+            zendesk_origin=hints.get_origin(self.get_zendesk_url()),
+            jwt_string=await self.aget_jwt_string(),
+            return_to=self.get_return_to(),
+        )
+        return kwargs
+
+    async def aget_claims(self):
+        claims = await session_claims.aget_claims(self)
+        if claims is not None:
+            return claims
+
+        claims_cache = cache.get_claims_cache()
+        if claims_cache is None:
+            return await self.acompute_claims()
+        return await self.aget_cached_claims(claims_cache)
+
+    async def aget_cached_claims(self, claims_cache):
+        key = self.get_claims_cache_key(await claims_cache.aget_generation(self.request.user.pk))
+        claims = await claims_cache.aget(key)
+        if claims is None:
+            claims = await self.acompute_claims()
+            if not self.claims_partial:
+                await claims_cache.aset(key, claims)
+        return claims
+
+    async def acompute_claims(self):
+        queryset = None if self.claims_user_loaded else self.get_claims_user_queryset()
+        if queryset is not None:
+            self.request.user = await queryset.aget()
+
+        return await resolution.aresolve_claims(self)
+
+    async def aget_jwt_string(self):
+        with self.timer.phase("claims"):
+            payload = self.build_payload(await self.aget_claims())
+        with self.timer.phase("sign"):
+            return await self.asign_payload(payload)
+
+    async def asign_payload(self, payload):
+        token = get_signer(self.get_token()).sign(payload)
+        await arecord_issued(self, payload)
+        audit.record_issued_nowait(self, payload)
+        return token
+
+    def render_passthrough(self, context):
+        template_names = self.get_template_names()
+        if get_setting("ZENDESK_PRECOMPILED_TEMPLATE"):
+            return get_precompiled_template(template_names, context).render_to_response(context)
+        return HttpResponse(render_to_string(template_names, context, self.request))
@@ -0,0 +1,71 @@
+"""
+One-time costs of the first login, paid in ``ZendeskAuthConfig.ready()``
+instead: loading and compiling the passthrough template (and its
+precompiled form), building the tenant registry and each tenant's signer,
+signing a throwaway payload and merging the views' claim declarations.
+
+State that holds connections, locks or threads, like the claims cache,
+ledger, throttle buckets, profiler and thread pools, is not warmed, and is
+rebuilt in forked children so workers started with ``gunicorn --preload``
+don't share them.
+"""
+import logging
+
+from django.template.loader import select_template
+
+from zendesk_auth import cache, ledger, profiling, resolution, session_claims, tenants, throttling
+from zendesk_auth.claims import get_claim_loads
+from zendesk_auth.conf import get_setting
+from zendesk_auth.jti import get_jti_generator
+from zendesk_auth.rendering import get_precompiled_template
+
+logger = logging.getLogger(__name__)
+
+# Context of the passthrough page on the untenanted routes.
+CONTEXT_FIELDS = ("jwt_string", "return_to", "zendesk_origin", "zendesk_url")
+
+
+def warm_templates():
+    from zendesk_auth.views import ZendeskJWTAuthorize
+
+    template_names = [ZendeskJWTAuthorize.template_name]
+    select_template(template_names)
+    if get_setting("ZENDESK_PRECOMPILED_TEMPLATE"):
+        get_precompiled_template(template_names, CONTEXT_FIELDS)
+
+
+def warm_signers():
+    for tenant in tenants.get_registry().tenants.values():
+        tenant.signer.sign({"iat": 0, "jti": get_jti_generator()()})
+
+
+def warm_claims():
+    from zendesk_auth.views import AsyncZendeskJWTAuthorize, ZendeskJWTAuthorize, ZendeskJWTToken
+
+    for view_class in (ZendeskJWTAuthorize, AsyncZendeskJWTAuthorize, ZendeskJWTToken):
+        get_claim_loads(view_class)
+
+
+WARMERS = (warm_templates, warm_signers, warm_claims)
+
+
+def warmup():
+    """
+    Runs every warmer. A failing warmer is logged, not raised, so a
+    misconfiguration surfaces in the system checks or the first request
+    rather than stopping the process from starting.
+    """
+    for warmer in WARMERS:
+        try:
+            warmer()
+        except Exception:
+            logger.warning("zendesk_auth warmup step %s failed", warmer.__name__, exc_info=True)
+
+
+def reset_after_fork():
+    cache.get_claims_cache.cache_clear()
+    ledger.get_ledger.cache_clear()
+    throttling.get_buckets.cache_clear()
+    profiling.get_profiler.cache_clear()
+    session_claims.get_executor.cache_clear()
+    resolution.get_executor.cache_clear()